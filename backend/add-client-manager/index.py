@@ -1,18 +1,17 @@
 import json
-from utils import OPTIONS_RESPONSE, ok, err, db, resolve_actor
+from utils import OPTIONS_RESPONSE, ok, err, db, RequestContext, instrumented
 import repository as repo
 import service
 
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
+@instrumented
 def handler(event, context):
     """Управление клиентами и заказами: добавление, редактирование, удаление, оформление заказов"""
     if event.get('httpMethod') == 'OPTIONS':
         return OPTIONS_RESPONSE
 
-    actor = resolve_actor(event)
-
     if event.get('httpMethod') == 'DELETE':
         params = event.get('queryStringParameters') or {}
         if params.get('order_id'):
@@ -32,13 +31,15 @@ def handler(event, context):
     action = body.get('action', '')
 
     if action == 'create_order':
-        return _handle_create_order(body, actor)
+        with RequestContext(event) as ctx:
+            return _handle_create_order(body, ctx)
     if action == 'save_magnet_comment':
         return _handle_save_magnet_comment(body)
     if action == 'update_client_comment':
         return _handle_update_client_comment(body)
 
-    return _handle_add_client(body, actor)
+    with RequestContext(event) as ctx:
+        return _handle_add_client(body, ctx)
 
 
 def _handle_delete_order(params):
@@ -47,16 +48,13 @@ def _handle_delete_order(params):
         return err('Укажите order_id')
     return_magnets = params.get('return_magnets') == '1'
     return_bonuses = params.get('return_bonuses') == '1'
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute("SELECT id FROM %s.orders WHERE id = %d" % (SCHEMA, int(order_id)))
         if not cur.fetchone():
             return err('Заказ не найден', 404)
         result = service.delete_order(cur, conn, int(order_id), return_magnets, return_bonuses)
         return ok(result)
-    finally:
-        conn.close()
 
 
 def _handle_delete_client(event):
@@ -65,16 +63,13 @@ def _handle_delete_client(event):
     if not client_id or not client_id.isdigit():
         return err('Укажите id клиента')
     return_magnets = params.get('return_magnets') == '1'
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         if not repo.find_registration(cur, int(client_id)):
             return err('Клиент не найден', 404)
         repo.soft_remove_client(cur, int(client_id), return_magnets=return_magnets)
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
 
 
 def _handle_update_client(body):
@@ -85,18 +80,15 @@ def _handle_update_client(body):
     phone = (body.get('phone') or '').strip()
     if not name and not phone:
         return err('Укажите имя или телефон')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         if not repo.find_registration(cur, int(client_id)):
             return err('Клиент не найден', 404)
         result = service.update_client(cur, conn, int(client_id), name, phone)
         return ok(result)
-    finally:
-        conn.close()
 
 
-def _handle_create_order(body, actor):
+def _handle_create_order(body, ctx):
     order_number = (body.get('order_number') or '').strip()
     channel = (body.get('channel') or '').strip() or 'Ozon'
     amount = body.get('amount', 0)
@@ -107,9 +99,10 @@ def _handle_create_order(body, actor):
     except (ValueError, TypeError):
         amount = 0
 
-    conn = db()
+    conn = ctx.conn
     try:
         cur = conn.cursor()
+        actor = ctx.actor
         if client_id:
             result = service.create_order_for_client(cur, conn, int(client_id), order_number, channel, amount)
         else:
@@ -125,16 +118,13 @@ def _handle_create_order(body, actor):
         return ok(result)
     except service.ClientError as e:
         return err(str(e), e.status)
-    finally:
-        conn.close()
 
 
 def _handle_update_order(body):
     order_id = body.get('order_id')
     if not order_id or not str(order_id).isdigit():
         return err('Укажите order_id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute("SELECT id FROM %s.orders WHERE id = %d" % (SCHEMA, int(order_id)))
         if not cur.fetchone():
@@ -163,8 +153,6 @@ def _handle_update_order(body):
             'channel': row[3], 'status': row[4], 'created_at': str(row[5]),
             'comment': row[6], 'magnet_comment': row[7],
         }})
-    finally:
-        conn.close()
 
 
 def _handle_update_client_comment(body):
@@ -172,8 +160,7 @@ def _handle_update_client_comment(body):
     comment = (body.get('comment') or '').strip()
     if not client_id or not str(client_id).isdigit():
         return err('Укажите client_id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE %s.registrations SET comment = '%s' WHERE id = %d"
@@ -181,8 +168,6 @@ def _handle_update_client_comment(body):
         )
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
 
 
 def _handle_save_magnet_comment(body):
@@ -192,8 +177,7 @@ def _handle_save_magnet_comment(body):
         return err('Укажите order_id')
     if not comment:
         return err('Укажите comment')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE %s.orders SET magnet_comment = '%s' WHERE id = %d"
@@ -201,11 +185,9 @@ def _handle_save_magnet_comment(body):
         )
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
 
 
-def _handle_add_client(body, actor):
+def _handle_add_client(body, ctx):
     name = (body.get('name') or '').strip()
     phone = (body.get('phone') or '').strip()
     channel = (body.get('channel') or '').strip()
@@ -221,16 +203,13 @@ def _handle_add_client(body, actor):
     if not channel and has_ozon_code:
         channel = 'Ozon'
 
-    conn = db()
-    try:
-        cur = conn.cursor()
-        row = repo.insert_registration(cur, name, phone, channel, ozon_order_code, registered)
-        if actor:
-            cur.execute(
-                "UPDATE %s.registrations SET created_by = %%s WHERE id = %%s" % SCHEMA,
-                (actor, row[0])
-            )
-        conn.commit()
-        return ok({'id': row[0], 'created_at': str(row[1]), 'registered': registered})
-    finally:
-        conn.close()
\ No newline at end of file
+    cur = ctx.cursor()
+    actor = ctx.actor
+    row = repo.insert_registration(cur, name, phone, channel, ozon_order_code, registered)
+    if actor:
+        cur.execute(
+            "UPDATE %s.registrations SET created_by = %%s WHERE id = %%s" % SCHEMA,
+            (actor, row[0])
+        )
+    ctx.conn.commit()
+    return ok({'id': row[0], 'created_at': str(row[1]), 'registered': registered})
\ No newline at end of file
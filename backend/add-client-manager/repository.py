@@ -1,3 +1,5 @@
+from utils import run_prepared
+
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
@@ -41,14 +43,11 @@ def count_orders(cur, reg_id):
     return cur.fetchone()[0]
 
 
-def count_magnets(cur, reg_id):
-    cur.execute("SELECT COUNT(*) FROM %s.client_magnets WHERE registration_id = %d" % (SCHEMA, int(reg_id)))
-    return cur.fetchone()[0]
-
-
-def count_unique_breeds(cur, reg_id):
-    cur.execute("SELECT COUNT(DISTINCT breed) FROM %s.client_magnets WHERE registration_id = %d" % (SCHEMA, int(reg_id)))
-    return cur.fetchone()[0]
+def get_magnet_counts(cur, reg_id):
+    cur.execute(
+        "SELECT magnets, unique_breeds FROM %s.registration_summary WHERE registration_id = %d" % (SCHEMA, int(reg_id))
+    )
+    return cur.fetchone() or (0, 0)
 
 
 def get_given_milestones(cur, reg_id):
@@ -110,21 +109,14 @@ def get_order_full(cur, order_id):
     return cur.fetchone()
 
 
-def get_client_magnets_breeds(cur, reg_id):
-    cur.execute(
-        "SELECT breed FROM %s.client_magnets WHERE registration_id = %d" % (SCHEMA, int(reg_id))
-    )
-    return [r[0] for r in cur.fetchall()]
-
-
 def soft_remove_client(cur, reg_id, return_magnets=False):
     if return_magnets:
-        breeds = get_client_magnets_breeds(cur, reg_id)
-        for breed in breeds:
-            cur.execute(
-                "UPDATE %s.magnet_inventory SET stock = stock + 1, updated_at = now() WHERE breed = '%s'"
-                % (SCHEMA, breed.replace("'", "''"))
-            )
+        cur.execute(
+            "INSERT INTO %s.inventory_movements (breed, delta, reason, registration_id, magnet_id, order_id) "
+            "SELECT m.breed, 1, 'client_delete', m.registration_id, m.id, m.order_id FROM %s.client_magnets m "
+            "JOIN %s.magnet_inventory i ON i.breed = m.breed WHERE m.registration_id = %d"
+            % (SCHEMA, SCHEMA, SCHEMA, int(reg_id))
+        )
     cur.execute(
         "UPDATE %s.registrations SET removed_at = now() WHERE id = %d" % (SCHEMA, int(reg_id))
     )
@@ -145,7 +137,7 @@ def hard_remove_client(cur, reg_id):
 
 def get_order_magnets(cur, order_id):
     cur.execute(
-        "SELECT id, breed FROM %s.client_magnets WHERE order_id = %d" % (SCHEMA, int(order_id))
+        "SELECT id, breed, registration_id, order_id FROM %s.client_magnets WHERE order_id = %d" % (SCHEMA, int(order_id))
     )
     return cur.fetchall()
 
@@ -157,10 +149,12 @@ def get_order_bonuses(cur, order_id):
     return cur.fetchall()
 
 
-def restore_magnet_stock(cur, breed):
+def restore_magnet_stock(cur, magnet):
+    """Возврат магнита (строка get_order_magnets) на склад — движение +1, если порода есть на складе."""
     cur.execute(
-        "UPDATE %s.magnet_inventory SET stock = stock + 1, updated_at = now() WHERE breed = '%s'"
-        % (SCHEMA, breed.replace("'", "''"))
+        "INSERT INTO %s.inventory_movements (breed, delta, reason, registration_id, magnet_id, order_id) "
+        "SELECT breed, 1, 'order_delete', %%s, %%s, %%s FROM %s.magnet_inventory WHERE breed = %%s" % (SCHEMA, SCHEMA),
+        (magnet[2], magnet[0], magnet[3], magnet[1])
     )
 
 
@@ -208,10 +202,15 @@ def give_paduk(cur, registration_id, phone, order_id):
         return
     cur.execute(
         "INSERT INTO %s.client_magnets (registration_id, phone, breed, stars, category, order_id, status) "
-        "VALUES (%d, '%s', 'Падук', 2, 'Особенный', %d, 'in_transit')"
+        "VALUES (%d, '%s', 'Падук', 2, 'Особенный', %d, 'in_transit') RETURNING id"
         % (SCHEMA, int(registration_id), (phone or '').replace("'", "''"), int(order_id))
     )
+    magnet_id = cur.fetchone()[0]
+    # Списание — строкой журнала и только при положительном остатке. Порода блокируется, как в
+    # give-magnet: иначе параллельные заказы новых клиентов увидят один и тот же остаток.
+    run_prepared(cur, 'lock_breed', ('Падук',))
     cur.execute(
-        "UPDATE %s.magnet_inventory SET stock = GREATEST(stock - 1, 0), updated_at = now() "
-        "WHERE breed = 'Падук' AND stock > 0" % SCHEMA
-    )
\ No newline at end of file
+        "INSERT INTO %s.inventory_movements (breed, delta, reason, registration_id, magnet_id, order_id) "
+        "SELECT breed, -1, 'paduk', %d, %d, %d FROM %s.magnet_inventory_current WHERE breed = 'Падук' AND stock > 0"
+        % (SCHEMA, int(registration_id), magnet_id, int(order_id), SCHEMA)
+    )
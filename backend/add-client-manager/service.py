@@ -38,8 +38,7 @@ def create_order_by_ozon_code(cur, conn, order_number, channel, amount):
 
         pending_bonuses = []
         if registered:
-            total_magnets = repo.count_magnets(cur, cid)
-            unique_breeds = repo.count_unique_breeds(cur, cid)
+            total_magnets, unique_breeds = repo.get_magnet_counts(cur, cid)
             pending_bonuses = get_pending_bonuses(cur, cid, total_magnets, unique_breeds)
 
         return {
@@ -85,8 +84,7 @@ def create_order_for_client(cur, conn, client_id, order_code, channel, amount):
 
     pending_bonuses = []
     if registered:
-        total_magnets = repo.count_magnets(cur, client_id)
-        unique_breeds = repo.count_unique_breeds(cur, client_id)
+        total_magnets, unique_breeds = repo.get_magnet_counts(cur, client_id)
         pending_bonuses = get_pending_bonuses(cur, client_id, total_magnets, unique_breeds)
 
     return {
@@ -106,7 +104,7 @@ def delete_order(cur, conn, order_id, return_magnets, return_bonuses):
     removed_breeds = []
     for m in magnets:
         if return_magnets:
-            repo.restore_magnet_stock(cur, m[1])
+            repo.restore_magnet_stock(cur, m)
         repo.delete_magnet(cur, m[0])
         removed_breeds.append(m[1])
 
@@ -3,7 +3,8 @@ import json
 import secrets
 import hashlib
 from datetime import datetime, timezone, timedelta
-import psycopg2
+
+psycopg2 = None  # импортируется в _db(): OPTIONS не платит за загрузку драйвера
 
 SCHEMA = "t_p65563100_joywood_magnets_app"
 SESSION_TTL_HOURS = 10
@@ -388,6 +389,10 @@ def _get_audit(params):
 # ─── HELPERS ─────────────────────────────────────────────────────────────────
 
 def _db():
+    global psycopg2
+    if psycopg2 is None:
+        import psycopg2 as driver
+        psycopg2 = driver
     return psycopg2.connect(os.environ["DATABASE_URL"])
 
 
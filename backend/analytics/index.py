@@ -1,15 +1,13 @@
-from utils import OPTIONS_RESPONSE, ok, db
+from utils import OPTIONS_RESPONSE, ok, db, instrumented
 import service
 
 
+@instrumented
 def handler(event, context):
     """GET — аналитика: топ клиентов по количеству и стоимости магнитов, распределение по категориям."""
     if event.get('httpMethod') == 'OPTIONS':
         return OPTIONS_RESPONSE
 
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
-        return ok(service.get_analytics(cur))
-    finally:
-        conn.close()
+        return ok(service.get_analytics(cur), event=event)
@@ -5,16 +5,15 @@ def get_top_clients(cur):
     cur.execute("""
         SELECT
             r.id, r.name, r.phone,
-            COUNT(cm.id) AS magnet_count,
-            SUM(CASE cm.stars WHEN 1 THEN 150 WHEN 2 THEN 350 WHEN 3 THEN 700 ELSE 0 END) AS collection_value,
-            COUNT(CASE WHEN cm.stars = 1 THEN 1 END) AS star1_count,
-            COUNT(CASE WHEN cm.stars = 2 THEN 1 END) AS star2_count,
-            COUNT(CASE WHEN cm.stars = 3 THEN 1 END) AS star3_count
-        FROM %s.registrations r
-        LEFT JOIN %s.client_magnets cm ON cm.registration_id = r.id
-        GROUP BY r.id, r.name, r.phone
-        HAVING COUNT(cm.id) > 0
-        ORDER BY magnet_count DESC, collection_value DESC
+            s.magnets AS magnet_count,
+            s.collection_value,
+            s.star1 AS star1_count,
+            s.star2 AS star2_count,
+            s.star3 AS star3_count
+        FROM %s.registration_summary s
+        JOIN %s.registrations r ON r.id = s.registration_id
+        WHERE s.magnets > 0
+        ORDER BY s.magnets DESC, s.collection_value DESC
         LIMIT 20
     """ % (SCHEMA, SCHEMA))
     return cur.fetchall()
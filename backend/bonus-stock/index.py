@@ -1,20 +1,21 @@
 import json
-from utils import OPTIONS_RESPONSE, ok, err, db
+from utils import OPTIONS_RESPONSE, ok, err, not_modified, db, instrumented
 import repository as repo
 
 
+@instrumented
 def handler(event, context):
     """GET — остатки призов по бонусам. PUT — обновить остаток."""
     if event.get('httpMethod') == 'OPTIONS':
         return OPTIONS_RESPONSE
 
     method = event.get('httpMethod')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
 
         if method == 'GET':
-            return ok({'stock': repo.get_stock(cur)})
+            version = repo.get_version(cur)
+            return not_modified(event, version) or ok({'stock': repo.get_stock(cur)}, version, event)
 
         if method == 'PUT':
             body = json.loads(event.get('body') or '{}')
@@ -29,5 +30,3 @@ def handler(event, context):
             return ok({'ok': True, 'reward': reward, 'stock': int(stock)})
 
         return err('Метод не поддерживается', 405)
-    finally:
-        conn.close()
@@ -1,6 +1,12 @@
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
+def get_version(cur):
+    """Версия остатков призов для ETag: любая запись строки меняет её xmin, удаление — число строк."""
+    cur.execute("SELECT count(*), COALESCE(sum(xmin::text::bigint), 0) FROM %s.bonus_stock" % SCHEMA)
+    return '%d-%d' % cur.fetchone()
+
+
 def get_stock(cur):
     cur.execute("SELECT reward, stock FROM %s.bonus_stock ORDER BY reward" % SCHEMA)
     return {r[0]: r[1] for r in cur.fetchall()}
@@ -1,8 +1,6 @@
 import json
 import os
 import base64
-import boto3
-from botocore.exceptions import ClientError
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -26,6 +24,7 @@ def err(msg, status=400):
 
 
 def s3_client():
+    import boto3
     return boto3.client(
         's3',
         endpoint_url='https://bucket.poehali.dev',
@@ -35,6 +34,7 @@ def s3_client():
 
 
 def read_notes(client):
+    from botocore.exceptions import ClientError
     try:
         resp = client.get_object(Bucket=BUCKET, Key=NOTES_KEY)
         return json.loads(resp['Body'].read().decode('utf-8'))
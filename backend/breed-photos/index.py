@@ -1,16 +1,15 @@
 import json
 import os
 import base64
-import boto3
-from botocore.exceptions import ClientError
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
+    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, If-None-Match',
     'Access-Control-Max-Age': '86400',
 }
 CORS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+CONDITIONAL = {'Cache-Control': 'no-cache', 'Access-Control-Expose-Headers': 'ETag'}
 OPTIONS_RESPONSE = {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
 BUCKET = 'files'
@@ -18,8 +17,13 @@ PREFIX = 'breed-photos/'
 INDEX_KEY = 'breed-photos/_index.json'
 
 
-def ok(data):
-    return {'statusCode': 200, 'headers': CORS, 'body': json.dumps(data, ensure_ascii=False)}
+def ok(data, etag=None):
+    headers = {**CORS, **CONDITIONAL, 'ETag': etag} if etag else CORS
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(data, ensure_ascii=False)}
+
+
+def not_modified(etag):
+    return {'statusCode': 304, 'headers': {**CORS, **CONDITIONAL, 'ETag': etag}, 'body': ''}
 
 
 def err(msg, status=400):
@@ -27,6 +31,7 @@ def err(msg, status=400):
 
 
 def s3_client():
+    import boto3
     return boto3.client(
         's3',
         endpoint_url='https://bucket.poehali.dev',
@@ -36,6 +41,7 @@ def s3_client():
 
 
 def read_index(client):
+    from botocore.exceptions import ClientError
     try:
         resp = client.get_object(Bucket=BUCKET, Key=INDEX_KEY)
         return json.loads(resp['Body'].read().decode('utf-8'))
@@ -43,6 +49,20 @@ def read_index(client):
         return {}
 
 
+def read_index_if_changed(client, known_etag):
+    """(index, etag) индекса; (None, etag) — у клиента актуальная версия (S3 ответил 304).
+    ETag ответа — ETag объекта _index.json, сравнение If-None-Match делает S3 без скачивания."""
+    from botocore.exceptions import ClientError
+    try:
+        resp = client.get_object(Bucket=BUCKET, Key=INDEX_KEY, **({'IfNoneMatch': known_etag} if known_etag else {}))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == '304':
+            headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+            return None, headers.get('etag') or known_etag
+        return {}, None
+    return json.loads(resp['Body'].read().decode('utf-8')), resp.get('ETag')
+
+
 def write_index(client, index):
     client.put_object(
         Bucket=BUCKET,
@@ -63,9 +83,12 @@ def handler(event, context):
     client = s3_client()
 
     if method == 'GET':
-        index = read_index(client)
+        headers = event.get('headers') or {}
+        index, etag = read_index_if_changed(client, headers.get('if-none-match') or headers.get('If-None-Match'))
+        if index is None:
+            return not_modified(etag)
         photos = {breed: cdn_base + filename for breed, filename in index.items()}
-        return ok({'photos': photos})
+        return ok({'photos': photos}, etag)
 
     if method == 'POST':
         raw_body = event.get('body') or '{}'
@@ -110,6 +133,7 @@ def handler(event, context):
         index = read_index(client)
         filename = index.get(breed)
         if filename:
+            from botocore.exceptions import ClientError
             try:
                 client.delete_object(Bucket=BUCKET, Key=f"{PREFIX}{filename}")
             except ClientError:
@@ -1,6 +1,5 @@
 import os
 import json
-import requests
 
 
 def handler(event: dict, context) -> dict:
@@ -15,6 +14,7 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 400, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'key обязателен'})}
 
     api_key = os.environ['IDGTL_API_KEY']
+    import requests
     resp = requests.post(
         'https://direct.i-dgtl.ru/api/v1/verifier/widget/check',
         headers={
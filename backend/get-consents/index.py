@@ -1,7 +1,8 @@
-from utils import OPTIONS_RESPONSE, ok, db
+from utils import OPTIONS_RESPONSE, ok, db, instrumented
 import repository as repo
 
 
+@instrumented
 def handler(event: dict, context) -> dict:
     """Список клиентов, давших согласие с политикой конфиденциальности"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -10,18 +11,15 @@ def handler(event: dict, context) -> dict:
     params = event.get('queryStringParameters') or {}
     page = int(params.get('page', 1) or 1)
 
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         rows, total = repo.get_consents(cur, page)
         consents = [
             {
                 'id': r[0], 'phone': r[1], 'name': r[2] or '—',
                 'policy_version': r[3] or '—', 'ip': r[4] or '—',
-                'created_at': str(r[5]),
+                'created_at': r[5],
             }
             for r in rows
         ]
-        return ok({'consents': consents, 'total': total, 'page': page, 'page_size': repo.PAGE_SIZE})
-    finally:
-        conn.close()
\ No newline at end of file
+        return ok({'consents': consents, 'total': total, 'page': page, 'page_size': repo.PAGE_SIZE}, event=event)
\ No newline at end of file
@@ -1,8 +1,9 @@
 import os
-from utils import OPTIONS_RESPONSE, ok, err, db
+from utils import OPTIONS_RESPONSE, ok, err, db, instrumented
 import repository as repo
 
 
+@instrumented
 def handler(event, context):
     """Получение клиентов, заказов и аналитики регистраций"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -12,75 +13,66 @@ def handler(event, context):
     action = params.get('action', '')
 
     if action == 'orders':
-        return _get_orders(params)
+        return _get_orders(event, params)
     if action == 'client_orders':
-        return _get_client_orders(params)
+        return _get_client_orders(event, params)
     if action == 'recent_registrations':
-        return _get_recent_registrations()
+        return _get_recent_registrations(event)
     if action == 'registration_stats':
-        return _get_registration_stats()
+        return _get_registration_stats(event)
     if action == 'check_password':
         return _check_password(params)
     if action == 'list':
-        return _get_registrations_list()
+        return _get_registrations_list(event)
     if action == 'attention_clients':
-        return _get_attention_clients()
+        return _get_attention_clients(event)
     if action == 'lookup_log':
-        return _get_lookup_log(params)
+        return _get_lookup_log(event, params)
     if action == 'client_by_id':
-        return _get_client_by_id(params)
+        return _get_client_by_id(event, params)
 
-    return _get_clients(params)
+    return _get_clients(event, params)
 
 
 def _row_to_client(row):
     return {
         'id': row[0], 'name': row[1], 'phone': row[2], 'channel': row[3],
-        'ozon_order_code': row[4], 'created_at': str(row[5]),
+        'ozon_order_code': row[4], 'created_at': row[5],
         'registered': bool(row[6]), 'total_amount': float(row[7]), 'channels': row[8] or [],
         'comment': row[9] or '', 'created_by': row[10] if len(row) > 10 else None,
     }
 
 
-def _get_clients(params):
+def _get_clients(event, params):
     page = max(1, int(params.get('page', 1)))
     limit = min(max(1, int(params.get('limit', 50))), 200)
     q = (params.get('q') or '').strip()
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         rows, total = repo.get_clients(cur, page=page, limit=limit, q=q)
-        return ok({'clients': [_row_to_client(r) for r in rows], 'total': total, 'page': page, 'limit': limit})
-    finally:
-        conn.close()
+        return ok({'clients': [_row_to_client(r) for r in rows], 'total': total, 'page': page, 'limit': limit}, event=event)
 
 
-def _get_client_by_id(params):
+def _get_client_by_id(event, params):
     client_id = params.get('id', '')
     if not client_id or not str(client_id).isdigit():
         return err('Укажите id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         row = repo.get_client_by_id(cur, int(client_id))
         if not row:
             return err('Клиент не найден', 404)
-        return ok({'client': _row_to_client(row)})
-    finally:
-        conn.close()
+        return ok({'client': _row_to_client(row)}, event=event)
 
 
-def _get_registrations_list():
-    conn = db()
-    try:
+def _get_registrations_list(event):
+    with db() as conn:
         cur = conn.cursor()
         rows = repo.get_registrations_list(cur)
         return ok({'registrations': [
             {'id': r[0], 'name': r[1], 'phone': r[2], 'registered': bool(r[3])}
             for r in rows
-        ]})
-    finally:
-        conn.close()
+        ]}, event=event)
 
 
 def _check_password(params):
@@ -91,112 +83,94 @@ def _check_password(params):
     return err('Неверный пароль', 403)
 
 
-def _get_registration_stats():
-    conn = db()
-    try:
+def _get_registration_stats(event):
+    with db() as conn:
         cur = conn.cursor()
         daily_rows = repo.get_registration_stats_daily(cur)
-        daily = [{'date': str(r[0]), 'ozon': int(r[1]), 'total': int(r[1])} for r in daily_rows]
+        daily = [{'date': r[0], 'ozon': int(r[1]), 'total': int(r[1])} for r in daily_rows]
         r = repo.get_registration_stats_summary(cur)
         summary = {'ozon': int(r[0] or 0), 'today': int(r[1] or 0), 'this_week': int(r[2] or 0)}
-        return ok({'daily': daily, 'summary': summary})
-    finally:
-        conn.close()
+        return ok({'daily': daily, 'summary': summary}, event=event)
 
 
-def _get_recent_registrations():
-    conn = db()
-    try:
+def _get_recent_registrations(event):
+    with db() as conn:
         cur = conn.cursor()
         items = [
             {
                 'id': r[0], 'name': r[1], 'phone': r[2], 'channel': r[3],
-                'registered': bool(r[4]), 'created_at': str(r[5]),
+                'registered': bool(r[4]), 'created_at': r[5],
                 'total_amount': float(r[6]), 'orders_count': int(r[7]),
             }
             for r in repo.get_recent_registrations(cur)
         ]
-        return ok({'registrations': items})
-    finally:
-        conn.close()
+        return ok({'registrations': items}, event=event)
 
 
-def _get_orders(params):
+def _get_orders(event, params):
     page = max(1, int(params.get('page', 1)))
     limit = min(max(1, int(params.get('limit', 50))), 200)
     q = (params.get('q') or '').strip()
     channel = (params.get('channel') or '').strip().lower()
 
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         rows, total = repo.get_orders(cur, page=page, limit=limit, q=q, channel=channel)
         orders = [
             {
                 'id': r[0], 'order_code': r[1] or '', 'amount': float(r[2]) if r[2] else 0,
-                'channel': r[3], 'status': r[4], 'created_at': str(r[5]),
+                'channel': r[3], 'status': r[4], 'created_at': r[5],
                 'registration_id': r[6], 'client_name': r[7] or '',
                 'client_phone': r[8] or '', 'magnet_comment': r[9] or '', 'comment': r[10] or '',
                 'created_by': r[11] if len(r) > 11 else None,
             }
             for r in rows
         ]
-        return ok({'orders': orders, 'total': total, 'page': page, 'limit': limit})
-    finally:
-        conn.close()
+        return ok({'orders': orders, 'total': total, 'page': page, 'limit': limit}, event=event)
 
 
-def _get_attention_clients():
-    conn = db()
-    try:
+def _get_attention_clients(event):
+    with db() as conn:
         cur = conn.cursor()
         items = [
             {
                 'id': r[0], 'name': r[1], 'phone': r[2],
-                'ozon_order_code': r[3] or '', 'created_at': str(r[4]),
+                'ozon_order_code': r[3] or '', 'created_at': r[4],
                 'magnet_count': int(r[5]), 'order_count': int(r[6]),
             }
             for r in repo.get_attention_clients(cur)
         ]
-        return ok({'clients': items, 'total': len(items)})
-    finally:
-        conn.close()
+        return ok({'clients': items, 'total': len(items)}, event=event)
 
 
-def _get_lookup_log(params):
+def _get_lookup_log(event, params):
     limit = min(int(params.get('limit', 100)), 500)
     event_filter = params.get('event', '')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         items = [
             {
                 'id': r[0], 'phone': r[1] or '', 'event': r[2],
-                'details': r[3] or '', 'created_at': str(r[4]),
+                'details': r[3] or '', 'created_at': r[4],
             }
             for r in repo.get_lookup_log(cur, event_filter, limit)
         ]
         counts = {r[0]: int(r[1]) for r in repo.get_lookup_log_counts(cur)}
-        return ok({'log': items, 'counts_7d': counts})
-    finally:
-        conn.close()
+        return ok({'log': items, 'counts_7d': counts}, event=event)
 
 
-def _get_client_orders(params):
+def _get_client_orders(event, params):
     reg_id = params.get('registration_id', '')
     if not reg_id or not reg_id.isdigit():
         return err('registration_id required')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         orders = [
             {
                 'id': r[0], 'order_code': r[1] or '', 'amount': float(r[2]) if r[2] else 0,
-                'channel': r[3], 'status': r[4], 'created_at': str(r[5]),
+                'channel': r[3], 'status': r[4], 'created_at': r[5],
                 'magnet_comment': r[6] or '', 'comment': r[7] or '',
             }
             for r in repo.get_client_orders(cur, int(reg_id))
         ]
-        return ok({'orders': orders})
-    finally:
-        conn.close()
\ No newline at end of file
+        return ok({'orders': orders}, event=event)
\ No newline at end of file
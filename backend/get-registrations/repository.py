@@ -24,12 +24,12 @@ def get_clients(cur, page=1, limit=50, q=''):
     offset = (page - 1) * limit
     cur.execute(
         "SELECT r.id, r.name, r.phone, r.channel, r.ozon_order_code, r.created_at, r.registered, "
-        "COALESCE(SUM(o.amount), 0) as total_amount, "
-        "array_remove(array_agg(DISTINCT o.channel), NULL) as channels, "
+        "COALESCE(s.orders_total, 0) as total_amount, "
+        "COALESCE(s.channels, '{}') as channels, "
         "r.comment, r.created_by "
         "FROM %s.registrations r "
-        "LEFT JOIN %s.orders o ON o.registration_id = r.id "
-        "%s GROUP BY r.id ORDER BY r.created_at DESC LIMIT %d OFFSET %d"
+        "LEFT JOIN %s.registration_summary s ON s.registration_id = r.id "
+        "%s ORDER BY r.created_at DESC LIMIT %d OFFSET %d"
         % (SCHEMA, SCHEMA, where, limit, offset)
     )
     return cur.fetchall(), total
@@ -38,12 +38,12 @@ def get_clients(cur, page=1, limit=50, q=''):
 def get_client_by_id(cur, client_id):
     cur.execute(
         "SELECT r.id, r.name, r.phone, r.channel, r.ozon_order_code, r.created_at, r.registered, "
-        "COALESCE(SUM(o.amount), 0) as total_amount, "
-        "array_remove(array_agg(DISTINCT o.channel), NULL) as channels, "
+        "COALESCE(s.orders_total, 0) as total_amount, "
+        "COALESCE(s.channels, '{}') as channels, "
         "r.comment "
         "FROM %s.registrations r "
-        "LEFT JOIN %s.orders o ON o.registration_id = r.id "
-        "WHERE r.id = %d GROUP BY r.id" % (SCHEMA, SCHEMA, int(client_id))
+        "LEFT JOIN %s.registration_summary s ON s.registration_id = r.id "
+        "WHERE r.id = %d" % (SCHEMA, SCHEMA, int(client_id))
     )
     return cur.fetchone()
 
@@ -81,11 +81,11 @@ def get_registration_stats_summary(cur):
 def get_recent_registrations(cur):
     cur.execute(
         "SELECT r.id, r.name, r.phone, r.channel, r.registered, r.created_at, "
-        "COALESCE(SUM(o.amount), 0) as total_amount, COUNT(o.id) as orders_count "
+        "COALESCE(s.orders_total, 0) as total_amount, COALESCE(s.orders_count, 0) as orders_count "
         "FROM %s.registrations r "
-        "LEFT JOIN %s.orders o ON o.registration_id = r.id "
+        "LEFT JOIN %s.registration_summary s ON s.registration_id = r.id "
         "WHERE r.registered = TRUE AND LOWER(r.channel) = 'ozon' "
-        "GROUP BY r.id ORDER BY r.created_at DESC" % (SCHEMA, SCHEMA)
+        "ORDER BY r.created_at DESC" % (SCHEMA, SCHEMA)
     )
     return cur.fetchall()
 
@@ -131,14 +131,11 @@ def get_orders(cur, page=1, limit=50, q='', channel=''):
 def get_attention_clients(cur):
     cur.execute(
         "SELECT r.id, r.name, r.phone, r.ozon_order_code, r.created_at, "
-        "COUNT(cm.id) as magnet_count, COUNT(o.id) as order_count "
+        "COALESCE(s.magnets, 0) as magnet_count, COALESCE(s.orders_count, 0) as order_count "
         "FROM %s.registrations r "
-        "LEFT JOIN %s.client_magnets cm ON cm.registration_id = r.id "
-        "LEFT JOIN %s.orders o ON o.registration_id = r.id "
-        "WHERE r.registered = TRUE "
-        "GROUP BY r.id "
-        "HAVING COUNT(cm.id) = 0 "
-        "ORDER BY r.created_at DESC" % (SCHEMA, SCHEMA, SCHEMA)
+        "LEFT JOIN %s.registration_summary s ON s.registration_id = r.id "
+        "WHERE r.registered = TRUE AND COALESCE(s.magnets, 0) = 0 "
+        "ORDER BY r.created_at DESC" % (SCHEMA, SCHEMA)
     )
     return cur.fetchall()
 
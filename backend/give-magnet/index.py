@@ -1,13 +1,21 @@
+import base64
+import binascii
 import json
-from utils import OPTIONS_RESPONSE, ok, err, db, resolve_actor
+from utils import OPTIONS_RESPONSE, ok, err, not_modified, db, RequestContext, instrumented
 import repository as repo
 import service
 
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
+@instrumented
 def handler(event, context):
-    """POST — выдать магнит / бонус. GET — магниты клиента / остатки / бонусы. DELETE — удалить магнит."""
+    """POST — выдать магнит / бонус / магниты списком (action=give_bulk).
+    GET — магниты клиента / бонусы / остатки (action=inventory; since=<version> — только изменённые
+    с этой отметки, version в ответе — новая отметка, total — число пород для сверки удалений,
+    full — отметка устарела и пришёл склад целиком;
+    action=movements — журнал движений склада, breed и limit до 500).
+    PUT — остатки списком или импорт CSV-выгрузки склада (action=import). DELETE — удалить магнит."""
     if event.get('httpMethod') == 'OPTIONS':
         return OPTIONS_RESPONSE
 
@@ -15,34 +23,45 @@ def handler(event, context):
     params = event.get('queryStringParameters') or {}
 
     if method == 'GET' and params.get('action') == 'inventory':
-        conn = db()
-        try:
+        since = params.get('since')
+        if since is not None and (not str(since).isdigit() or len(str(since)) > 18):
+            return err('since должен быть числом')
+        since = int(since) if since is not None else None
+        with db() as conn:
+            total, mark, full, digest, inventory = repo.get_inventory(conn.cursor(), since)
+            # ETag — только содержимое склада: отметка (xmin) растёт от любой записи в базе. После 304
+            # клиент продолжает со своей прежней отметкой — она меньше, дельта от неё лишь шире.
+            etag = '%d-%s' % (total, digest[:16]) + (':%d' % since if since is not None else '')
+            return not_modified(event, etag) or ok(
+                {'inventory': inventory, 'version': mark, 'total': total, 'full': full}, etag, event
+            )
+
+    if method == 'GET' and params.get('action') == 'movements':
+        limit = params.get('limit') or '100'
+        if not str(limit).isdigit() or not 0 < int(limit) <= 500:
+            return err('limit — число от 1 до 500')
+        with db() as conn:
             cur = conn.cursor()
-            return ok({'inventory': repo.get_inventory(cur)})
-        finally:
-            conn.close()
+            return ok({'movements': repo.get_movements(cur, (params.get('breed') or '').strip(), int(limit))}, event=event)
 
     if method == 'GET' and params.get('action') == 'bonuses':
         reg_id = params.get('registration_id')
         if not reg_id:
             return err('Укажите registration_id')
-        conn = db()
-        try:
+        with db() as conn:
             cur = conn.cursor()
-            return ok({'bonuses': repo.get_bonuses_for_client(cur, int(reg_id))})
-        finally:
-            conn.close()
+            return ok({'bonuses': repo.get_bonuses_for_client(cur, int(reg_id))}, event=event)
 
     if method == 'GET':
         reg_id = params.get('registration_id')
         if not reg_id:
             return err('Укажите registration_id')
-        conn = db()
-        try:
+        with db() as conn:
             cur = conn.cursor()
-            return ok({'magnets': repo.get_magnets_for_client(cur, int(reg_id))})
-        finally:
-            conn.close()
+            return ok({'magnets': repo.get_magnets_for_client(cur, int(reg_id))}, event=event)
+
+    if method == 'PUT' and params.get('action') == 'import':
+        return _import(event, params)
 
     if method == 'PUT':
         body = json.loads(event.get('body') or '{}')
@@ -51,47 +70,31 @@ def handler(event, context):
             active = body.get('active')
             if not breed or active is None:
                 return err('Укажите breed и active')
-            conn = db()
-            try:
+            with db() as conn:
                 cur = conn.cursor()
                 repo.toggle_breed_active(cur, breed, active)
                 conn.commit()
                 return ok({'ok': True, 'breed': breed, 'active': active})
-            finally:
-                conn.close()
 
         items = body.get('items')
         if not items or not isinstance(items, list):
             return err('Укажите items — массив {breed, stars, category, stock}')
-        conn = db()
-        try:
-            cur = conn.cursor()
-            for item in items:
-                breed = (item.get('breed') or '').strip()
-                if not breed:
-                    continue
-                repo.update_inventory_item(cur, breed, item.get('stars', 1), item.get('category', ''), item.get('stock', 0))
-            conn.commit()
-            return ok({'ok': True, 'updated': len(items)})
-        finally:
-            conn.close()
+        with RequestContext(event) as ctx:
+            summary = service.import_inventory(ctx.cursor(), ctx.conn, enumerate(items, 1), False, 'set', ctx.actor)
+            return ok({'ok': True, 'updated': summary['total'], **summary})
 
     if method == 'DELETE':
         magnet_id = params.get('magnet_id')
         if not magnet_id or not str(magnet_id).isdigit():
             return err('Укажите magnet_id')
-        conn = db()
-        try:
-            cur = conn.cursor()
-            result = service.remove_magnet(cur, conn, int(magnet_id))
-            return ok(result)
-        except service.MagnetError as e:
-            return err(str(e), e.status)
-        finally:
-            conn.close()
+        with RequestContext(event) as ctx:
+            try:
+                result = service.remove_magnet(ctx.cursor(), ctx.conn, int(magnet_id), ctx.actor)
+                return ok(result)
+            except service.MagnetError as e:
+                return err(str(e), e.status)
 
     if method == 'POST':
-        actor = resolve_actor(event)
         body = json.loads(event.get('body') or '{}')
 
         if body.get('action') == 'give_bonus':
@@ -102,15 +105,22 @@ def handler(event, context):
             order_id = body.get('order_id')
             if not registration_id or not milestone_count or not milestone_type or not reward:
                 return err('Укажите registration_id, milestone_count, milestone_type, reward')
-            conn = db()
-            try:
-                cur = conn.cursor()
-                result = service.give_bonus(cur, conn, registration_id, milestone_count, milestone_type, reward, order_id)
-                return ok(result)
-            except service.MagnetError as e:
-                return err(str(e), e.status)
-            finally:
-                conn.close()
+            with db() as conn:
+                try:
+                    cur = conn.cursor()
+                    result = service.give_bonus(cur, conn, registration_id, milestone_count, milestone_type, reward, order_id)
+                    return ok(result)
+                except service.MagnetError as e:
+                    return err(str(e), e.status)
+
+        if body.get('action') == 'give_bulk':
+            items = body.get('items')
+            if not items or not isinstance(items, list):
+                return err('Укажите items — массив {registration_id, breed, stars, category}')
+            if len(items) > service.GIVE_BULK_MAX:
+                return err('Не больше %d магнитов за запрос' % service.GIVE_BULK_MAX)
+            with RequestContext(event) as ctx:
+                return ok(service.give_magnets(ctx.cursor(), ctx.conn, items, ctx.actor))
 
         registration_id = body.get('registration_id')
         breed = (body.get('breed') or '').strip()
@@ -120,20 +130,44 @@ def handler(event, context):
         if not registration_id or not breed or not stars or not category:
             return err('Укажите registration_id, breed, stars и category')
 
-        conn = db()
+        with RequestContext(event) as ctx:
+            try:
+                result = service.give_magnet(ctx.cursor(), ctx.conn, registration_id, breed, stars, category, ctx.actor)
+                return ok(result)
+            except service.MagnetError as e:
+                return err(str(e), e.status)
+
+    return err('Method not allowed', 405)
+
+
+def _import(event, params):
+    """Тело — CSV-выгрузка склада (или JSON {"items": [...]}); dry_run=1 — только показать изменения.
+    Base64-тело может быть в UTF-8 или cp1251, кодировка возвращается в сводке."""
+    raw, encoding = event.get('body') or '', 'utf-8'
+    try:
+        if event.get('isBase64Encoded'):
+            raw, encoding = service.decode_upload(base64.b64decode(raw))
+        raw = raw.lstrip('\ufeff')
+        if '\x00' in raw:
+            return err('Файл не похож на текстовую выгрузку')
+        if raw.lstrip().startswith('{'):
+            body = json.loads(raw)
+            items = body.get('items') if isinstance(body, dict) else None
+            if not isinstance(items, list):
+                return err('Укажите items — массив {breed, stars, category, stock}')
+            records = enumerate(items, 1)
+        else:
+            records = service.read_inventory_csv(raw)
+    except binascii.Error:
+        return err('Тело не в base64')
+    except ValueError:
+        return err('Некорректный JSON')
+    except service.MagnetError as e:
+        return err(str(e), e.status)
+    dry_run = params.get('dry_run') in ('1', 'true')
+    with RequestContext(event) as ctx:
         try:
-            cur = conn.cursor()
-            result = service.give_magnet(cur, conn, registration_id, breed, stars, category)
-            if actor and result.get('magnet_id'):
-                cur.execute(
-                    "UPDATE %s.client_magnets SET created_by = %%s WHERE id = %%s" % SCHEMA,
-                    (actor, result['magnet_id'])
-                )
-                conn.commit()
-            return ok(result)
+            summary = service.import_inventory(ctx.cursor(), ctx.conn, records, dry_run, 'import', ctx.actor)
+            return ok({**summary, 'encoding': encoding})
         except service.MagnetError as e:
             return err(str(e), e.status)
-        finally:
-            conn.close()
-
-    return err('Method not allowed', 405)
@@ -1,9 +1,30 @@
+from utils import run_prepared
+
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
-def get_inventory(cur):
-    cur.execute("SELECT breed, stars, category, stock, active FROM %s.magnet_inventory ORDER BY stars, breed" % SCHEMA)
-    return {r[0]: {'stars': r[1], 'category': r[2], 'stock': r[3], 'active': r[4]} for r in cur.fetchall()}
+def get_inventory(cur, since=None):
+    """Склад одним запросом, без блокировок (V0043): (число пород, отметка, отпечаток, полный ли ответ,
+    {порода: ...}). Отметка — xmin снимка чтения; с since отдаются строки с version >= since, а since
+    больше xmax снимка (отметка до V0043 или чужая) считается устаревшей — тогда склад целиком.
+    Отпечаток — md5 содержимого всех строк, без version: ETag из него не меняется от чужих записей
+    в базе, которые сдвигают отметку."""
+    cur.execute(
+        "WITH snap AS ("
+        " SELECT pg_snapshot_xmin(s)::text::bigint AS mark, pg_snapshot_xmax(s)::text::bigint AS xmax"
+        " FROM pg_current_snapshot() AS s"
+        ") "
+        "SELECT count(i.breed), snap.mark, %%(since)s::bigint IS NULL OR %%(since)s > snap.xmax,"
+        " md5(COALESCE(string_agg(concat_ws(':', i.breed, i.stock, i.active, i.stars, i.category), ','"
+        " ORDER BY i.breed), '')),"
+        " COALESCE(json_agg(json_build_array(i.breed, i.stars, i.category, i.stock, i.active) ORDER BY i.stars, i.breed)"
+        " FILTER (WHERE %%(since)s::bigint IS NULL OR %%(since)s > snap.xmax OR i.version >= %%(since)s), '[]')"
+        " FROM snap LEFT JOIN %s.magnet_inventory_current i ON true GROUP BY snap.mark, snap.xmax" % SCHEMA,
+        {'since': since}
+    )
+    total, mark, full, digest, rows = cur.fetchone()
+    inventory = {r[0]: {'stars': r[1], 'category': r[2], 'stock': r[3], 'active': r[4]} for r in rows}
+    return total, mark, full, digest, inventory
 
 
 def get_bonuses_for_client(cur, registration_id):
@@ -52,54 +73,82 @@ def decrement_bonus_stock(cur, reward):
     )
 
 
-def find_registration(cur, registration_id):
-    cur.execute("SELECT id, phone FROM %s.registrations WHERE id = %d" % (SCHEMA, int(registration_id)))
+def lock_registration(cur, registration_id):
+    run_prepared(cur, 'lock_registration', (int(registration_id),))
     return cur.fetchone()
 
 
-def has_breed(cur, registration_id, breed):
+def lock_breed(cur, breed):
+    run_prepared(cur, 'lock_breed', (breed,))
+
+
+def give_magnet(cur, registration_id, breed, phone, stars, category, actor):
+    run_prepared(cur, 'give_magnet', (int(registration_id), breed, phone or '', int(stars), category, actor))
+    return cur.fetchone()
+
+
+def lock_registrations(cur, registration_ids):
+    """{id: телефон} существующих участников; строки блокируются по возрастанию id, как в lock_registration."""
     cur.execute(
-        "SELECT id FROM %s.client_magnets WHERE registration_id = %d AND breed = '%s' LIMIT 1"
-        % (SCHEMA, int(registration_id), breed.replace("'", "''"))
+        "SELECT id, phone FROM %s.registrations WHERE id = ANY(%%s) ORDER BY id FOR NO KEY UPDATE" % SCHEMA,
+        (sorted(registration_ids),)
     )
-    return cur.fetchone() is not None
+    return {r[0]: r[1] or '' for r in cur.fetchall()}
+
 
+def lock_breeds(cur, breeds):
+    """Блокировки пород, как lock_breed, со свёрткой накопившихся движений (V0042)."""
+    cur.execute("SELECT %s.lock_inventory_breeds(%%s::text[])" % SCHEMA, (list(breeds),))
 
-def get_breed_inventory(cur, breed):
+
+def lock_inventory(cur, breeds):
+    """{порода: (остаток, active)} с текущими остатками; породы блокируются до конца транзакции."""
+    lock_breeds(cur, breeds)
     cur.execute(
-        "SELECT stock, active FROM %s.magnet_inventory WHERE breed = '%s'"
-        % (SCHEMA, breed.replace("'", "''"))
+        "SELECT breed, stock, active FROM %s.magnet_inventory_current WHERE breed = ANY(%%s)" % SCHEMA,
+        (list(breeds),)
     )
-    return cur.fetchone()
+    return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
 
 
-def get_last_order_id(cur, registration_id):
+def get_owned_breeds(cur, registration_ids, breeds):
     cur.execute(
-        "SELECT id FROM %s.orders WHERE registration_id = %d ORDER BY created_at DESC LIMIT 1"
-        % (SCHEMA, int(registration_id))
+        "SELECT DISTINCT registration_id, breed FROM %s.client_magnets "
+        "WHERE registration_id = ANY(%%s) AND breed = ANY(%%s)" % SCHEMA,
+        (list(registration_ids), list(breeds))
     )
-    row = cur.fetchone()
-    return row[0] if row else None
+    return set(cur.fetchall())
 
 
-def insert_magnet(cur, registration_id, phone, breed, stars, category, order_id, status):
-    order_id_sql = str(order_id) if order_id else 'NULL'
+def get_last_order_ids(cur, registration_ids):
     cur.execute(
-        "INSERT INTO %s.client_magnets (registration_id, phone, breed, stars, category, order_id, status) "
-        "VALUES (%d, '%s', '%s', %d, '%s', %s, '%s') RETURNING id, given_at"
-        % (
-            SCHEMA, int(registration_id), (phone or '').replace("'", "''"),
-            breed.replace("'", "''"), int(stars),
-            category.replace("'", "''"), order_id_sql, status,
-        )
+        "SELECT DISTINCT ON (registration_id) registration_id, id FROM %s.orders "
+        "WHERE registration_id = ANY(%%s) ORDER BY registration_id, created_at DESC" % SCHEMA,
+        (list(registration_ids),)
+    )
+    return dict(cur.fetchall())
+
+
+def insert_magnets(cur, rows):
+    """rows — (registration_id, phone, breed, stars, category, order_id, created_by); одна вставка
+    на все строки, (id, given_at) в том же порядке."""
+    from psycopg2.extras import execute_values
+    return execute_values(
+        cur,
+        "INSERT INTO %s.client_magnets (registration_id, phone, breed, stars, category, order_id, status, created_by) "
+        "VALUES %%s RETURNING id, given_at" % SCHEMA,
+        rows, template="(%s, %s, %s, %s, %s, %s, 'in_transit', %s)", page_size=len(rows), fetch=True,
     )
-    return cur.fetchone()
 
 
-def decrement_magnet_stock(cur, breed):
-    cur.execute(
-        "UPDATE %s.magnet_inventory SET stock = GREATEST(stock - 1, 0), updated_at = now() WHERE breed = '%s'"
-        % (SCHEMA, breed.replace("'", "''"))
+def insert_movements(cur, rows):
+    """rows — (breed, delta, reason, registration_id, magnet_id, order_id, actor); одна вставка."""
+    from psycopg2.extras import execute_values
+    execute_values(
+        cur,
+        "INSERT INTO %s.inventory_movements (breed, delta, reason, registration_id, magnet_id, order_id, actor) "
+        "VALUES %%s" % SCHEMA,
+        rows, page_size=len(rows),
     )
 
 
@@ -109,25 +158,63 @@ def delete_magnet(cur, magnet_id):
 
 def get_magnet_by_id(cur, magnet_id):
     cur.execute(
-        "SELECT id, breed FROM %s.client_magnets WHERE id = %d" % (SCHEMA, int(magnet_id))
+        "SELECT id, breed, registration_id, order_id FROM %s.client_magnets WHERE id = %d" % (SCHEMA, int(magnet_id))
     )
     return cur.fetchone()
 
 
-def restore_magnet_stock(cur, breed):
+def restore_magnet_stock(cur, magnet, actor=None):
+    """Возврат магнита на склад — движение +1, если порода есть на складе. magnet — строка get_magnet_by_id."""
+    cur.execute(
+        "INSERT INTO %s.inventory_movements (breed, delta, reason, registration_id, magnet_id, order_id, actor) "
+        "SELECT breed, 1, 'remove', %%s, %%s, %%s, %%s FROM %s.magnet_inventory WHERE breed = %%s" % (SCHEMA, SCHEMA),
+        (magnet[2], magnet[0], magnet[3], actor, magnet[1])
+    )
+
+
+def upsert_inventory(cur, items, reason, actor=None):
+    """items — [(breed, stars, category, stock)] без повторов породы. Новые породы вставляются
+    с этим остатком; у существующих разница с текущим остатком пишется движением reason.
+    Возвращает [(breed, прежний остаток или None для новой породы, новый остаток)] по изменённым."""
+    lock_breeds(cur, [item[0] for item in items])
     cur.execute(
-        "UPDATE %s.magnet_inventory SET stock = stock + 1, updated_at = now() WHERE breed = '%s'"
-        % (SCHEMA, breed.replace("'", "''"))
+        "WITH incoming AS ("
+        " SELECT * FROM unnest(%%s::text[], %%s::int[], %%s::text[], %%s::int[]) AS t(breed, stars, category, stock)"
+        "), current AS ("
+        " SELECT breed, stock FROM %s.magnet_inventory_current WHERE breed IN (SELECT breed FROM incoming)"
+        "), added AS ("
+        " INSERT INTO %s.magnet_inventory (breed, stars, category, stock, updated_at)"
+        " SELECT breed, stars, category, stock, now() FROM incoming"
+        " WHERE breed NOT IN (SELECT breed FROM current)"
+        " ON CONFLICT (breed) DO NOTHING"
+        " RETURNING breed, stock"
+        "), moved AS ("
+        " INSERT INTO %s.inventory_movements (breed, delta, reason, actor)"
+        " SELECT i.breed, i.stock - c.stock, %%s, %%s FROM incoming i JOIN current c USING (breed)"
+        " WHERE i.stock <> c.stock"
+        " RETURNING breed, delta"
+        ")"
+        " SELECT breed, NULL::int, stock FROM added"
+        " UNION ALL SELECT m.breed, c.stock, c.stock + m.delta FROM moved m JOIN current c USING (breed)"
+        " ORDER BY 1"
+        % (SCHEMA, SCHEMA, SCHEMA),
+        (*(tuple(map(list, zip(*items))) if items else ([], [], [], [])), reason, actor)
     )
+    return cur.fetchall()
 
 
-def update_inventory_item(cur, breed, stars, category, stock):
+def get_movements(cur, breed=None, limit=100):
+    """Журнал движений склада, новые первыми; breed — только по этой породе."""
+    where = "WHERE breed = '%s' " % breed.replace("'", "''") if breed else ''
     cur.execute(
-        "INSERT INTO %s.magnet_inventory (breed, stars, category, stock, updated_at) "
-        "VALUES ('%s', %d, '%s', %d, now()) "
-        "ON CONFLICT (breed) DO UPDATE SET stock = %d, updated_at = now()"
-        % (SCHEMA, breed.replace("'", "''"), int(stars), category.replace("'", "''"), int(stock), int(stock))
+        "SELECT id, breed, delta, reason, registration_id, magnet_id, order_id, actor, created_at "
+        "FROM %s.inventory_movements %sORDER BY id DESC LIMIT %d" % (SCHEMA, where, int(limit))
     )
+    return [
+        {'id': r[0], 'breed': r[1], 'delta': r[2], 'reason': r[3], 'registration_id': r[4], 'magnet_id': r[5],
+         'order_id': r[6], 'actor': r[7], 'created_at': str(r[8])}
+        for r in cur.fetchall()
+    ]
 
 
 def toggle_breed_active(cur, breed, active):
@@ -1,5 +1,19 @@
+import os
+
 import repository as repo
 
+# Массовая выдача после развоза: не больше GIVE_BULK_MAX позиций за запрос.
+GIVE_BULK_MAX = int(os.environ.get('GIVE_BULK_MAX', '200'))
+
+# Импорт остатков пишется в БД порциями по IMPORT_CHUNK пород. Колонки CSV узнаются по заголовку.
+IMPORT_CHUNK = 500
+CSV_COLUMNS = {
+    'breed': ('breed', 'порода'),
+    'stars': ('stars', 'звезды', 'звёзды'),
+    'category': ('category', 'категория'),
+    'stock': ('stock', 'остаток', 'количество'),
+}
+
 
 class MagnetError(Exception):
     def __init__(self, message, status=400):
@@ -22,35 +36,202 @@ def give_bonus(cur, conn, registration_id, milestone_count, milestone_type, rewa
     return {'id': row[0], 'given_at': str(row[1])}
 
 
-def give_magnet(cur, conn, registration_id, breed, stars, category):
-    reg = repo.find_registration(cur, registration_id)
+def give_magnet(cur, conn, registration_id, breed, stars, category, actor=None):
+    """Выдача в одной транзакции: участник и порода блокируются, затем проверка, вставка, движение
+    списания и отметка «кто выдал» — одним запросом give_magnet. Отказ откатывает транзакцию целиком."""
+    reg = repo.lock_registration(cur, registration_id)
     if not reg:
+        conn.rollback()
         raise MagnetError('Клиент не найден', 404)
 
-    if repo.has_breed(cur, registration_id, breed):
-        raise MagnetError('Порода «%s» уже есть в коллекции этого клиента' % breed, 409)
-
-    inv_row = repo.get_breed_inventory(cur, breed)
-    current_stock = inv_row[0] if inv_row else 0
-    if inv_row and not inv_row[1]:
-        raise MagnetError('Магнит «%s» снят с участия в акции' % breed)
-    if inv_row and current_stock <= 0:
-        raise MagnetError('Магнит «%s» закончился на складе (остаток: 0)' % breed)
-
     phone = reg[1] or ''
-    last_order_id = repo.get_last_order_id(cur, registration_id)
-    row = repo.insert_magnet(cur, registration_id, phone, breed, stars, category, last_order_id, 'in_transit')
-    repo.decrement_magnet_stock(cur, breed)
+    repo.lock_breed(cur, breed)
+    row = repo.give_magnet(cur, registration_id, breed, phone, stars, category, actor)
+    if row[0] is None:
+        conn.rollback()
+        if row[2]:
+            raise MagnetError('Порода «%s» уже есть в коллекции этого клиента' % breed, 409)
+        if row[3] is False:
+            raise MagnetError('Магнит «%s» снят с участия в акции' % breed)
+        raise MagnetError('Магнит «%s» закончился на складе (остаток: 0)' % breed)
     conn.commit()
 
     return {'id': row[0], 'given_at': str(row[1]), 'phone': phone}
 
 
-def remove_magnet(cur, conn, magnet_id):
+def _bulk_item(item):
+    """(registration_id, breed, stars, category) или None, если позиция заполнена неверно."""
+    if not isinstance(item, dict):
+        return None
+    reg_id, stars = item.get('registration_id'), item.get('stars')
+    breed = str(item.get('breed') or '').strip()
+    category = str(item.get('category') or '').strip()
+    if not str(reg_id).isdigit() or not str(stars).isdigit() or not breed or not category:
+        return None
+    return int(reg_id), breed, int(stars), category
+
+
+def give_magnets(cur, conn, items, actor=None):
+    """Массовая выдача в одной транзакции: участники и породы блокируются, дубли и остатки
+    проверяются в памяти по этому снимку, магниты и движения списания вставляются двумя INSERT.
+    Результат — по позиции на каждый элемент items в том же порядке."""
+    parsed = [_bulk_item(item) for item in items]
+    valid = [p for p in parsed if p]
+    reg_ids = {p[0] for p in valid}
+
+    phones = repo.lock_registrations(cur, reg_ids) if reg_ids else {}
+    breeds = {p[1] for p in valid if p[0] in phones}
+    inventory = repo.lock_inventory(cur, breeds) if breeds else {}
+    owned = repo.get_owned_breeds(cur, phones, breeds) if phones else set()
+    last_orders = repo.get_last_order_ids(cur, phones) if phones else {}
+
+    results, rows, taken, moves = [], [], {}, []
+    for item in parsed:
+        if item is None:
+            results.append({'ok': False, 'status': 400, 'error': 'Укажите registration_id, breed, stars и category'})
+            continue
+        reg_id, breed, stars, category = item
+        result = {'registration_id': reg_id, 'breed': breed}
+        stock, active = inventory.get(breed, (None, True))
+        if reg_id not in phones:
+            result.update(ok=False, status=404, error='Клиент не найден')
+        elif (reg_id, breed) in owned:
+            result.update(ok=False, status=409, error='Порода «%s» уже есть в коллекции этого клиента' % breed)
+        elif not active:
+            result.update(ok=False, status=400, error='Магнит «%s» снят с участия в акции' % breed)
+        elif stock is not None and stock - taken.get(breed, 0) <= 0:
+            result.update(ok=False, status=400, error='Магнит «%s» закончился на складе (остаток: 0)' % breed)
+        else:
+            owned.add((reg_id, breed))
+            if stock is not None:
+                taken[breed] = taken.get(breed, 0) + 1
+            rows.append((reg_id, phones[reg_id], breed, stars, category, last_orders.get(reg_id), actor))
+            result.update(ok=True, phone=phones[reg_id])
+        results.append(result)
+
+    if rows:
+        inserted = iter(repo.insert_magnets(cur, rows))
+        for result in results:
+            if result['ok']:
+                magnet_id, given_at = next(inserted)
+                result.update(id=magnet_id, given_at=str(given_at))
+                if result['breed'] in taken:
+                    reg_id = result['registration_id']
+                    moves.append((result['breed'], -1, 'give_bulk', reg_id, magnet_id, last_orders.get(reg_id), actor))
+    if moves:
+        repo.insert_movements(cur, moves)
+    conn.commit()
+    return {'results': results, 'given': len(rows), 'failed': len(results) - len(rows)}
+
+
+def _whole(value, default):
+    """Целое из элемента items (число, в том числе 5.0) или из ячейки CSV (строка)."""
+    if value is None or value == '':
+        return default
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value.strip() or default)
+        except ValueError:
+            pass
+    raise ValueError('Остаток и звёзды должны быть целыми числами')
+
+
+def _inventory_item(record):
+    """(breed, stars, category, stock) из строки CSV или элемента items; ValueError — строка с ошибкой."""
+    breed = str(record.get('breed') or '').strip()
+    if not breed:
+        raise ValueError('Не указана порода')
+    stock = _whole(record.get('stock'), 0)
+    stars = _whole(record.get('stars'), 1)
+    if stock < 0:
+        raise ValueError('Остаток не может быть отрицательным')
+    return breed, stars, str(record.get('category') or '').strip(), stock
+
+
+def decode_upload(data):
+    """Текст выгрузки из байтов и кодировка: UTF-8 (с BOM или без), иначе cp1251 — так сохраняет Excel."""
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            return data.decode(encoding), encoding.replace('-sig', '')
+        except UnicodeDecodeError:
+            continue
+    raise MagnetError('Файл не в UTF-8 и не в cp1251 — сохраните выгрузку в UTF-8')
+
+
+def read_inventory_csv(text):
+    """Строки выгрузки склада как (номер строки, {колонка: значение}), по одной. Разделитель
+    (; , или табуляция) определяется по заголовку; обязательны колонки породы и остатка."""
+    import csv
+    import io
+    import itertools
+
+    lines = io.StringIO(text.lstrip('\ufeff'))
+    header = lines.readline()
+    delimiter = max(';,\t', key=header.count)
+    reader = csv.reader(itertools.chain([header], lines), delimiter=delimiter)
+    try:
+        names = [name.strip().lower() for name in next(reader, [])]
+        columns = {key: names.index(alias) for key, aliases in CSV_COLUMNS.items() for alias in aliases if alias in names}
+        if 'breed' not in columns or 'stock' not in columns:
+            raise MagnetError('В CSV нужны колонки breed и stock (порода, остаток)')
+        for row in reader:
+            if any(cell.strip() for cell in row):
+                yield reader.line_num, {key: row[i] if i < len(row) else '' for key, i in columns.items()}
+    except csv.Error as e:
+        raise MagnetError('CSV не разобран (строка %d): %s' % (reader.line_num, e))
+
+
+def import_inventory(cur, conn, records, dry_run=False, reason='import', actor=None):
+    """Остатки из records ((номер, запись)) на склад: новые породы добавляются, у существующих
+    разница остатков пишется движением reason, если остаток другой. Сводка — добавленные, изменённые
+    (было/стало), без изменений и ошибки по строкам; повтор породы — ошибка, берётся первая строка.
+    dry_run считает то же самое и откатывает транзакцию."""
+    summary = {'total': 0, 'added': [], 'changed': [], 'unchanged': 0, 'errors': [], 'dry_run': dry_run}
+    chunk, seen = {}, {}
+
+    def flush():
+        rows = repo.upsert_inventory(cur, list(chunk.values()), reason, actor)
+        for breed, old_stock, new_stock in rows:
+            if old_stock is None:
+                summary['added'].append({'breed': breed, 'stock': new_stock})
+            else:
+                summary['changed'].append({'breed': breed, 'old_stock': old_stock, 'new_stock': new_stock})
+        summary['unchanged'] += len(chunk) - len(rows)
+        chunk.clear()
+
+    for line, record in records:
+        try:
+            item = _inventory_item(record if isinstance(record, dict) else {})
+        except ValueError as e:
+            summary['errors'].append({'line': line, 'error': str(e)})
+            continue
+        if item[0] in seen:
+            summary['errors'].append({'line': line, 'error': 'Порода «%s» уже была в строке %s' % (item[0], seen[item[0]])})
+            continue
+        seen[item[0]] = line
+        summary['total'] += 1
+        chunk[item[0]] = item
+        if len(chunk) >= IMPORT_CHUNK:
+            flush()
+    if chunk:
+        flush()
+
+    if dry_run:
+        conn.rollback()
+    else:
+        conn.commit()
+    return summary
+
+
+def remove_magnet(cur, conn, magnet_id, actor=None):
     magnet = repo.get_magnet_by_id(cur, magnet_id)
     if not magnet:
         raise MagnetError('Магнит не найден', 404)
-    repo.restore_magnet_stock(cur, magnet[1])
+    repo.restore_magnet_stock(cur, magnet, actor)
     repo.delete_magnet(cur, magnet_id)
     conn.commit()
     return {'ok': True}
@@ -1,12 +1,14 @@
 import json
 import re
-from utils import OPTIONS_RESPONSE, ok, err, db
-import repository as repo
+from utils import OPTIONS_RESPONSE, ok, err, ndjson, db, instrumented, log_lookup_event, RequestContext
 import service
 
 
+@instrumented
 def handler(event, context):
-    """Поиск выданных магнитов и бонусов клиента по номеру телефона"""
+    """Поиск выданных магнитов и бонусов клиента по номеру телефона.
+    {"phones": [...], "registration_ids": [...], "format": "ndjson"} — пакетный поиск для менеджера;
+    ndjson — запись на строку, тело ответа собирается целиком (не потоковое)."""
     if event.get('httpMethod') == 'OPTIONS':
         return OPTIONS_RESPONSE
 
@@ -14,27 +16,43 @@ def handler(event, context):
         return err('Method not allowed', 405)
 
     body = json.loads(event.get('body', '{}'))
+    if 'phones' in body or 'registration_ids' in body:
+        return _batch(event, body)
+
     raw_phone = (body.get('phone') or '').strip()
     digits = re.sub(r'\D', '', raw_phone)
 
     if len(digits) < 10:
         return err('Введите корректный номер телефона')
 
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
-        reg = repo.find_registration_by_phone(cur, digits[-10:])
+        row, collection = service.lookup(cur, digits[-10:])
 
-        if not reg:
-            repo.log_not_found(cur, raw_phone)
-            conn.commit()
+        if not row:
+            log_lookup_event(raw_phone, 'not_found')
             return err('Участник с таким номером не найден. Сначала зарегистрируйтесь в акции.', 404)
 
         if body.get('check_only'):
-            consent_info = service.check_consent(cur, reg[0])
-            return ok({'exists': True, **consent_info})
-
-        data = service.build_collection(cur, reg)
-        return ok(data)
-    finally:
-        conn.close()
+            return ok({'exists': True, **service.check_consent(cur, row)})
+
+        return ok(service.build_collection(cur, row, collection))
+
+
+def _batch(event, body):
+    phones = body.get('phones') or []
+    ids = body.get('registration_ids') or []
+    if not isinstance(phones, list) or not isinstance(ids, list):
+        return err('phones и registration_ids должны быть списками')
+    if len(phones) + len(ids) > service.LOOKUP_BATCH_MAX:
+        return err('Не больше %d телефонов и id за запрос' % service.LOOKUP_BATCH_MAX)
+    if not all(isinstance(i, int) or (isinstance(i, str) and i.isdigit()) for i in ids):
+        return err('registration_ids должны быть числами')
+
+    with RequestContext(event) as ctx:
+        if not ctx.actor:
+            return err('Не авторизован', 401)
+        records = service.batch_collections(ctx.conn, phones, ids)
+        if body.get('format') == 'ndjson':
+            return ndjson(records, event)
+        return ok({'clients': list(records)})
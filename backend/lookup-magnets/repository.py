@@ -1,95 +1,109 @@
+from utils import run_prepared
+
 SCHEMA = 't_p65563100_joywood_magnets_app'
-CV_FORMULA = "COALESCE(SUM(CASE cm2.stars WHEN 1 THEN 150 WHEN 2 THEN 350 WHEN 3 THEN 700 ELSE 0 END), 0)"
 
 
-def find_registration_by_phone(cur, digits_10):
-    cur.execute(
-        "SELECT r.id, r.name, r.phone FROM %s.registrations r "
-        "WHERE regexp_replace(r.phone, '\\D', '', 'g') LIKE '%%%s%%' LIMIT 1"
-        % (SCHEMA, digits_10)
-    )
+def lookup_collection(cur, digits_10, cached_id=0, cached_version=-1):
+    """Строка PREPARED['lookup_collection'] или None, если участник не найден.
+    Магниты и бонусы в ней — NULL, если версия коллекции совпала с cached_id/cached_version."""
+    run_prepared(cur, 'lookup_collection', (digits_10, int(cached_id), int(cached_version)))
     return cur.fetchone()
 
 
-def log_not_found(cur, raw_phone):
-    cur.execute(
-        "INSERT INTO %s.lookup_log (phone, event, details) VALUES ('%s', 'not_found', NULL)"
-        % (SCHEMA, raw_phone.replace("'", "''"))
-    )
-
-
-def get_setting(cur, key):
-    cur.execute(
-        "SELECT value FROM %s.settings WHERE key = '%s'" % (SCHEMA, key.replace("'", "''"))
-    )
-    row = cur.fetchone()
-    return row[0] if row else None
-
-
-def has_consent(cur, registration_id):
-    cur.execute(
-        "SELECT id FROM %s.policy_consents "
-        "WHERE registration_id = %d ORDER BY created_at DESC LIMIT 1"
-        % (SCHEMA, registration_id)
-    )
-    return cur.fetchone() is not None
-
-
-def get_all_magnets(cur, registration_id):
-    cur.execute(
-        "SELECT id, breed, stars, category, given_at, status FROM %s.client_magnets "
-        "WHERE registration_id = %d ORDER BY given_at DESC" % (SCHEMA, registration_id)
-    )
-    return cur.fetchall()
-
-
-def get_inactive_breeds(cur):
-    cur.execute("SELECT breed FROM %s.magnet_inventory WHERE active = false" % SCHEMA)
-    return set(r[0] for r in cur.fetchall())
-
-
-def get_bonuses(cur, registration_id):
-    cur.execute(
-        "SELECT id, milestone_count, milestone_type, reward, given_at FROM %s.bonuses "
-        "WHERE registration_id = %d ORDER BY given_at DESC" % (SCHEMA, registration_id)
-    )
-    return cur.fetchall()
-
-
-def get_all_rating_stats(cur):
+def lookup_collections(cur, phones_10, registration_ids):
+    """Коллекции многих участников одним запросом: по телефонам (первая регистрация на номер,
+    как в lookup_collection) и по id. Строки (id, name, phone, phone_digits, magnets, in_transit, bonuses, xp)
+    по возрастанию id; cur может быть именованным курсором — тогда они читаются порциями."""
+    cur.execute("""
+        WITH reg AS (
+            (SELECT DISTINCT ON (phone_digits) id, name, phone, phone_digits
+             FROM %s.registrations WHERE phone_digits = ANY(%%s) ORDER BY phone_digits, id)
+            UNION
+            SELECT id, name, phone, phone_digits FROM %s.registrations WHERE id = ANY(%%s)
+        ), m AS (
+            SELECT cm.registration_id,
+                   json_agg(json_build_object('id', cm.id, 'breed', cm.breed, 'stars', cm.stars,
+                            'category', cm.category, 'given_at', cm.given_at::text, 'status', cm.status)
+                            ORDER BY cm.given_at DESC) FILTER (WHERE cm.status <> 'in_transit') AS magnets,
+                   json_agg(json_build_object('id', cm.id, 'stars', cm.stars,
+                            'category', cm.category, 'given_at', cm.given_at::text)
+                            ORDER BY cm.given_at DESC) FILTER (WHERE cm.status = 'in_transit') AS in_transit
+            FROM %s.client_magnets cm
+            WHERE cm.registration_id IN (SELECT id FROM reg)
+            GROUP BY cm.registration_id
+        ), b AS (
+            SELECT registration_id,
+                   json_agg(json_build_object('id', id, 'milestone_count', milestone_count,
+                            'milestone_type', milestone_type, 'reward', reward, 'given_at', given_at::text)
+                            ORDER BY given_at DESC) AS bonuses
+            FROM %s.bonuses
+            WHERE registration_id IN (SELECT id FROM reg)
+            GROUP BY registration_id
+        )
+        SELECT reg.id, reg.name, reg.phone, reg.phone_digits,
+               COALESCE(m.magnets, '[]'), COALESCE(m.in_transit, '[]'), COALESCE(b.bonuses, '[]'),
+               COALESCE(s.xp, 0)
+        FROM reg
+        LEFT JOIN m ON m.registration_id = reg.id
+        LEFT JOIN b ON b.registration_id = reg.id
+        LEFT JOIN %s.registration_summary s ON s.registration_id = reg.id
+        ORDER BY reg.id
+    """ % (SCHEMA, SCHEMA, SCHEMA, SCHEMA, SCHEMA), (list(phones_10), [int(i) for i in registration_ids]))
+
+
+def get_ranks(cur, registration_ids):
+    """(версия leaderboard, {id: (rank_magnets, rank_value, collection_value)}) — ранги по индексам
+    leaderboard, как get_rank, пачкой; версия приходит и тогда, когда в рейтинге никого из них нет."""
+    cur.execute("""
+        SELECT v.last_value, l.registration_id,
+            (SELECT COUNT(*) FROM %s.leaderboard o
+             WHERE (-o.magnets, o.last_magnet_at, o.registration_id)
+                 < (-l.magnets, l.last_magnet_at, l.registration_id)) + 1,
+            (SELECT COUNT(*) FROM %s.leaderboard o
+             WHERE (-o.collection_value, o.last_magnet_at, o.registration_id)
+                 < (-l.collection_value, l.last_magnet_at, l.registration_id)) + 1,
+            l.collection_value
+        FROM %s.leaderboard_version v
+        LEFT JOIN %s.leaderboard l ON l.registration_id = ANY(%%s)
+    """ % (SCHEMA, SCHEMA, SCHEMA, SCHEMA), ([int(i) for i in registration_ids],))
+    rows = cur.fetchall()
+    return rows[0][0], {r[1]: r[2:] for r in rows if r[1] is not None}
+
+
+def get_rank(cur, registration_id):
+    """(версия leaderboard, rank_magnets, rank_value, collection_value) одного участника: число строк
+    впереди + 1, один диапазон idx_leaderboard_rank_*. Ранги None, если участника нет в рейтинге."""
     cur.execute("""
-        SELECT r2.id, COUNT(cm2.id) AS total_magnets, %s AS collection_value,
-               MAX(cm2.given_at) AS last_magnet_at
-        FROM %s.registrations r2
-        LEFT JOIN %s.client_magnets cm2
-            ON cm2.registration_id = r2.id AND cm2.status = 'revealed'
-        WHERE r2.registered = true
-        GROUP BY r2.id
-    """ % (CV_FORMULA, SCHEMA, SCHEMA))
-    return cur.fetchall()
+        SELECT v.last_value, r.rank_magnets, r.rank_value, r.collection_value
+        FROM %s.leaderboard_version v
+        LEFT JOIN (
+            SELECT
+                (SELECT COUNT(*) FROM %s.leaderboard o
+                 WHERE (-o.magnets, o.last_magnet_at, o.registration_id)
+                     < (-l.magnets, l.last_magnet_at, l.registration_id)) + 1 AS rank_magnets,
+                (SELECT COUNT(*) FROM %s.leaderboard o
+                 WHERE (-o.collection_value, o.last_magnet_at, o.registration_id)
+                     < (-l.collection_value, l.last_magnet_at, l.registration_id)) + 1 AS rank_value,
+                l.collection_value
+            FROM %s.leaderboard l WHERE l.registration_id = %d
+        ) r ON true
+    """ % (SCHEMA, SCHEMA, SCHEMA, SCHEMA, int(registration_id)))
+    return cur.fetchone()
 
 
-def get_top_by_magnets(cur):
-    cur.execute("""
-        SELECT r2.id, r2.name, COUNT(cm2.id) AS total_magnets, %s AS collection_value
-        FROM %s.registrations r2
-        LEFT JOIN %s.client_magnets cm2
-            ON cm2.registration_id = r2.id AND cm2.status = 'revealed'
-        WHERE r2.registered = true
-        GROUP BY r2.id, r2.name
-        ORDER BY total_magnets DESC, MAX(cm2.given_at) ASC LIMIT 3
-    """ % (CV_FORMULA, SCHEMA, SCHEMA))
-    return [{'id': r[0], 'name': r[1], 'total_magnets': r[2], 'collection_value': int(r[3])} for r in cur.fetchall()]
+def _top(key):
+    return """
+        (SELECT COALESCE(json_agg(json_build_object('id', t.registration_id, 'name', t.name,
+                'total_magnets', t.magnets, 'collection_value', t.collection_value)
+                ORDER BY -t.%(k)s, t.last_magnet_at, t.registration_id), '[]')
+         FROM (SELECT l.registration_id, r.name, l.magnets, l.collection_value, l.last_magnet_at
+               FROM %(s)s.leaderboard l
+               JOIN %(s)s.registrations r ON r.id = l.registration_id
+               ORDER BY -l.%(k)s, l.last_magnet_at, l.registration_id LIMIT 3) t)
+    """ % {'s': SCHEMA, 'k': key}
 
 
-def get_top_by_value(cur):
-    cur.execute("""
-        SELECT r2.id, r2.name, COUNT(cm2.id) AS total_magnets, %s AS collection_value
-        FROM %s.registrations r2
-        LEFT JOIN %s.client_magnets cm2
-            ON cm2.registration_id = r2.id AND cm2.status = 'revealed'
-        WHERE r2.registered = true
-        GROUP BY r2.id, r2.name
-        ORDER BY collection_value DESC, MAX(cm2.given_at) ASC LIMIT 3
-    """ % (CV_FORMULA, SCHEMA, SCHEMA))
-    return [{'id': r[0], 'name': r[1], 'total_magnets': r[2], 'collection_value': int(r[3])} for r in cur.fetchall()]
\ No newline at end of file
+def get_board(cur):
+    """(число участников, топ-3 по магнитам, топ-3 по ценности) одним запросом."""
+    cur.execute("SELECT (SELECT COUNT(*) FROM %s.leaderboard), %s, %s" % (SCHEMA, _top('magnets'), _top('collection_value')))
+    return cur.fetchone()
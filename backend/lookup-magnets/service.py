@@ -1,11 +1,27 @@
-import time
+import os
+import re
+import threading
+from collections import OrderedDict
+from utils import encode_json, get_setting, trace_note
 import repository as repo
 
-_rating_cache = None
-_rating_cache_ts = 0
-_RATING_TTL = 300
+# Рейтинг читается из leaderboard (V0035): ранг участника — один запрос по индексам
+# idx_leaderboard_rank_* вместе с версией leaderboard. Число участников и топ-3 ни от кого
+# не зависят — они держатся в контейнере до смены версии и перечитываются одним запросом.
+_board = None
 
-XP_BY_STARS = {1: 10, 2: 25, 3: 50}
+# Собранные коллекции: телефон → (registration_id, collection_version, коллекция, размер JSON).
+# Свежесть проверяет сам lookup_collection по версии в registrations (её поднимают триггеры
+# на client_magnets и bonuses); при совпадении магниты и бонусы не читаются. LRU по числу записей.
+COLLECTION_CACHE_SIZE = int(os.environ.get('COLLECTION_CACHE_SIZE', '1000'))
+_collections = OrderedDict()
+_collections_lock = threading.Lock()
+_collection_stats = {'hits': 0, 'misses': 0, 'json_bytes': 0}
+
+# Пакетный поиск для админки и сверок: не больше LOOKUP_BATCH_MAX телефонов и id за запрос,
+# строки читаются именованным курсором по BATCH_CHUNK.
+LOOKUP_BATCH_MAX = int(os.environ.get('LOOKUP_BATCH_MAX', '500'))
+BATCH_CHUNK = 200
 
 LEVELS = [
     (0,    1, 'Сборщик щепы',       3),
@@ -17,52 +33,45 @@ LEVELS = [
 ]
 
 
-def get_rating(cur, reg_id):
-    global _rating_cache, _rating_cache_ts
-    now = time.time()
-    if _rating_cache is None or (now - _rating_cache_ts) > _RATING_TTL:
-        all_stats = repo.get_all_rating_stats(cur)
-        sorted_by_magnets = sorted(all_stats, key=lambda x: (-x[1], x[3] or ''))
-        sorted_by_value = sorted(all_stats, key=lambda x: (-float(x[2]), x[3] or ''))
-        _rating_cache = {
-            'all_stats': all_stats,
-            'sorted_by_magnets': sorted_by_magnets,
-            'sorted_by_value': sorted_by_value,
-            'top_magnets': repo.get_top_by_magnets(cur),
-            'top_value': repo.get_top_by_value(cur),
-            'total_participants': len(all_stats),
+def current_board(cur, version):
+    """Число участников и топ-3 для версии leaderboard; из БД — только если версия сменилась."""
+    global _board
+    board = _board
+    if board is None or board['version'] != version:
+        total, top_magnets, top_value = repo.get_board(cur)
+        board = _board = {
+            'version': version, 'total_participants': total, 'top_magnets': top_magnets, 'top_value': top_value,
         }
-        _rating_cache_ts = now
+    return board
 
-    c = _rating_cache
-    rank_magnets = next((i + 1 for i, x in enumerate(c['sorted_by_magnets']) if x[0] == reg_id), None)
-    rank_value = next((i + 1 for i, x in enumerate(c['sorted_by_value']) if x[0] == reg_id), None)
-    my_stats = next((x for x in c['all_stats'] if x[0] == reg_id), None)
-    my_collection_value = int(my_stats[2]) if my_stats else 0
 
+def get_rating(cur, reg_id):
+    version, rank_magnets, rank_value, my_collection_value = repo.get_rank(cur, reg_id)
+    board = current_board(cur, version)
     return {
         'rank_magnets': rank_magnets,
         'rank_value': rank_value,
-        'total_participants': c['total_participants'],
-        'my_collection_value': my_collection_value,
+        'total_participants': board['total_participants'],
+        'my_collection_value': my_collection_value or 0,
         'my_reg_id': reg_id,
-        'top_magnets': c['top_magnets'],
-        'top_value': c['top_value'],
+        'top_magnets': board['top_magnets'],
+        'top_value': board['top_value'],
     }
 
 
-def check_consent(cur, reg_id):
-    policy_url = repo.get_setting(cur, 'privacy_policy_url') or ''
+def check_consent(cur, row):
+    """Нужно ли согласие с политикой: URL и версия — из кэша настроек, согласие — из строки lookup_collection."""
+    policy_url = get_setting(cur, 'privacy_policy_url') or ''
     needs_consent = False
     policy_version = ''
     if policy_url:
-        policy_version = repo.get_setting(cur, 'privacy_policy_updated_at') or policy_url
-        needs_consent = not repo.has_consent(cur, reg_id)
+        policy_version = get_setting(cur, 'privacy_policy_updated_at') or policy_url
+        needs_consent = not row[8]
     return {'needs_consent': needs_consent, 'policy_url': policy_url, 'policy_version': policy_version}
 
 
-def calc_raccoon(magnets):
-    total_xp = sum(XP_BY_STARS.get(m['stars'], 0) for m in magnets)
+def calc_raccoon(magnets, total_xp):
+    """Уровень енота; total_xp — из registration_summary, породы для слотов — из раскрытых магнитов."""
     current = LEVELS[0]
     for lvl in LEVELS:
         if total_xp >= lvl[0]:
@@ -86,35 +95,107 @@ def calc_raccoon(magnets):
     }
 
 
-def build_collection(cur, reg):
-    reg_id = reg[0]
-
-    all_rows = repo.get_all_magnets(cur, reg_id)
-    magnets = [
-        {'id': r[0], 'breed': r[1], 'stars': r[2], 'category': r[3], 'given_at': str(r[4]), 'status': r[5]}
-        for r in all_rows if r[5] != 'in_transit'
-    ]
-    in_transit = [
-        {'id': r[0], 'stars': r[2], 'category': r[3], 'given_at': str(r[4])}
-        for r in all_rows if r[5] == 'in_transit'
-    ]
-    inactive_breeds = repo.get_inactive_breeds(cur)
-    bonus_rows = repo.get_bonuses(cur, reg_id)
-    bonuses = [
-        {'id': r[0], 'milestone_count': r[1], 'milestone_type': r[2], 'reward': r[3], 'given_at': str(r[4])}
-        for r in bonus_rows
-    ]
-
-    raccoon = calc_raccoon(magnets)
-    rating = get_rating(cur, reg_id)
-
+def _collection(magnets, in_transit, bonuses, xp):
     return {
-        'client_name': reg[1], 'phone': reg[2],
         'magnets': magnets, 'total_magnets': len(magnets),
         'unique_breeds': len(set(m['breed'] for m in magnets)),
         'in_transit': in_transit, 'total_in_transit': len(in_transit),
         'bonuses': bonuses,
-        'inactive_breeds': list(inactive_breeds),
-        'raccoon': raccoon,
-        'rating': rating,
-    }
\ No newline at end of file
+        'raccoon': calc_raccoon(magnets, xp or 0),
+    }
+
+
+def _remember_collection(digits, entry):
+    with _collections_lock:
+        old = _collections.pop(digits, None)
+        if old is not None:
+            _collection_stats['json_bytes'] -= old[3]
+        _collections[digits] = entry
+        _collection_stats['json_bytes'] += entry[3]
+        while len(_collections) > COLLECTION_CACHE_SIZE:
+            _collection_stats['json_bytes'] -= _collections.popitem(last=False)[1][3]
+
+
+def lookup(cur, digits):
+    """(строка lookup_collection, коллекция) по телефону; (None, None) — участник не найден.
+    Коллекция берётся из кэша, если версия в БД не изменилась, иначе собирается из строки."""
+    with _collections_lock:
+        entry = _collections.get(digits)
+        if entry is not None:
+            _collections.move_to_end(digits)
+    row = repo.lookup_collection(cur, digits, *entry[:2]) if entry else repo.lookup_collection(cur, digits)
+    if row is None:
+        return None, None
+
+    hit = row[4] is None
+    if hit:
+        collection = entry[2]
+    else:
+        collection = _collection(*row[4:7], row[9])
+        _remember_collection(digits, (row[0], row[3], collection, len(encode_json(collection))))
+    with _collections_lock:
+        _collection_stats['hits' if hit else 'misses'] += 1
+        lookups = _collection_stats['hits'] + _collection_stats['misses']
+        trace_note('collection_cache', {
+            'hit': hit, 'hit_ratio': round(_collection_stats['hits'] / lookups, 3),
+            'entries': len(_collections), 'json_bytes': _collection_stats['json_bytes'],
+        })
+    return row, collection
+
+
+def build_collection(cur, row, collection):
+    """Ответ: коллекция (из кэша или только что собранная), имя и неактивные породы из строки,
+    рейтинг — из leaderboard."""
+    return {
+        'client_name': row[1], 'phone': row[2],
+        **collection,
+        'inactive_breeds': row[7],
+        'rating': get_rating(cur, row[0]),
+    }
+
+
+def batch_collections(conn, phones, registration_ids):
+    """Записи пакетного поиска, по одной на найденный телефон или id: коллекция, енот и место
+    в рейтинге; ненайденные — {'query', 'error'} в конце. Генератор: строки читаются порциями,
+    ранги — одним запросом на порцию."""
+    cur = conn.cursor()
+
+    wanted_phones, invalid = {}, []
+    for phone in phones:
+        digits = re.sub(r'\D', '', str(phone))
+        if len(digits) < 10:
+            invalid.append(phone)
+        else:
+            wanted_phones.setdefault(digits[-10:], phone)
+    wanted_ids = {int(i): i for i in registration_ids}
+
+    rows_cur = conn.cursor('lookup_batch')
+    repo.lookup_collections(rows_cur, wanted_phones, wanted_ids)
+    while True:
+        rows = rows_cur.fetchmany(BATCH_CHUNK)
+        if not rows:
+            break
+        version, ranks = repo.get_ranks(cur, [r[0] for r in rows])
+        total = current_board(cur, version)['total_participants']
+        for row in rows:
+            # Первая по id строка с этим номером — та же, что нашёл бы одиночный lookup.
+            queries = [q for q in (wanted_phones.pop(row[3], None), wanted_ids.pop(row[0], None)) if q is not None]
+            if not queries:
+                continue
+            position = ranks.get(row[0], (None, None, 0))
+            record = {
+                'id': row[0], 'client_name': row[1], 'phone': row[2],
+                **_collection(*row[4:8]),
+                'rating': {
+                    'rank_magnets': position[0], 'rank_value': position[1],
+                    'my_collection_value': position[2], 'total_participants': total,
+                },
+            }
+            for query in queries:
+                yield {'query': query, **record}
+    rows_cur.close()
+
+    for query in invalid:
+        yield {'query': query, 'error': 'invalid_phone'}
+    for query in (*wanted_phones.values(), *wanted_ids.values()):
+        yield {'query': query, 'error': 'not_found'}
@@ -1,7 +1,6 @@
 import os
 import json
 import base64
-import boto3
 
 CORS = {
     'Access-Control-Allow-Origin': '*',
@@ -13,6 +12,7 @@ BUCKET = 'files'
 
 
 def s3_client():
+    import boto3
     return boto3.client(
         's3',
         endpoint_url='https://bucket.poehali.dev',
@@ -1,8 +1,9 @@
 import json
-from utils import OPTIONS_RESPONSE, ok, err, db
+from utils import OPTIONS_RESPONSE, ok, err, db, instrumented
 import service
 
 
+@instrumented
 def handler(event, context):
     """Регистрация участника акции. Если код Ozon совпадает с уже добавленным менеджером — объединяет записи."""
     if event.get('httpMethod') == 'OPTIONS':
@@ -21,12 +22,10 @@ def handler(event, context):
     if len(phone) < 6:
         return err('Укажите корректный телефон')
 
-    conn = db()
-    try:
-        cur = conn.cursor()
-        result = service.register(cur, conn, name, phone, ozon_order_code)
-        return ok(result)
-    except service.OzonCodeNotFound as e:
-        return err(str(e), 404)
-    finally:
-        conn.close()
+    with db() as conn:
+        try:
+            cur = conn.cursor()
+            result = service.register(cur, conn, name, phone, ozon_order_code)
+            return ok(result)
+        except service.OzonCodeNotFound as e:
+            return err(str(e), 404)
@@ -50,10 +50,3 @@ def insert_registration(cur, name, phone, channel, ozon_order_code):
         )
     )
     return cur.fetchone()
-
-
-def log_event(cur, phone, event_name, details=''):
-    cur.execute(
-        "INSERT INTO %s.lookup_log (phone, event, details) VALUES ('%s', '%s', '%s')"
-        % (SCHEMA, phone.replace("'", "''"), event_name, details.replace("'", "''"))
-    )
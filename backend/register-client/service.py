@@ -1,4 +1,5 @@
 import re
+from utils import log_lookup_event
 import repository as repo
 
 
@@ -17,8 +18,7 @@ def register(cur, conn, name, phone, ozon_order_code):
                 conn.commit()
                 merged = True
             else:
-                repo.log_event(cur, phone, 'ozon_code_not_matched', ozon_order_code)
-                conn.commit()
+                log_lookup_event(phone, 'ozon_code_not_matched', ozon_order_code)
                 raise OzonCodeNotFound(
                     'К сожалению, система не нашла ваши заказы — возможно, они ещё не были совершены. '
                     'Если это не так, для выяснения свяжитесь с нами по номеру +79277760036'
@@ -33,13 +33,12 @@ def register(cur, conn, name, phone, ozon_order_code):
         else:
             channel = 'Ozon' if ozon_order_code else ''
             row = repo.insert_registration(cur, name, phone, channel, ozon_order_code)
-            conn.commit()
             existing_id = row[0]
+            conn.commit()
 
     event_name = 'registered_merged' if merged else 'registered_new'
     details = ozon_order_code or ''
-    repo.log_event(cur, phone, event_name, details)
-    conn.commit()
+    log_lookup_event(phone, event_name, details)
 
     return {'id': existing_id, 'merged': merged, 'message': 'Регистрация успешна'}
 
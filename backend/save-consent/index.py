@@ -1,9 +1,10 @@
 import json
 import re
-from utils import OPTIONS_RESPONSE, ok, err, db
+from utils import OPTIONS_RESPONSE, ok, err, db, instrumented
 import repository as repo
 
 
+@instrumented
 def handler(event: dict, context) -> dict:
     """Сохранение согласия клиента с политикой конфиденциальности"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -20,12 +21,9 @@ def handler(event: dict, context) -> dict:
 
     ip = (event.get('requestContext') or {}).get('identity', {}).get('sourceIp') or ''
 
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         reg_id = repo.find_registration_by_phone(cur, digits[-10:])
         repo.insert_consent(cur, reg_id, phone, policy_version, ip, user_agent)
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
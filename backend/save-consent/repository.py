@@ -1,12 +1,10 @@
+from utils import run_prepared
+
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
 def find_registration_by_phone(cur, digits_10):
-    cur.execute(
-        "SELECT id FROM %s.registrations "
-        "WHERE regexp_replace(phone, '\\D', '', 'g') LIKE '%%%s%%' LIMIT 1"
-        % (SCHEMA, digits_10)
-    )
+    run_prepared(cur, 'find_registration_by_phone', (digits_10,))
     row = cur.fetchone()
     return row[0] if row else None
 
@@ -1,10 +1,11 @@
 import json
 import re
-from utils import OPTIONS_RESPONSE, ok, err, db
+from utils import OPTIONS_RESPONSE, ok, err, db, instrumented
 import repository as repo
 import service
 
 
+@instrumented
 def handler(event, context):
     """POST — сканирование QR-кода магнита породы. Раскрывает магнит, если он 'в пути' у этого пользователя."""
     if event.get('httpMethod') == 'OPTIONS':
@@ -24,8 +25,7 @@ def handler(event, context):
     if len(digits) < 10:
         return err('Некорректный номер телефона')
 
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         reg = repo.find_registration_by_phone(cur, digits[-10:])
         if not reg:
@@ -33,5 +33,3 @@ def handler(event, context):
 
         result = service.scan(cur, conn, reg, breed)
         return ok(result)
-    finally:
-        conn.close()
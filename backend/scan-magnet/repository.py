@@ -1,21 +1,15 @@
+from utils import run_prepared
+
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
 def find_registration_by_phone(cur, digits_10):
-    cur.execute(
-        "SELECT r.id, r.name, r.phone FROM %s.registrations r "
-        "WHERE regexp_replace(r.phone, '\\D', '', 'g') LIKE '%%%s%%' LIMIT 1"
-        % (SCHEMA, digits_10)
-    )
+    run_prepared(cur, 'find_registration_by_phone', (digits_10,))
     return cur.fetchone()
 
 
 def get_magnet_by_breed(cur, registration_id, breed):
-    cur.execute(
-        "SELECT id, status, stars, category FROM %s.client_magnets "
-        "WHERE registration_id = %d AND breed = '%s' LIMIT 1"
-        % (SCHEMA, registration_id, breed.replace("'", "''"))
-    )
+    run_prepared(cur, 'get_magnet_by_breed', (int(registration_id), breed))
     return cur.fetchone()
 
 
@@ -1,8 +1,9 @@
 import json
-from utils import OPTIONS_RESPONSE, ok, err, db
+from utils import OPTIONS_RESPONSE, ok, err, not_modified, db, instrumented, settings_snapshot, forget_settings
 import repository as repo
 
 
+@instrumented
 def handler(event: dict, context) -> dict:
     """Чтение и обновление настроек приложения (например, верификация телефона)"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -11,12 +12,9 @@ def handler(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET')
 
     if method == 'GET':
-        conn = db()
-        try:
-            cur = conn.cursor()
-            return ok(repo.get_all(cur))
-        finally:
-            conn.close()
+        with db() as conn:
+            version, values = settings_snapshot(conn.cursor())
+            return not_modified(event, version) or ok(values, version, event)
 
     if method == 'POST':
         body = json.loads(event.get('body') or '{}')
@@ -24,13 +22,11 @@ def handler(event: dict, context) -> dict:
         value = body.get('value')
         if not key or value is None:
             return err('key и value обязательны')
-        conn = db()
-        try:
+        with db() as conn:
             cur = conn.cursor()
             repo.upsert(cur, key, value)
             conn.commit()
+            forget_settings()
             return ok({'ok': True, 'key': key, 'value': str(value)})
-        finally:
-            conn.close()
 
     return err('Method not allowed', 405)
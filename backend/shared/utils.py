@@ -1,56 +1,807 @@
 # Единый источник правды для всех backend-функций.
 # НЕ редактировать копии в папках функций — только этот файл.
-# После изменений запустить: npm run sync:utils
+# После изменений запустить: python3 scripts/sync_utils.py
+import atexit
+import functools
+import hashlib
 import json
 import os
-import psycopg2
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from datetime import time as dtime
+from decimal import Decimal
+
+# Тяжёлые модули (psycopg2, orjson) грузятся при первом использовании: OPTIONS и ответы
+# без БД не платят за их импорт на холодном старте. См. scripts/import_budget.py.
+psycopg2 = None
+orjson = None
+brotli = None
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
+    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, If-None-Match',
     'Access-Control-Max-Age': '86400',
 }
 
 CORS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+CONDITIONAL = {'Cache-Control': 'no-cache', 'Access-Control-Expose-Headers': 'ETag'}
 
 OPTIONS_RESPONSE = {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
 
-def ok(data: dict) -> dict:
-    return {'statusCode': 200, 'headers': CORS, 'body': json.dumps(data, ensure_ascii=False, default=str)}
+def _response(status: int, body: str, extra: dict | None = None) -> dict:
+    headers = CORS
+    timing = _server_timing()
+    if timing:
+        headers = {**CORS, 'Server-Timing': timing, 'Timing-Allow-Origin': '*'}
+    if extra:
+        headers = {**headers, **extra}
+    return {'statusCode': status, 'headers': headers, 'body': body}
+
+
+# Кодировщик ответов: типизированные пути для значений из БД вместо общего default=str.
+# Формат совпадает с прежним str(): '2026-02-22 10:00:00', Decimal — строкой, UUID и прочее — через str().
+# Кодирует orjson из requirements.txt функции; без него или с JSON_BACKEND=stdlib — json.dumps.
+_JSON_TYPES = {datetime: str, date: str, dtime: str, Decimal: str, set: list}
+
+
+def _json_default(value):
+    encode = _JSON_TYPES.get(type(value))
+    return encode(value) if encode is not None else str(value)
+
+
+_USE_ORJSON = os.environ.get('JSON_BACKEND', '') != 'stdlib'
+_ORJSON_OPTS = 0
+
+
+def _load_orjson() -> bool:
+    global orjson, _USE_ORJSON, _ORJSON_OPTS
+    if orjson is None:
+        try:
+            import orjson as module
+        except ImportError:
+            _USE_ORJSON = False
+            return False
+        _ORJSON_OPTS = module.OPT_PASSTHROUGH_DATETIME | module.OPT_NON_STR_KEYS
+        orjson = module
+    return True
+
+
+def encode_json(data) -> str:
+    if _USE_ORJSON and _load_orjson():
+        try:
+            return orjson.dumps(data, default=_json_default, option=_ORJSON_OPTS).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+# Условные ответы: GET получает сильный ETag (хэш тела или версия данных от handler'а),
+# совпавший If-None-Match даёт пустой 304. Запрос handler передаёт в ok(..., event=event).
+def _etag(version) -> str:
+    return '"%s"' % version
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def _conditional_get(event: dict | None) -> str | None:
+    """If-None-Match запроса, если это GET; None — условные ответы для вызова не нужны."""
+    if not event or event.get('httpMethod') not in ('GET', 'HEAD'):
+        return None
+    headers = event.get('headers') or {}
+    return headers.get('if-none-match') or headers.get('If-None-Match') or ''
+
+
+def _not_modified_response(etag: str) -> dict:
+    trace_note('not_modified', True)
+    return _response(304, '', {**CONDITIONAL, 'ETag': etag})
+
+
+def not_modified(event: dict, version) -> dict | None:
+    """304 без основного запроса, если клиент уже держит данные этой версии; иначе None.
+    Ту же версию нужно передать в ok(data, version=...)."""
+    header = _conditional_get(event)
+    if header and _etag_matches(header, _etag(version)):
+        return _not_modified_response(_etag(version))
+    return None
+
+
+# Сжатие ответов GET: тела от COMPRESS_MIN_BYTES жмутся в br (если установлен brotli) или gzip
+# по Accept-Encoding и отдаются base64 с isBase64Encoded. ETag сжатого ответа — слабый (W/).
+# Запрос передаётся в ok(..., event=event) явно; без него ответ не сжимается и не условный.
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '2048'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+_USE_BROTLI = True
+
+
+def _load_brotli() -> bool:
+    global brotli, _USE_BROTLI
+    if brotli is None and _USE_BROTLI:
+        try:
+            import brotli as module
+        except ImportError:
+            _USE_BROTLI = False
+            return False
+        brotli = module
+    return brotli is not None
+
+
+def _accepted_encoding(event: dict | None) -> str | None:
+    headers = (event or {}).get('headers') or {}
+    accept = headers.get('accept-encoding') or headers.get('Accept-Encoding') or ''
+    offered = set()
+    for part in accept.lower().split(','):
+        name, _, params = part.partition(';')
+        q = params.strip().removeprefix('q=')
+        try:
+            if q and float(q) <= 0:
+                continue
+        except ValueError:
+            pass
+        offered.add(name.strip())
+    if 'br' in offered and _load_brotli():
+        return 'br'
+    if 'gzip' in offered or '*' in offered:
+        return 'gzip'
+    return None
+
+
+def _compress(event: dict | None, response: dict) -> dict:
+    """Сжатое тело GET-ответа. Vary — на любом ответе, который мог быть сжат: иначе кэш отдаст
+    несжатое тело клиенту с gzip или br и наоборот."""
+    body = response['body']
+    if not event or event.get('httpMethod') != 'GET' or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = _accepted_encoding(event)
+    if encoding is None:
+        return {**response, 'headers': {**response['headers'], 'Vary': 'Accept-Encoding'}}
+    raw = body.encode('utf-8')
+    if encoding == 'br':
+        packed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        import gzip
+        packed = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    trace_note('compression', {
+        'encoding': encoding, 'bytes': len(raw), 'compressed': len(packed),
+        'ratio': round(len(raw) / max(len(packed), 1), 2),
+    })
+    import base64
+    headers = {**response['headers'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    if 'ETag' in headers:
+        headers['ETag'] = 'W/' + headers['ETag']
+    return {**response, 'headers': headers, 'body': base64.b64encode(packed).decode('ascii'), 'isBase64Encoded': True}
+
+
+def ok(data: dict, version=None, event: dict | None = None) -> dict:
+    body = encode_json(data)
+    header = _conditional_get(event)
+    if header is None:
+        return _compress(event, _response(200, body))
+    if version is None:
+        version = hashlib.blake2b(body.encode('utf-8'), digest_size=12).hexdigest()
+    etag = _etag(version)
+    if _etag_matches(header, etag):
+        return _not_modified_response(etag)
+    return _compress(event, _response(200, body, {**CONDITIONAL, 'ETag': etag}))
+
+
+def ndjson(records, event: dict | None = None) -> dict:
+    """200 с телом NDJSON: строка encode_json на запись. Ответ функции — одно тело, поэтому оно
+    целиком собирается в памяти: это построчный формат для клиента, а не потоковая отдача."""
+    body = ''.join(encode_json(record) + '\n' for record in records)
+    return _compress(event, _response(200, body, {'Content-Type': 'application/x-ndjson'}))
 
 
 def err(message: str, status: int = 400) -> dict:
-    return {'statusCode': status, 'headers': CORS, 'body': json.dumps({'error': message}, ensure_ascii=False)}
+    return _response(status, encode_json({'error': message}))
+
+
+# Инструментирование вызова: каждый запрос к БД пишется в статистику текущего вызова,
+# в конце handler'а — одна JSON-строка в лог и заголовок Server-Timing в ответе.
+# SQL_EXPLAIN_SLOWEST=N добавляет в лог EXPLAIN для N самых медленных запросов.
+SQL_EXPLAIN_SLOWEST = int(os.environ.get('SQL_EXPLAIN_SLOWEST', '0'))
+
+_trace = threading.local()
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_SPACES = re.compile(r'\s+')
+
+
+def _normalize_sql(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return _SQL_SPACES.sub(' ', _SQL_LITERAL.sub('?', query)).strip()[:300]
+
+
+def _record(cur, started):
+    stats = getattr(_trace, 'stats', None)
+    if stats is not None:
+        stats['queries'].append((cur.query, (time.perf_counter() - started) * 1000, cur.rowcount))
+
+
+def _server_timing() -> str:
+    stats = getattr(_trace, 'stats', None)
+    if stats is None:
+        return ''
+    db_ms = sum(q[1] for q in stats['queries'])
+    total_ms = (time.perf_counter() - stats['started']) * 1000
+    return 'db;dur=%.1f;desc="%d queries", app;dur=%.1f' % (db_ms, len(stats['queries']), total_ms)
+
+
+def trace_note(key: str, value):
+    """Добавляет поле в итоговую строку лога текущего вызова."""
+    stats = getattr(_trace, 'stats', None)
+    if stats is not None:
+        stats['extra'][key] = value
+
+
+def _explain(queries) -> list:
+    plans = []
+    with db() as conn:
+        cur = conn.cursor()
+        for query, ms, _ in sorted(queries, key=lambda q: -q[1])[:SQL_EXPLAIN_SLOWEST]:
+            text = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+            if not re.match(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', text, re.I):
+                continue
+            try:
+                cur.execute('EXPLAIN ' + text)
+                plans.append({'sql': _normalize_sql(text), 'ms': round(ms, 2), 'plan': [r[0] for r in cur.fetchall()]})
+            except psycopg2.Error as e:
+                conn.rollback()
+                plans.append({'sql': _normalize_sql(text), 'ms': round(ms, 2), 'error': str(e).strip()})
+    return plans
+
+
+def _emit_trace(stats, event: dict, context, response):
+    queries = stats['queries']
+    line = {
+        'fn': getattr(context, 'function_name', None) or os.environ.get('FUNCTION_NAME', ''),
+        'method': event.get('httpMethod'),
+        'status': response.get('statusCode') if isinstance(response, dict) else None,
+        'ms': round((time.perf_counter() - stats['started']) * 1000, 2),
+        'queries': len(queries),
+        'db_ms': round(sum(q[1] for q in queries), 2),
+        'rows': sum(max(q[2], 0) for q in queries),
+        'sql': [{'sql': _normalize_sql(q[0]), 'ms': round(q[1], 2), 'rows': q[2]} for q in queries],
+        **stats['extra'],
+    }
+    if SQL_EXPLAIN_SLOWEST and queries:
+        try:
+            line['explain'] = _explain(queries)
+        except Exception as e:
+            line['explain'] = [{'error': str(e)}]
+    print(json.dumps(line, ensure_ascii=False, default=str))
+
+
+def instrumented(handler):
+    """Декоратор handler'а: собирает статистику SQL вызова и пишет её одной строкой в лог."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        stats = {'started': time.perf_counter(), 'queries': [], 'extra': {}}
+        _trace.stats = stats
+        response = None
+        try:
+            response = handler(event, context)
+        finally:
+            # lookup_log пишется, пока статистика вызова открыта: в sync INSERT попадает
+            # в число запросов и в Server-Timing ответа.
+            events = stats.pop('log_events', None)
+            if events:
+                _flush_lookup_log(events)
+                stats['extra']['lookup_log'] = {'events': len(events), 'mode': LOOKUP_LOG_MODE, **_log_stats}
+                if 'Server-Timing' in ((response or {}).get('headers') or {}):
+                    response = {**response, 'headers': {**response['headers'], 'Server-Timing': _server_timing()}}
+            _trace.stats = None
+            _trace.last = stats
+            if event.get('httpMethod') != 'OPTIONS':
+                _emit_trace(stats, event, context, response)
+        return response
+
+    return wrapper
+
+
+def last_trace() -> dict | None:
+    """Статистика последнего завершённого вызова — для локального прогона тестов."""
+    return getattr(_trace, 'last', None)
+
+
+# Пул соединений живёт на уровне модуля и переживает вызовы в тёплом контейнере,
+# поэтому TCP+TLS+auth рукопожатие платится только на холодном старте.
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', '300'))
+POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+_pool = []
+_pool_lock = threading.Lock()
+
+
+InstrumentedCursor = None
+_PoolConnection = None
+_driver_lock = threading.Lock()
+
+
+def _load_driver():
+    """Импортирует psycopg2 и объявляет классы курсора и соединения — один раз на контейнер."""
+    global psycopg2, InstrumentedCursor, _PoolConnection
+    with _driver_lock:
+        if psycopg2 is not None:
+            return
+        import psycopg2 as driver
+        from psycopg2 import extensions
+
+        class _InstrumentedCursor(extensions.cursor):
+            """Курсор, записывающий текст, длительность и число строк каждого запроса."""
+
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _record(self, started)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _record(self, started)
+
+        class _Connection(extensions.connection):
+            """Соединение пула; помнит, какие prepared statements уже подготовлены на сервере."""
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared = set()
+
+        InstrumentedCursor, _PoolConnection = _InstrumentedCursor, _Connection
+        psycopg2 = driver
+
+
+def _connect():
+    if psycopg2 is None:
+        _load_driver()
+    return psycopg2.connect(
+        os.environ['DATABASE_URL'], connection_factory=_PoolConnection, cursor_factory=InstrumentedCursor,
+    )
+
+
+def _is_alive(conn) -> bool:
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _acquire():
+    now = time.monotonic()
+    while True:
+        with _pool_lock:
+            if not _pool:
+                break
+            conn, released_at = _pool.pop()
+        idle = now - released_at
+        if conn.closed or idle > POOL_MAX_IDLE:
+            _discard(conn)
+            continue
+        if idle > POOL_PING_AFTER and not _is_alive(conn):
+            _discard(conn)
+            continue
+        return conn
+    return _connect()
+
+
+def _release(conn):
+    if conn.closed:
+        return
+    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            _discard(conn)
+            return
+    with _pool_lock:
+        if len(_pool) < POOL_SIZE:
+            _pool.append((conn, time.monotonic()))
+            return
+    _discard(conn)
+
+
+def _discard(conn):
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
 
 
-def db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+class PooledConnection:
+    """Соединение, арендованное из пула. close() и выход из with возвращают его в пул."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError('connection already returned to pool')
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            _release(conn)
+
+
+def db() -> PooledConnection:
+    """Соединение из пула с проверкой живости. Использовать как `with db() as conn:`."""
+    return PooledConnection(_acquire())
 
 
 SCHEMA = 't_p65563100_joywood_magnets_app'
 
 
-def resolve_actor(event: dict) -> str | None:
-    """Возвращает email менеджера по X-Session-Id заголовку, или None если сессия не найдена."""
+# Горячие запросы объявлены один раз и выполняются как серверные prepared statements:
+# PREPARE делается лениво на каждом соединении пула, дальше — только EXECUTE с параметрами,
+# и Postgres переиспользует план. DB_PREPARE=0 (например, за pgbouncer в transaction mode)
+# выполняет тот же текст обычным параметризованным запросом.
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') != '0'
+
+PREPARED = {
+    'find_registration_by_phone': (
+        f"SELECT id, name, phone FROM {SCHEMA}.registrations WHERE phone_digits = $1 ORDER BY id LIMIT 1"
+    ),
+    'get_magnet_by_breed': (
+        f"SELECT id, status, stars, category FROM {SCHEMA}.client_magnets"
+        f" WHERE registration_id = $1 AND breed = $2 LIMIT 1"
+    ),
+    # Блокировка участника до конца транзакции: выдачи одному клиенту идут по очереди, и проверка
+    # «порода уже есть» в give_magnet видит магнит, выданный параллельным запросом.
+    'lock_registration': f"SELECT id, phone FROM {SCHEMA}.registrations WHERE id = $1 FOR NO KEY UPDATE",
+    # Блокировка породы до конца транзакции (после lock_registration): выдачи одной породы идут
+    # по очереди, и остаток в give_magnet — баланс плюс все закоммиченные движения. Накопившиеся
+    # движения породы тут же сворачиваются в баланс (V0042).
+    'lock_breed': f"SELECT {SCHEMA}.lock_inventory_breeds(ARRAY[$1::text])",
+    # Выдача магнита одним запросом: ($1 участник, $2 порода, $3 телефон, $4 звёзды, $5 категория,
+    # $6 кто выдал). Магнит вставляется, если породы ещё нет у участника, а порода активна и остаток
+    # положительный (или её нет на складе); списание — строка -1 в inventory_movements.
+    # Строка: (id, given_at, уже есть, active, остаток до выдачи); id NULL — отказ.
+    'give_magnet': (
+        f"WITH dup AS ("
+        f" SELECT id FROM {SCHEMA}.client_magnets WHERE registration_id = $1 AND breed = $2 LIMIT 1"
+        f"), inv AS ("
+        f" SELECT stock, active FROM {SCHEMA}.magnet_inventory_current WHERE breed = $2"
+        f"), ins AS ("
+        f" INSERT INTO {SCHEMA}.client_magnets"
+        f" (registration_id, phone, breed, stars, category, order_id, status, created_by)"
+        f" SELECT $1, $3, $2, $4, $5,"
+        f" (SELECT id FROM {SCHEMA}.orders WHERE registration_id = $1 ORDER BY created_at DESC LIMIT 1),"
+        f" 'in_transit', $6"
+        f" WHERE NOT EXISTS (SELECT 1 FROM dup)"
+        f" AND NOT EXISTS (SELECT 1 FROM inv WHERE NOT active OR stock <= 0)"
+        f" RETURNING id, given_at, order_id"
+        f"), moved AS ("
+        f" INSERT INTO {SCHEMA}.inventory_movements (breed, delta, reason, registration_id, magnet_id, order_id, actor)"
+        f" SELECT $2, -1, 'give', $1, ins.id, ins.order_id, $6 FROM ins WHERE EXISTS (SELECT 1 FROM inv)"
+        f")"
+        f" SELECT ins.id, ins.given_at, EXISTS (SELECT 1 FROM dup), (SELECT active FROM inv), (SELECT stock FROM inv)"
+        f" FROM (SELECT 1) one LEFT JOIN ins ON true"
+    ),
+    # Вся коллекция участника по телефону за один запрос: регистрация, версия коллекции, магниты
+    # (в пути — без породы), бонусы, неактивные породы, есть ли согласие с политикой и XP енота
+    # из registration_summary.
+    # $2/$3 — id и collection_version из кэша lookup-magnets: если совпали, магниты, бонусы и XP
+    # не собираются (NULL), остаётся одно чтение по индексу. Нет строки — участник не найден.
+    'lookup_collection': (
+        f"WITH reg AS ("
+        f" SELECT id, name, phone, collection_version, (id = $2 AND collection_version = $3) AS cached"
+        f" FROM {SCHEMA}.registrations WHERE phone_digits = $1 ORDER BY id LIMIT 1"
+        f")"
+        f" SELECT reg.id, reg.name, reg.phone, reg.collection_version,"
+        f" CASE WHEN reg.cached THEN NULL ELSE"
+        f" (SELECT COALESCE(json_agg(json_build_object('id', cm.id, 'breed', cm.breed, 'stars', cm.stars,"
+        f" 'category', cm.category, 'given_at', cm.given_at::text, 'status', cm.status) ORDER BY cm.given_at DESC), '[]')"
+        f" FROM {SCHEMA}.client_magnets cm WHERE cm.registration_id = reg.id AND cm.status <> 'in_transit') END,"
+        f" CASE WHEN reg.cached THEN NULL ELSE"
+        f" (SELECT COALESCE(json_agg(json_build_object('id', cm.id, 'stars', cm.stars,"
+        f" 'category', cm.category, 'given_at', cm.given_at::text) ORDER BY cm.given_at DESC), '[]')"
+        f" FROM {SCHEMA}.client_magnets cm WHERE cm.registration_id = reg.id AND cm.status = 'in_transit') END,"
+        f" CASE WHEN reg.cached THEN NULL ELSE"
+        f" (SELECT COALESCE(json_agg(json_build_object('id', b.id, 'milestone_count', b.milestone_count,"
+        f" 'milestone_type', b.milestone_type, 'reward', b.reward, 'given_at', b.given_at::text)"
+        f" ORDER BY b.given_at DESC), '[]')"
+        f" FROM {SCHEMA}.bonuses b WHERE b.registration_id = reg.id) END,"
+        f" (SELECT COALESCE(json_agg(breed), '[]') FROM {SCHEMA}.magnet_inventory WHERE active = false),"
+        f" EXISTS (SELECT 1 FROM {SCHEMA}.policy_consents pc WHERE pc.registration_id = reg.id),"
+        f" CASE WHEN reg.cached THEN NULL ELSE"
+        f" (SELECT s.xp FROM {SCHEMA}.registration_summary s WHERE s.registration_id = reg.id) END"
+        f" FROM reg"
+    ),
+}
+
+_PLACEHOLDER = re.compile(r'\$(\d+)')
+
+
+def run_prepared(cur, name: str, params: tuple = ()):
+    """Выполняет запрос из PREPARED по имени; результат читается из cur как обычно."""
+    conn = cur.connection
+    if not DB_PREPARE or not hasattr(conn, 'prepared'):
+        sql = _PLACEHOLDER.sub(lambda m: '%%(p%s)s' % m.group(1), PREPARED[name].replace('%', '%%'))
+        cur.execute(sql, {'p%d' % (i + 1): v for i, v in enumerate(params)})
+        return
+    if name not in conn.prepared:
+        cur.execute('PREPARE %s AS %s' % (name, PREPARED[name]))
+        conn.prepared.add(name)
+    if params:
+        cur.execute('EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(params))), params)
+    else:
+        cur.execute('EXECUTE %s' % name)
+
+
+# Короткий LRU сессия → email: серия просмотров менеджера не ходит в admin_sessions.
+# Только для GET: выход или отзыв сессии в admin-auth (другой контейнер) этот кэш не видит,
+# поэтому записи всегда сверяют сессию с БД, а отозванная сессия читает не дольше TTL.
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '30'))
+SESSION_CACHE_SIZE = 256
+
+_session_cache = OrderedDict()
+_session_lock = threading.Lock()
+
+
+def _cached_actor(sid: str) -> str | None:
+    with _session_lock:
+        entry = _session_cache.get(sid)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del _session_cache[sid]
+            return None
+        _session_cache.move_to_end(sid)
+        return entry[0]
+
+
+def _remember_actor(sid: str, email: str):
+    with _session_lock:
+        _session_cache[sid] = (email, time.monotonic() + SESSION_CACHE_TTL)
+        _session_cache.move_to_end(sid)
+        while len(_session_cache) > SESSION_CACHE_SIZE:
+            _session_cache.popitem(last=False)
+
+
+def _session_id(event: dict) -> str:
     headers = event.get('headers') or {}
-    sid = headers.get('x-session-id') or headers.get('X-Session-Id') or ''
+    return headers.get('x-session-id') or headers.get('X-Session-Id') or ''
+
+
+def _query_actor(conn, sid: str) -> str | None:
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT u.email FROM {SCHEMA}.admin_sessions s"
+        f" JOIN {SCHEMA}.admin_users u ON u.id = s.user_id"
+        f" WHERE s.id = %s AND s.revoked = false AND s.expires_at > now() AND u.is_active = true",
+        (sid,)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def resolve_actor(event: dict, conn=None) -> str | None:
+    """Возвращает email менеджера по X-Session-Id заголовку, или None если сессия не найдена.
+    Если передан conn — запрос идёт через него, без отдельного соединения; ошибка БД тогда
+    поднимается: откат чужой транзакции молча потерял бы то, что вызывающий уже сделал."""
+    sid = _session_id(event)
     if not sid:
         return None
+    cacheable = event.get('httpMethod') == 'GET'
+    email = _cached_actor(sid) if cacheable else None
+    if email:
+        return email
+    if conn is not None:
+        email = _query_actor(conn, sid)
+    else:
+        try:
+            with db() as own:
+                email = _query_actor(own, sid)
+        except Exception:
+            return None
+    if email and cacheable:
+        _remember_actor(sid, email)
+    elif not email:
+        with _session_lock:
+            _session_cache.pop(sid, None)
+    return email
+
+
+# Настройки (флаги, URL политики) меняются раз в неделю: вся таблица settings живёт в памяти
+# процесса и раз в SETTINGS_TTL секунд сверяется по версии. Версия — count + sum(xmin): её
+# меняет любая запись (settings POST, upload-privacy-policy, ручная правка), писателям
+# ничего бампать не нужно. Запись в этом же процессе сбрасывает кэш через forget_settings().
+SETTINGS_TTL = float(os.environ.get('SETTINGS_TTL', '30'))
+
+_settings = {'version': None, 'values': {}, 'checked_at': 0.0}
+_settings_lock = threading.Lock()
+
+
+def _settings_version(cur) -> str:
+    cur.execute(f"SELECT count(*), COALESCE(sum(xmin::text::bigint), 0) FROM {SCHEMA}.settings")
+    return '%d-%d' % cur.fetchone()
+
+
+def settings_snapshot(cur) -> tuple:
+    """(version, {key: value}) из кэша; в БД — только сверка версии раз в SETTINGS_TTL
+    и перечитывание таблицы, если она изменилась."""
+    now = time.monotonic()
+    with _settings_lock:
+        if _settings['version'] is not None and now - _settings['checked_at'] < SETTINGS_TTL:
+            return _settings['version'], _settings['values']
+    version = _settings_version(cur)
+    if version != _settings['version']:
+        # Версия читается до данных: запись между ними даст новую версию на следующей сверке.
+        cur.execute(f"SELECT key, value FROM {SCHEMA}.settings")
+        values = {row[0]: row[1] for row in cur.fetchall()}
+    else:
+        values = _settings['values']
+    with _settings_lock:
+        _settings.update(version=version, values=values, checked_at=now)
+    trace_note('settings_version', version)
+    return version, values
+
+
+def get_setting(cur, key: str, default=None):
+    return settings_snapshot(cur)[1].get(key, default)
+
+
+def forget_settings():
+    with _settings_lock:
+        _settings.update(version=None, values={}, checked_at=0.0)
+
+
+# Журнал lookup_log: события вызова копятся в буфере и в конце @instrumented пишутся одной
+# пачкой, многострочным INSERT — до того, как handler вернёт ответ. По lookup_log считаются
+# counts_7d в get-registrations, поэтому это режим по умолчанию (sync): Cloud Functions
+# замораживают потоки между вызовами и выгружают контейнер без atexit.
+# LOOKUP_LOG_MODE=async — для долгоживущего процесса: пачка уходит в очередь фонового потока
+# (не больше LOOKUP_LOG_QUEUE пачек, лишние теряются и считаются в dropped), atexit дописывает остаток.
+LOOKUP_LOG_MODE = os.environ.get('LOOKUP_LOG_MODE', 'sync')
+LOOKUP_LOG_QUEUE = int(os.environ.get('LOOKUP_LOG_QUEUE', '1000'))
+LOOKUP_LOG_BATCH = 500
+
+_log_queue = None
+_log_lock = threading.Lock()
+_log_stats = {'written': 0, 'dropped': 0, 'failed': 0}
+
+
+def log_lookup_event(phone: str, event: str, details: str | None = None):
+    """Событие для lookup_log; пишется одной пачкой в конце @instrumented (в sync — до возврата
+    ответа, своим соединением), коммит вызова не нужен."""
+    stats = getattr(_trace, 'stats', None)
+    if stats is not None:
+        stats.setdefault('log_events', []).append((phone, event, details))
+    else:
+        _flush_lookup_log([(phone, event, details)])
+
+
+def _write_lookup_log(events: list):
     try:
-        conn = db()
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                f"SELECT u.email FROM {SCHEMA}.admin_sessions s"
-                f" JOIN {SCHEMA}.admin_users u ON u.id = s.user_id"
-                f" WHERE s.id = %s AND s.revoked = false AND s.expires_at > now() AND u.is_active = true",
-                (sid,)
+        with db() as conn:
+            from psycopg2.extras import execute_values
+            execute_values(
+                conn.cursor(), f"INSERT INTO {SCHEMA}.lookup_log (phone, event, details) VALUES %s", events,
             )
-            row = cur.fetchone()
-            return row[0] if row else None
-        finally:
-            conn.close()
-    except Exception:
-        return None
\ No newline at end of file
+            conn.commit()
+        outcome = 'written'
+    except Exception as e:
+        print(json.dumps({'lookup_log_error': str(e), 'events': len(events)}, ensure_ascii=False))
+        outcome = 'failed'
+    with _log_lock:
+        _log_stats[outcome] += len(events)
+
+
+def _drain_lookup_log(first: list | None = None):
+    import queue
+    batch = list(first or [])
+    while len(batch) < LOOKUP_LOG_BATCH:
+        try:
+            batch.extend(_log_queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        _write_lookup_log(batch)
+
+
+def _lookup_log_worker():
+    while True:
+        _drain_lookup_log(_log_queue.get())
+
+
+def _start_lookup_log_worker():
+    global _log_queue
+    import queue
+    with _log_lock:
+        if _log_queue is not None:
+            return
+        _log_queue = queue.Queue(maxsize=LOOKUP_LOG_QUEUE)
+    threading.Thread(target=_lookup_log_worker, name='lookup-log', daemon=True).start()
+    atexit.register(_drain_lookup_log_at_exit)
+
+
+def _drain_lookup_log_at_exit():
+    while not _log_queue.empty():
+        _drain_lookup_log()
+
+
+def _flush_lookup_log(events: list | None):
+    if not events:
+        return
+    if LOOKUP_LOG_MODE == 'sync':
+        _write_lookup_log(events)
+        return
+    _start_lookup_log_worker()
+    import queue
+    try:
+        _log_queue.put_nowait(events)
+    except queue.Full:
+        with _log_lock:
+            _log_stats['dropped'] += len(events)
+
+
+_UNSET = object()
+
+
+class RequestContext:
+    """Контекст вызова: одно соединение из пула на всё — актор, репозитории, служебные UPDATE.
+
+    with RequestContext(event) as ctx:
+        cur = ctx.cursor()
+        ... ctx.actor ...
+        ctx.conn.commit()
+    """
+
+    def __init__(self, event: dict):
+        self.event = event
+        self._lease = None
+        self._actor = _UNSET
+
+    @property
+    def conn(self) -> PooledConnection:
+        if self._lease is None:
+            self._lease = db()
+        return self._lease
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    @property
+    def actor(self) -> str | None:
+        if self._actor is _UNSET:
+            self._actor = resolve_actor(self.event, self.conn) if _session_id(self.event) else None
+        return self._actor
+
+    def close(self):
+        lease, self._lease = self._lease, None
+        if lease is not None:
+            lease.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,38 +1,18 @@
 import json
-import os
-import psycopg2
-
-SCHEMA = 't_p65563100_joywood_magnets_app'
-
-CORS_HEADERS = {
-    'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
-}
-
-
-def db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-
-def ok(data):
-    return {'statusCode': 200, 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'}, 'body': json.dumps(data, default=str)}
-
-
-def err(msg, code=400):
-    return {'statusCode': code, 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'}, 'body': json.dumps({'error': msg})}
+from utils import OPTIONS_RESPONSE, ok, err, db, SCHEMA, instrumented
 
 
+@instrumented
 def handler(event, context):
     """Управление корзиной: список удалённых клиентов и заказов, восстановление, окончательное удаление"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
+        return OPTIONS_RESPONSE
 
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters') or {}
 
     if method == 'GET':
-        return _list_trash()
+        return _list_trash(event)
 
     if method == 'POST':
         body = json.loads(event.get('body') or '{}')
@@ -53,9 +33,8 @@ def handler(event, context):
     return err('Method not allowed', 405)
 
 
-def _list_trash():
-    conn = db()
-    try:
+def _list_trash(event):
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT r.id, r.name, r.phone, r.channel, r.removed_at, "
@@ -67,7 +46,7 @@ def _list_trash():
         )
         clients = [
             {'id': row[0], 'name': row[1], 'phone': row[2] or '', 'channel': row[3] or '',
-             'removed_at': str(row[4]), 'removed_orders': row[5]}
+             'removed_at': row[4], 'removed_orders': row[5]}
             for row in cur.fetchall()
         ]
         cur.execute(
@@ -80,20 +59,17 @@ def _list_trash():
         )
         orders = [
             {'id': row[0], 'order_code': row[1] or '', 'amount': float(row[2] or 0),
-             'channel': row[3] or '', 'removed_at': str(row[4]),
+             'channel': row[3] or '', 'removed_at': row[4],
              'client_id': row[5], 'client_name': row[6]}
             for row in cur.fetchall()
         ]
-        return ok({'clients': clients, 'orders': orders})
-    finally:
-        conn.close()
+        return ok({'clients': clients, 'orders': orders}, event=event)
 
 
 def _restore_client(client_id):
     if not client_id or not str(client_id).isdigit():
         return err('Укажите client_id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE %s.registrations SET removed_at = NULL WHERE id = %d AND removed_at IS NOT NULL RETURNING id"
@@ -107,15 +83,12 @@ def _restore_client(client_id):
         )
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
 
 
 def _restore_order(order_id):
     if not order_id or not str(order_id).isdigit():
         return err('Укажите order_id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE %s.orders SET removed_at = NULL WHERE id = %d AND removed_at IS NOT NULL RETURNING id"
@@ -125,15 +98,12 @@ def _restore_order(order_id):
             return err('Заказ не найден в корзине', 404)
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
 
 
 def _purge_client(client_id):
     if not str(client_id).isdigit():
         return err('Укажите client_id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT id FROM %s.registrations WHERE id = %d AND removed_at IS NOT NULL"
@@ -149,26 +119,22 @@ def _purge_client(client_id):
         cur.execute("DELETE FROM %s.registrations WHERE id = %d" % (SCHEMA, int(client_id)))
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
 
 
 def _purge_order(order_id):
     if not str(order_id).isdigit():
         return err('Укажите order_id')
-    conn = db()
-    try:
+    with db() as conn:
         cur = conn.cursor()
         cur.execute(
-            "SELECT id FROM %s.orders WHERE id = %d AND removed_at IS NOT NULL"
+            "SELECT id, registration_id FROM %s.orders WHERE id = %d AND removed_at IS NOT NULL"
             % (SCHEMA, int(order_id))
         )
-        if not cur.fetchone():
+        row = cur.fetchone()
+        if not row:
             return err('Заказ не найден в корзине', 404)
         cur.execute("DELETE FROM %s.client_magnets WHERE order_id = %d" % (SCHEMA, int(order_id)))
         cur.execute("DELETE FROM %s.bonuses WHERE order_id = %d" % (SCHEMA, int(order_id)))
         cur.execute("DELETE FROM %s.orders WHERE id = %d" % (SCHEMA, int(order_id)))
         conn.commit()
         return ok({'ok': True})
-    finally:
-        conn.close()
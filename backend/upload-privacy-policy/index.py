@@ -1,8 +1,6 @@
 import os
 import json
 import base64
-import boto3
-import psycopg2
 from datetime import datetime
 
 SCHEMA = 't_p65563100_joywood_magnets_app'
@@ -14,6 +12,7 @@ CORS = {
 
 
 def get_conn():
+    import psycopg2
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
@@ -31,6 +30,7 @@ def handler(event: dict, context) -> dict:
 
     file_data = base64.b64decode(file_b64)
 
+    import boto3
     s3 = boto3.client(
         's3',
         endpoint_url='https://bucket.poehali.dev',
@@ -1,8 +1,6 @@
 import os
 import json
 import base64
-import boto3
-import urllib.request
 
 CORS = {
     'Access-Control-Allow-Origin': '*',
@@ -15,6 +13,7 @@ INDEX_KEY = 'raccoon/index.json'
 
 
 def s3_client():
+    import boto3
     return boto3.client(
         's3',
         endpoint_url='https://bucket.poehali.dev',
@@ -62,6 +61,7 @@ def handler(event: dict, context) -> dict:
         if not source_url:
             return {'statusCode': 400, 'headers': {**CORS, 'Content-Type': 'application/json'},
                     'body': json.dumps({'error': 'url обязателен'})}
+        import urllib.request
         req = urllib.request.Request(source_url, headers={'User-Agent': 'Mozilla/5.0'})
         with urllib.request.urlopen(req, timeout=60) as resp:
             video_data = resp.read()
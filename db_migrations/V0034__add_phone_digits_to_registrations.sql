@@ -0,0 +1,8 @@
+ALTER TABLE t_p65563100_joywood_magnets_app.registrations
+ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(10)
+GENERATED ALWAYS AS (right(regexp_replace(phone, '\D', '', 'g'), 10)) STORED;
+
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.registrations.phone_digits IS 'Последние 10 цифр телефона — ключ поиска участника по номеру';
+
+CREATE INDEX IF NOT EXISTS idx_registrations_phone_digits
+ON t_p65563100_joywood_magnets_app.registrations (phone_digits);
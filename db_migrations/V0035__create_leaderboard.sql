@@ -0,0 +1,31 @@
+-- Материализованный рейтинг: одна строка на зарегистрированного участника.
+-- Пересчитывается триггерами V0045 (функция refresh_leaderboard) в той же транзакции,
+-- где меняются раскрытые магниты участника или флаг registered.
+CREATE TABLE IF NOT EXISTS t_p65563100_joywood_magnets_app.leaderboard (
+    registration_id INTEGER PRIMARY KEY
+        REFERENCES t_p65563100_joywood_magnets_app.registrations(id) ON DELETE CASCADE,
+    magnets INTEGER NOT NULL DEFAULT 0,
+    collection_value INTEGER NOT NULL DEFAULT 0,
+    last_magnet_at TIMESTAMP NOT NULL DEFAULT '-infinity',
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON TABLE t_p65563100_joywood_magnets_app.leaderboard IS 'Рейтинг участников по раскрытым магнитам; ранг = число строк впереди по индексу + 1';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.leaderboard.last_magnet_at IS 'Время последнего раскрытого магнита; -infinity, если магнитов нет. При равенстве выше тот, у кого раньше';
+
+-- Порядок индексов совпадает с порядком рейтинга: больше — выше, при равенстве раньше — выше.
+CREATE INDEX IF NOT EXISTS idx_leaderboard_magnets
+ON t_p65563100_joywood_magnets_app.leaderboard (magnets DESC, last_magnet_at, registration_id);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_value
+ON t_p65563100_joywood_magnets_app.leaderboard (collection_value DESC, last_magnet_at, registration_id);
+
+INSERT INTO t_p65563100_joywood_magnets_app.leaderboard (registration_id, magnets, collection_value, last_magnet_at)
+SELECT r.id, COUNT(cm.id),
+       COALESCE(SUM(CASE cm.stars WHEN 1 THEN 150 WHEN 2 THEN 350 WHEN 3 THEN 700 ELSE 0 END), 0),
+       COALESCE(MAX(cm.given_at), '-infinity')
+FROM t_p65563100_joywood_magnets_app.registrations r
+LEFT JOIN t_p65563100_joywood_magnets_app.client_magnets cm
+    ON cm.registration_id = r.id AND cm.status = 'revealed'
+WHERE r.registered = true
+GROUP BY r.id
+ON CONFLICT (registration_id) DO NOTHING;
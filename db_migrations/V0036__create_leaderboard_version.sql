@@ -0,0 +1,3 @@
+-- Версия leaderboard: refresh_leaderboard берёт nextval при каждом пересчёте строки.
+-- Контейнеры lookup-magnets сверяют last_value со своими топ-3 и числом участников и перечитывают их только при изменении.
+CREATE SEQUENCE IF NOT EXISTS t_p65563100_joywood_magnets_app.leaderboard_version;
@@ -0,0 +1,10 @@
+-- Ключ рейтинга целиком по возрастанию: (-магниты, last_magnet_at, registration_id).
+-- Так «кто впереди» — одно сравнение строк (key) < (key участника), то есть один диапазон индекса:
+-- и для ранга (COUNT), и для окна соседей сверху/снизу, и для страниц.
+DROP INDEX IF EXISTS t_p65563100_joywood_magnets_app.idx_leaderboard_magnets;
+DROP INDEX IF EXISTS t_p65563100_joywood_magnets_app.idx_leaderboard_value;
+
+CREATE INDEX IF NOT EXISTS idx_leaderboard_rank_magnets
+ON t_p65563100_joywood_magnets_app.leaderboard ((-magnets), last_magnet_at, registration_id);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_rank_value
+ON t_p65563100_joywood_magnets_app.leaderboard ((-collection_value), last_magnet_at, registration_id);
@@ -0,0 +1,61 @@
+-- Версия коллекции участника: растёт при любой записи в его client_magnets или bonuses
+-- (выдача, раскрытие, удаление магнита, бонус, удаление заказа, слияние, очистка корзины).
+-- lookup-magnets держит собранные коллекции в памяти и по ней проверяет их свежесть.
+ALTER TABLE t_p65563100_joywood_magnets_app.registrations
+ADD COLUMN IF NOT EXISTS collection_version BIGINT NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.registrations.collection_version IS 'Счётчик изменений магнитов и бонусов участника; ставится триггерами на client_magnets и bonuses';
+
+-- Триггеры уровня оператора: массовая выдача поднимает версию каждого участника один раз.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE t_p65563100_joywood_magnets_app.registrations SET collection_version = collection_version + 1
+        WHERE id IN (SELECT registration_id FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE t_p65563100_joywood_magnets_app.registrations SET collection_version = collection_version + 1
+        WHERE id IN (SELECT registration_id FROM old_rows);
+    ELSE
+        UPDATE t_p65563100_joywood_magnets_app.registrations SET collection_version = collection_version + 1
+        WHERE id IN (SELECT registration_id FROM new_rows UNION SELECT registration_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS client_magnets_collection_insert ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_collection_insert
+AFTER INSERT ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version();
+
+DROP TRIGGER IF EXISTS client_magnets_collection_update ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_collection_update
+AFTER UPDATE ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version();
+
+DROP TRIGGER IF EXISTS client_magnets_collection_delete ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_collection_delete
+AFTER DELETE ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version();
+
+DROP TRIGGER IF EXISTS bonuses_collection_insert ON t_p65563100_joywood_magnets_app.bonuses;
+CREATE TRIGGER bonuses_collection_insert
+AFTER INSERT ON t_p65563100_joywood_magnets_app.bonuses
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version();
+
+DROP TRIGGER IF EXISTS bonuses_collection_update ON t_p65563100_joywood_magnets_app.bonuses;
+CREATE TRIGGER bonuses_collection_update
+AFTER UPDATE ON t_p65563100_joywood_magnets_app.bonuses
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version();
+
+DROP TRIGGER IF EXISTS bonuses_collection_delete ON t_p65563100_joywood_magnets_app.bonuses;
+CREATE TRIGGER bonuses_collection_delete
+AFTER DELETE ON t_p65563100_joywood_magnets_app.bonuses
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_collection_version();
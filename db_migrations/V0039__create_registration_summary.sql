@@ -0,0 +1,148 @@
+-- Сводка по участнику: счётчики магнитов, XP, ценность коллекции и итоги заказов.
+-- Читается списками админки, аналитикой, add-client-manager и lookup-magnets вместо агрегатов
+-- по client_magnets/orders на каждый запрос. Пересчитывается триггерами в той же транзакции,
+-- где меняются магниты или заказы участника; scripts/rebuild_registration_summary.py сверяет
+-- таблицу с источником (registration_summary_source) и пересобирает её.
+CREATE TABLE IF NOT EXISTS t_p65563100_joywood_magnets_app.registration_summary (
+    registration_id INTEGER PRIMARY KEY
+        REFERENCES t_p65563100_joywood_magnets_app.registrations(id) ON DELETE CASCADE,
+    magnets INTEGER NOT NULL DEFAULT 0,
+    star1 INTEGER NOT NULL DEFAULT 0,
+    star2 INTEGER NOT NULL DEFAULT 0,
+    star3 INTEGER NOT NULL DEFAULT 0,
+    unique_breeds INTEGER NOT NULL DEFAULT 0,
+    collection_value INTEGER NOT NULL DEFAULT 0,
+    revealed_magnets INTEGER NOT NULL DEFAULT 0,
+    xp INTEGER NOT NULL DEFAULT 0,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    orders_total NUMERIC(14,2) NOT NULL DEFAULT 0,
+    channels TEXT[] NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON TABLE t_p65563100_joywood_magnets_app.registration_summary IS 'Агрегаты по участнику; ведётся триггерами на client_magnets и orders';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.registration_summary.magnets IS 'Все магниты участника, включая в пути; star1..3, unique_breeds и collection_value — по ним же';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.registration_summary.xp IS 'XP енота по раскрытым магнитам: 10/25/50 за 1/2/3 звезды';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.registration_summary.channels IS 'Различные каналы заказов участника по алфавиту';
+
+CREATE INDEX IF NOT EXISTS idx_registration_summary_top
+ON t_p65563100_joywood_magnets_app.registration_summary (magnets DESC, collection_value DESC);
+
+-- Эталонные агрегаты: триггеры берут из неё строки затронутых участников, скрипт сверки — все.
+CREATE OR REPLACE VIEW t_p65563100_joywood_magnets_app.registration_summary_source AS
+SELECT r.id AS registration_id,
+       COALESCE(m.magnets, 0) AS magnets,
+       COALESCE(m.star1, 0) AS star1,
+       COALESCE(m.star2, 0) AS star2,
+       COALESCE(m.star3, 0) AS star3,
+       COALESCE(m.unique_breeds, 0) AS unique_breeds,
+       COALESCE(m.collection_value, 0) AS collection_value,
+       COALESCE(m.revealed_magnets, 0) AS revealed_magnets,
+       COALESCE(m.xp, 0) AS xp,
+       COALESCE(o.orders_count, 0) AS orders_count,
+       COALESCE(o.orders_total, 0)::NUMERIC(14,2) AS orders_total,
+       COALESCE(o.channels, '{}')::TEXT[] AS channels
+FROM t_p65563100_joywood_magnets_app.registrations r
+LEFT JOIN LATERAL (
+    SELECT COUNT(*)::INTEGER AS magnets,
+           COUNT(*) FILTER (WHERE cm.stars = 1)::INTEGER AS star1,
+           COUNT(*) FILTER (WHERE cm.stars = 2)::INTEGER AS star2,
+           COUNT(*) FILTER (WHERE cm.stars = 3)::INTEGER AS star3,
+           COUNT(DISTINCT cm.breed)::INTEGER AS unique_breeds,
+           SUM(CASE cm.stars WHEN 1 THEN 150 WHEN 2 THEN 350 WHEN 3 THEN 700 ELSE 0 END)::INTEGER AS collection_value,
+           COUNT(*) FILTER (WHERE cm.status <> 'in_transit')::INTEGER AS revealed_magnets,
+           SUM(CASE cm.stars WHEN 1 THEN 10 WHEN 2 THEN 25 WHEN 3 THEN 50 ELSE 0 END)
+               FILTER (WHERE cm.status <> 'in_transit')::INTEGER AS xp
+    FROM t_p65563100_joywood_magnets_app.client_magnets cm
+    WHERE cm.registration_id = r.id
+) m ON true
+LEFT JOIN LATERAL (
+    SELECT COUNT(*)::INTEGER AS orders_count,
+           SUM(o.amount) AS orders_total,
+           array_remove(array_agg(DISTINCT o.channel), NULL) AS channels
+    FROM t_p65563100_joywood_magnets_app.orders o
+    WHERE o.registration_id = r.id
+) o ON true;
+
+-- Пересчёт строк участников целиком из registration_summary_source. Сначала берётся блокировка
+-- их строк в registrations: параллельная транзакция по тому же участнику ждёт коммита этой, и её
+-- пересчёт (новый снимок) видит уже оба изменения — сводка не теряет записи.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.refresh_registration_summary(ids INTEGER[])
+RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM 1 FROM t_p65563100_joywood_magnets_app.registrations
+    WHERE id = ANY(ids) ORDER BY id FOR NO KEY UPDATE;
+
+    INSERT INTO t_p65563100_joywood_magnets_app.registration_summary (
+        registration_id, magnets, star1, star2, star3, unique_breeds, collection_value,
+        revealed_magnets, xp, orders_count, orders_total, channels, updated_at)
+    SELECT s.*, NOW() FROM t_p65563100_joywood_magnets_app.registration_summary_source s
+    WHERE s.registration_id = ANY(ids)
+    ON CONFLICT (registration_id) DO UPDATE SET
+        magnets = EXCLUDED.magnets, star1 = EXCLUDED.star1, star2 = EXCLUDED.star2, star3 = EXCLUDED.star3,
+        unique_breeds = EXCLUDED.unique_breeds, collection_value = EXCLUDED.collection_value,
+        revealed_magnets = EXCLUDED.revealed_magnets, xp = EXCLUDED.xp,
+        orders_count = EXCLUDED.orders_count, orders_total = EXCLUDED.orders_total,
+        channels = EXCLUDED.channels, updated_at = EXCLUDED.updated_at;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM t_p65563100_joywood_magnets_app.refresh_registration_summary(
+            ARRAY(SELECT DISTINCT registration_id FROM new_rows WHERE registration_id IS NOT NULL));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM t_p65563100_joywood_magnets_app.refresh_registration_summary(
+            ARRAY(SELECT DISTINCT registration_id FROM old_rows WHERE registration_id IS NOT NULL));
+    ELSE
+        PERFORM t_p65563100_joywood_magnets_app.refresh_registration_summary(
+            ARRAY(SELECT registration_id FROM new_rows WHERE registration_id IS NOT NULL
+                  UNION SELECT registration_id FROM old_rows WHERE registration_id IS NOT NULL));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS client_magnets_summary_insert ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_summary_insert
+AFTER INSERT ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed();
+
+DROP TRIGGER IF EXISTS client_magnets_summary_update ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_summary_update
+AFTER UPDATE ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed();
+
+DROP TRIGGER IF EXISTS client_magnets_summary_delete ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_summary_delete
+AFTER DELETE ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed();
+
+DROP TRIGGER IF EXISTS orders_summary_insert ON t_p65563100_joywood_magnets_app.orders;
+CREATE TRIGGER orders_summary_insert
+AFTER INSERT ON t_p65563100_joywood_magnets_app.orders
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed();
+
+DROP TRIGGER IF EXISTS orders_summary_update ON t_p65563100_joywood_magnets_app.orders;
+CREATE TRIGGER orders_summary_update
+AFTER UPDATE ON t_p65563100_joywood_magnets_app.orders
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed();
+
+DROP TRIGGER IF EXISTS orders_summary_delete ON t_p65563100_joywood_magnets_app.orders;
+CREATE TRIGGER orders_summary_delete
+AFTER DELETE ON t_p65563100_joywood_magnets_app.orders
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.registration_summary_changed();
+
+INSERT INTO t_p65563100_joywood_magnets_app.registration_summary (
+    registration_id, magnets, star1, star2, star3, unique_breeds, collection_value,
+    revealed_magnets, xp, orders_count, orders_total, channels)
+SELECT * FROM t_p65563100_joywood_magnets_app.registration_summary_source
+ON CONFLICT (registration_id) DO NOTHING;
@@ -0,0 +1,33 @@
+-- Версия строки склада для дельта-синхронизации: любая вставка или изменение строки magnet_inventory
+-- (выдача, удаление и возврат магнита, PUT и импорт остатков, toggle_active, ручной SQL) берёт
+-- новое значение из последовательности magnet_inventory_version. give-magnet?action=inventory&since=N
+-- отдаёт строки с version > N и новую отметку — max(version).
+CREATE SEQUENCE IF NOT EXISTS t_p65563100_joywood_magnets_app.magnet_inventory_version;
+
+ALTER TABLE t_p65563100_joywood_magnets_app.magnet_inventory
+ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL
+DEFAULT nextval('t_p65563100_joywood_magnets_app.magnet_inventory_version');
+
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.magnet_inventory.version IS 'Значение magnet_inventory_version на момент последней записи строки; ставится триггером';
+
+CREATE INDEX IF NOT EXISTS idx_magnet_inventory_version
+ON t_p65563100_joywood_magnets_app.magnet_inventory (version);
+
+-- Последовательность выдаёт номера в порядке вызова, а не коммита: транзакция с меньшей версией
+-- может закоммититься позже большей, и клиент, уже получивший большую отметку, её пропустит.
+-- Поэтому пишущая транзакция держит разделяемую advisory-блокировку до коммита, а чтение склада
+-- (repository.lock_inventory_writers) берёт исключительную: ждёт, пока все версии до отметки
+-- станут видны, и на время чтения не пускает новые.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.bump_inventory_version()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock_shared(hashtext('magnet_inventory'));
+    NEW.version := nextval('t_p65563100_joywood_magnets_app.magnet_inventory_version');
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS magnet_inventory_version ON t_p65563100_joywood_magnets_app.magnet_inventory;
+CREATE TRIGGER magnet_inventory_version
+BEFORE INSERT OR UPDATE ON t_p65563100_joywood_magnets_app.magnet_inventory
+FOR EACH ROW EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_inventory_version();
@@ -0,0 +1,65 @@
+-- Журнал движений склада магнитов. Выдачи, возвраты и правки остатков не меняют строку породы в
+-- magnet_inventory (на «Падук» раньше упиралось создание каждого нового клиента), а дописывают
+-- строку сюда. Текущий остаток = magnet_inventory.stock (свёрнутый баланс) + сумма несвёрнутых
+-- движений; compact_inventory_movements() периодически переносит их в баланс.
+CREATE TABLE IF NOT EXISTS t_p65563100_joywood_magnets_app.inventory_movements (
+    id BIGSERIAL PRIMARY KEY,
+    breed VARCHAR(100) NOT NULL,
+    delta INTEGER NOT NULL,
+    reason VARCHAR(20) NOT NULL,
+    registration_id INTEGER,
+    magnet_id INTEGER,
+    order_id INTEGER,
+    actor TEXT,
+    version BIGINT NOT NULL DEFAULT nextval('t_p65563100_joywood_magnets_app.magnet_inventory_version'),
+    compacted BOOLEAN NOT NULL DEFAULT false,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON TABLE t_p65563100_joywood_magnets_app.inventory_movements IS 'Движения остатков магнитов: выдачи, возвраты, правки и импорт склада';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.inventory_movements.reason IS 'give, give_bulk, paduk, remove, order_delete, client_delete, set, import';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.inventory_movements.version IS 'Значение magnet_inventory_version: по нему give-magnet отдаёт дельту склада';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.inventory_movements.compacted IS 'Движение уже учтено в magnet_inventory.stock';
+
+CREATE INDEX IF NOT EXISTS idx_inventory_movements_pending
+ON t_p65563100_joywood_magnets_app.inventory_movements (breed) WHERE NOT compacted;
+
+CREATE INDEX IF NOT EXISTS idx_inventory_movements_breed
+ON t_p65563100_joywood_magnets_app.inventory_movements (breed, id);
+
+-- Та же версия и advisory-блокировка, что у строк склада (V0040): движение — тоже изменение склада.
+DROP TRIGGER IF EXISTS inventory_movements_version ON t_p65563100_joywood_magnets_app.inventory_movements;
+CREATE TRIGGER inventory_movements_version
+BEFORE INSERT ON t_p65563100_joywood_magnets_app.inventory_movements
+FOR EACH ROW EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_inventory_version();
+
+-- Склад с текущими остатками. version — последняя запись породы: строки склада или её движения.
+CREATE OR REPLACE VIEW t_p65563100_joywood_magnets_app.magnet_inventory_current AS
+SELECT i.breed, i.stars, i.category, i.active,
+       i.stock + COALESCE(p.delta, 0) AS stock,
+       GREATEST(i.version, COALESCE(p.version, 0)) AS version
+FROM t_p65563100_joywood_magnets_app.magnet_inventory i
+LEFT JOIN LATERAL (
+    SELECT SUM(m.delta)::INTEGER AS delta, MAX(m.version) AS version
+    FROM t_p65563100_joywood_magnets_app.inventory_movements m
+    WHERE m.breed = i.breed AND NOT m.compacted
+) p ON true;
+
+-- Свёртка: несвёрнутые движения помечаются и их сумма прибавляется к балансу одним оператором.
+-- Движения незакоммиченных транзакций не видны и не помечаются — попадут в следующую свёртку.
+-- Строка породы обновляется и при нулевой сумме: её версия не должна стать меньше версий движений.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.compact_inventory_movements()
+RETURNS TABLE (breed VARCHAR, delta BIGINT) LANGUAGE sql AS $$
+    WITH moved AS (
+        UPDATE t_p65563100_joywood_magnets_app.inventory_movements SET compacted = true
+        WHERE NOT compacted
+        RETURNING inventory_movements.breed, inventory_movements.delta
+    ), sums AS (
+        SELECT moved.breed, SUM(moved.delta) AS delta FROM moved GROUP BY moved.breed
+    ), applied AS (
+        UPDATE t_p65563100_joywood_magnets_app.magnet_inventory i
+        SET stock = i.stock + sums.delta, updated_at = now()
+        FROM sums WHERE i.breed = sums.breed
+    )
+    SELECT sums.breed, sums.delta FROM sums ORDER BY sums.breed;
+$$;
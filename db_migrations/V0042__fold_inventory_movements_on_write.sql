@@ -0,0 +1,32 @@
+-- Свёртка журнала склада на пути записи. Раньше движения сворачивал только
+-- compact_inventory_movements() из скрипта, и без планировщика несвёрнутые строки — а с ними
+-- сумма, которую считает magnet_inventory_current при каждом чтении, — росли без предела.
+-- Теперь блокировка пород перед списанием (give-magnet, Падук, импорт) сразу сворачивает
+-- породы, у которых накопилось fold_at несвёрнутых движений: под этой блокировкой других
+-- списаний породы нет, а движения незакоммиченных возвратов не видны и дождутся следующей свёртки.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.lock_inventory_breeds(breeds TEXT[], fold_at INTEGER DEFAULT 50)
+RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    b TEXT;
+BEGIN
+    -- Один порядок у всех вызывающих — без взаимных блокировок.
+    FOR b IN SELECT DISTINCT unnest(breeds) ORDER BY 1 LOOP
+        PERFORM pg_advisory_xact_lock(hashtext('magnet_inventory'), hashtext(b));
+    END LOOP;
+
+    WITH due AS (
+        SELECT m.breed FROM t_p65563100_joywood_magnets_app.inventory_movements m
+        WHERE m.breed = ANY(breeds) AND NOT m.compacted
+        GROUP BY m.breed HAVING count(*) >= fold_at
+    ), moved AS (
+        UPDATE t_p65563100_joywood_magnets_app.inventory_movements m SET compacted = true
+        WHERE m.breed IN (SELECT due.breed FROM due) AND NOT m.compacted
+        RETURNING m.breed, m.delta
+    ), sums AS (
+        SELECT moved.breed, SUM(moved.delta) AS delta FROM moved GROUP BY moved.breed
+    )
+    UPDATE t_p65563100_joywood_magnets_app.magnet_inventory i
+    SET stock = i.stock + sums.delta, updated_at = now()
+    FROM sums WHERE i.breed = sums.breed;
+END;
+$$;
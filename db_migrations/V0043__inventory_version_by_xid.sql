@@ -0,0 +1,32 @@
+-- Версия склада — номер пишущей транзакции вместо последовательности под advisory-блокировкой.
+-- В V0040 каждое чтение склада брало исключительную блокировку hashtext('magnet_inventory'),
+-- а каждая запись — разделяемую: опросы склада шли по очереди друг с другом и с выдачами,
+-- импортом и списанием Падука. Теперь блокировок нет. version = pg_current_xact_id() записи;
+-- отметка для клиента — xmin снимка чтения: все транзакции с номером меньше неё завершены,
+-- поэтому всё, что станет видно позже, получит version не меньше отметки. Дельта —
+-- строки с version >= since (строки на границе могут прийти повторно, это безвредно).
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.bump_inventory_version()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.version := pg_current_xact_id()::TEXT::BIGINT;
+    RETURN NEW;
+END;
+$$;
+
+ALTER TABLE t_p65563100_joywood_magnets_app.magnet_inventory
+ALTER COLUMN version SET DEFAULT pg_current_xact_id()::TEXT::BIGINT;
+
+ALTER TABLE t_p65563100_joywood_magnets_app.inventory_movements
+ALTER COLUMN version SET DEFAULT pg_current_xact_id()::TEXT::BIGINT;
+
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.magnet_inventory.version IS 'Номер транзакции последней записи строки; ставится триггером';
+COMMENT ON COLUMN t_p65563100_joywood_magnets_app.inventory_movements.version IS 'Номер транзакции движения: по нему give-magnet отдаёт дельту склада';
+
+-- Старые отметки клиентов — значения последовательности, с номерами транзакций несравнимы.
+-- Все строки получают номер этой транзакции: клиент со старой отметкой получит склад целиком
+-- (отметку больше текущего номера give-magnet тоже считает устаревшей).
+UPDATE t_p65563100_joywood_magnets_app.magnet_inventory SET updated_at = updated_at;
+UPDATE t_p65563100_joywood_magnets_app.inventory_movements
+SET version = pg_current_xact_id()::TEXT::BIGINT WHERE NOT compacted;
+
+DROP SEQUENCE IF EXISTS t_p65563100_joywood_magnets_app.magnet_inventory_version;
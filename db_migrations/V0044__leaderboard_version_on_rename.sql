@@ -0,0 +1,18 @@
+-- Имя участника входит в топ-3 lookup-magnets, который контейнер держит до смены версии
+-- leaderboard, а версия росла только при пересчёте строки рейтинга: после переименования топ
+-- показывал старое имя. Теперь смена имени участника из рейтинга тоже берёт nextval(leaderboard_version).
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.bump_leaderboard_version_on_rename()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM t_p65563100_joywood_magnets_app.leaderboard WHERE registration_id = NEW.id) THEN
+        PERFORM nextval('t_p65563100_joywood_magnets_app.leaderboard_version');
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS registrations_leaderboard_rename ON t_p65563100_joywood_magnets_app.registrations;
+CREATE TRIGGER registrations_leaderboard_rename
+AFTER UPDATE OF name ON t_p65563100_joywood_magnets_app.registrations
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION t_p65563100_joywood_magnets_app.bump_leaderboard_version_on_rename();
@@ -0,0 +1,118 @@
+-- leaderboard ведут триггеры, как registration_summary (V0039) и collection_version (V0038).
+-- Раньше строку пересчитывал запрос refresh_leaderboard, который вызывали вручную из
+-- scan-magnet, give-magnet, add-client-manager, trash-manager и register-client; новый путь
+-- записи без этого вызова молча оставлял рейтинг старым. Теперь строка участника
+-- пересчитывается при любой записи раскрытых магнитов и при смене флага registered.
+
+-- Пересчёт строк участников по раскрытым магнитам; незарегистрированные удаляются из рейтинга.
+-- Блокировка участников — та же, что в refresh_registration_summary: параллельный пересчёт по
+-- тому же участнику ждёт коммита и видит оба изменения. Версия leaderboard растёт один раз.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.refresh_leaderboard(ids INTEGER[])
+RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    IF cardinality(ids) = 0 THEN
+        RETURN;
+    END IF;
+
+    PERFORM 1 FROM t_p65563100_joywood_magnets_app.registrations
+    WHERE id = ANY(ids) ORDER BY id FOR NO KEY UPDATE;
+
+    DELETE FROM t_p65563100_joywood_magnets_app.leaderboard l
+    WHERE l.registration_id = ANY(ids) AND NOT EXISTS (
+        SELECT 1 FROM t_p65563100_joywood_magnets_app.registrations r
+        WHERE r.id = l.registration_id AND r.registered);
+
+    INSERT INTO t_p65563100_joywood_magnets_app.leaderboard
+        (registration_id, magnets, collection_value, last_magnet_at, updated_at)
+    SELECT r.id, COUNT(cm.id),
+           COALESCE(SUM(CASE cm.stars WHEN 1 THEN 150 WHEN 2 THEN 350 WHEN 3 THEN 700 ELSE 0 END), 0),
+           COALESCE(MAX(cm.given_at), '-infinity'), NOW()
+    FROM t_p65563100_joywood_magnets_app.registrations r
+    LEFT JOIN t_p65563100_joywood_magnets_app.client_magnets cm
+        ON cm.registration_id = r.id AND cm.status = 'revealed'
+    WHERE r.id = ANY(ids) AND r.registered
+    GROUP BY r.id
+    ON CONFLICT (registration_id) DO UPDATE SET
+        magnets = EXCLUDED.magnets, collection_value = EXCLUDED.collection_value,
+        last_magnet_at = EXCLUDED.last_magnet_at, updated_at = EXCLUDED.updated_at;
+
+    PERFORM nextval('t_p65563100_joywood_magnets_app.leaderboard_version');
+END;
+$$;
+
+-- Рейтинг зависит только от раскрытых магнитов: выдача в пути его не трогает.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_magnets_changed()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM t_p65563100_joywood_magnets_app.refresh_leaderboard(
+            ARRAY(SELECT DISTINCT registration_id FROM new_rows
+                  WHERE registration_id IS NOT NULL AND status = 'revealed'));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM t_p65563100_joywood_magnets_app.refresh_leaderboard(
+            ARRAY(SELECT DISTINCT registration_id FROM old_rows
+                  WHERE registration_id IS NOT NULL AND status = 'revealed'));
+    ELSE
+        PERFORM t_p65563100_joywood_magnets_app.refresh_leaderboard(
+            ARRAY(SELECT registration_id FROM new_rows WHERE registration_id IS NOT NULL AND status = 'revealed'
+                  UNION SELECT registration_id FROM old_rows WHERE registration_id IS NOT NULL AND status = 'revealed'));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS client_magnets_leaderboard_insert ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_leaderboard_insert
+AFTER INSERT ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_magnets_changed();
+
+DROP TRIGGER IF EXISTS client_magnets_leaderboard_update ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_leaderboard_update
+AFTER UPDATE ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_magnets_changed();
+
+DROP TRIGGER IF EXISTS client_magnets_leaderboard_delete ON t_p65563100_joywood_magnets_app.client_magnets;
+CREATE TRIGGER client_magnets_leaderboard_delete
+AFTER DELETE ON t_p65563100_joywood_magnets_app.client_magnets
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_magnets_changed();
+
+-- Регистрация, снятие регистрации и удаление участника. Строку рейтинга удалённого участника
+-- убирает ON DELETE CASCADE, триггер только поднимает версию.
+CREATE OR REPLACE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_registration_changed()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM nextval('t_p65563100_joywood_magnets_app.leaderboard_version');
+    ELSE
+        PERFORM t_p65563100_joywood_magnets_app.refresh_leaderboard(ARRAY[NEW.id]);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS registrations_leaderboard_insert ON t_p65563100_joywood_magnets_app.registrations;
+CREATE TRIGGER registrations_leaderboard_insert
+AFTER INSERT ON t_p65563100_joywood_magnets_app.registrations
+FOR EACH ROW WHEN (NEW.registered)
+EXECUTE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_registration_changed();
+
+DROP TRIGGER IF EXISTS registrations_leaderboard_registered ON t_p65563100_joywood_magnets_app.registrations;
+CREATE TRIGGER registrations_leaderboard_registered
+AFTER UPDATE OF registered ON t_p65563100_joywood_magnets_app.registrations
+FOR EACH ROW WHEN (OLD.registered IS DISTINCT FROM NEW.registered)
+EXECUTE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_registration_changed();
+
+DROP TRIGGER IF EXISTS registrations_leaderboard_delete ON t_p65563100_joywood_magnets_app.registrations;
+CREATE TRIGGER registrations_leaderboard_delete
+AFTER DELETE ON t_p65563100_joywood_magnets_app.registrations
+FOR EACH ROW WHEN (OLD.registered)
+EXECUTE FUNCTION t_p65563100_joywood_magnets_app.leaderboard_registration_changed();
+
+-- Пути записи без ручного вызова (например, создание клиента менеджером) оставили рейтинг
+-- расходящимся с данными: пересчитываются все зарегистрированные и все строки рейтинга.
+SELECT t_p65563100_joywood_magnets_app.refresh_leaderboard(ARRAY(
+    SELECT id FROM t_p65563100_joywood_magnets_app.registrations WHERE registered
+    UNION SELECT registration_id FROM t_p65563100_joywood_magnets_app.leaderboard));
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сериализации ответов: прежний json.dumps(default=str) против
+utils.encode_json на stdlib и на orjson (если установлен).
+
+Полезная нагрузка имитирует списки get-registrations: клиенты и заказы с
+datetime, Decimal, массивами каналов и кириллицей.
+
+Запуск:
+    python3 scripts/bench_json.py --rows 5000 --runs 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'shared'))
+import utils  # noqa: E402
+
+CHANNELS = ['Ozon', 'WB', 'Сайт', 'Ярмарка']
+NAMES = ['Иван Петров', 'Мария Смирнова', 'Алексей Кузнецов', 'Ольга Соколова']
+
+
+def payload(rows):
+    rnd = random.Random(42)
+    start = datetime(2026, 1, 1, 10, 0, 0)
+    clients = [{
+        'id': i, 'name': rnd.choice(NAMES), 'phone': '+7 (9%02d) %03d-%02d-%02d' % (i % 100, i % 1000, i % 100, i % 97),
+        'channel': rnd.choice(CHANNELS), 'ozon_order_code': '%08d-0001' % i,
+        'created_at': start + timedelta(minutes=i), 'registered': bool(i % 2),
+        'total_amount': Decimal('%d.%02d' % (rnd.randint(0, 50000), rnd.randint(0, 99))),
+        'channels': rnd.sample(CHANNELS, 2), 'comment': 'Комментарий к клиенту %d' % i,
+    } for i in range(rows)]
+    orders = [{
+        'id': i, 'order_code': 'ORD-%06d' % i, 'amount': float(rnd.randint(100, 9000)),
+        'channel': rnd.choice(CHANNELS), 'status': 'done', 'created_at': start + timedelta(minutes=i),
+        'registration_id': i, 'client_name': rnd.choice(NAMES), 'client_phone': '79001234567',
+        'magnet_comment': '', 'comment': '', 'created_by': None,
+    } for i in range(rows)]
+    return {'clients': clients, 'total': rows}, {'orders': orders, 'total': rows}
+
+
+def timed(encode, data, runs):
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        encode(data)
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сериализация ответов: json.dumps против encode_json')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    encoders = [('json.dumps(default=str)', lambda d: json.dumps(d, ensure_ascii=False, default=str))]
+    has_orjson = utils._load_orjson()
+    utils._USE_ORJSON = False
+    encoders.append(('encode_json (stdlib)', utils.encode_json))
+    if has_orjson:
+        encoders.append(('encode_json (orjson)', lambda d: _with_orjson(d)))
+
+    for label, data in zip(('клиенты', 'заказы'), payload(args.rows)):
+        reference = json.loads(encoders[0][1](data))
+        print(f'\n{label}: {args.rows} строк')
+        for name, encode in encoders:
+            assert json.loads(encode(data)) == reference, name
+            print(f'  {name:<26} {timed(encode, data, args.runs):>8.2f} мс')
+    if not has_orjson:
+        print('\norjson не установлен — pip install orjson для третьего варианта')
+
+
+def _with_orjson(data):
+    utils._USE_ORJSON = True
+    try:
+        return utils.encode_json(data)
+    finally:
+        utils._USE_ORJSON = False
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк горячих запросов: обычный SQL с подставленными литералами против
+серверных prepared statements из backend/shared/utils.py (PREPARED).
+
+На тёплом соединении каждый запрос выполняется --runs раз с разными параметрами.
+Печатается среднее время планирования (EXPLAIN ANALYZE → Planning Time) и
+среднее время выполнения со стороны клиента для обоих вариантов.
+
+Запуск:
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/bench_prepared.py --runs 500
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'shared'))
+from utils import PREPARED, SCHEMA  # noqa: E402
+
+# give_magnet и lock_registration пишут и блокируют — в бенчмарке только читающие запросы.
+READ_QUERIES = (
+    'find_registration_by_phone', 'get_magnet_by_breed', 'lookup_collection',
+)
+
+
+def sample_params(cur, runs):
+    cur.execute(
+        "SELECT r.id, r.phone_digits, COALESCE(cm.breed, 'Дуб') FROM %s.registrations r "
+        "LEFT JOIN %s.client_magnets cm ON cm.registration_id = r.id "
+        "ORDER BY random() LIMIT %d" % (SCHEMA, SCHEMA, runs)
+    )
+    rows = cur.fetchall() or [(1, '0000000000', 'Дуб')]
+    rows = (rows * (runs // len(rows) + 1))[:runs]
+    by_name = {
+        'find_registration_by_phone': [(r[1] or '',) for r in rows],
+        'get_magnet_by_breed': [(r[0], r[2]) for r in rows],
+        'lookup_collection': [(r[1] or '', 0, 0) for r in rows],
+    }
+    return by_name
+
+
+def literal_sql(cur, name, params):
+    sql = re.sub(r'\$(\d+)', lambda m: '%%(p%s)s' % m.group(1), PREPARED[name])
+    return cur.mogrify(sql, {'p%d' % (i + 1): v for i, v in enumerate(params)}).decode()
+
+
+def planning_ms(cur, sql):
+    cur.execute('EXPLAIN (ANALYZE, SUMMARY) ' + sql)
+    for (line,) in cur.fetchall():
+        if line.startswith('Planning Time'):
+            return float(line.split(':')[1].split()[0])
+    return 0.0
+
+
+def bench(cur, name, params_list):
+    adhoc_plan, adhoc_wall, prep_plan, prep_wall = [], [], [], []
+    cur.execute('DEALLOCATE ALL')
+    cur.execute('PREPARE %s AS %s' % (name, PREPARED[name]))
+    for params in params_list:
+        sql = literal_sql(cur, name, params)
+        adhoc_plan.append(planning_ms(cur, sql))
+        started = time.perf_counter()
+        cur.execute(sql)
+        cur.fetchall()
+        adhoc_wall.append((time.perf_counter() - started) * 1000)
+
+        execute = cur.mogrify('EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(params))), params).decode()
+        prep_plan.append(planning_ms(cur, execute))
+        started = time.perf_counter()
+        cur.execute(execute)
+        cur.fetchall()
+        prep_wall.append((time.perf_counter() - started) * 1000)
+    avg = lambda xs: sum(xs) / len(xs)  # noqa: E731
+    return avg(adhoc_plan), avg(adhoc_wall), avg(prep_plan), avg(prep_wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Планирование: литеральный SQL против prepared statements')
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    params = sample_params(cur, args.runs)
+
+    print(f'{"запрос":<28} {"план, мс":>10} {"prep план":>10} {"вызов, мс":>10} {"prep вызов":>10}')
+    for name in READ_QUERIES:
+        a_plan, a_wall, p_plan, p_wall = bench(cur, name, params[name])
+        print(f'{name:<28} {a_plan:>10.3f} {p_plan:>10.3f} {a_wall:>10.3f} {p_wall:>10.3f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
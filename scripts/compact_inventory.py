@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Свёртка журнала движений склада inventory_movements.
+
+Выдачи, возвраты и правки остатков пишутся движениями (V0041), а текущий
+остаток — magnet_inventory.stock плюс несвёрнутые движения (представление
+magnet_inventory_current). Обычно движения сворачивает сам путь записи:
+блокировка породы перед списанием переносит их в stock, когда их набралось
+50 (V0042). Скрипт сворачивает все породы сразу через
+compact_inventory_movements() — например, после массовых возвратов по
+породам, которые давно не выдавались. Остатки в magnet_inventory_current
+от этого не меняются.
+
+С --check ничего не меняется: печатается, сколько движений ждёт свёртки.
+
+Запуск:
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/compact_inventory.py
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/compact_inventory.py --check
+"""
+import argparse
+import os
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'shared'))
+from utils import SCHEMA  # noqa: E402
+
+
+def pending(cur):
+    """[(порода, движений, сумма)] по несвёрнутым движениям."""
+    cur.execute(
+        "SELECT breed, count(*), SUM(delta) FROM %s.inventory_movements WHERE NOT compacted "
+        "GROUP BY breed ORDER BY breed" % SCHEMA
+    )
+    return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Свёртка движений склада в magnet_inventory.stock')
+    parser.add_argument('--check', action='store_true', help='только показать несвёрнутые движения')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    if args.check:
+        rows = pending(cur)
+        for breed, count, delta in rows:
+            print(f'  {breed:<30} {count:>6} движ. {delta:+d}')
+        print(f'Несвёрнутых движений: {sum(r[1] for r in rows)}')
+        conn.close()
+        return
+
+    cur.execute("SELECT breed, delta FROM %s.compact_inventory_movements()" % SCHEMA)
+    rows = cur.fetchall()
+    conn.commit()
+    conn.close()
+    for breed, delta in rows:
+        print(f'  {breed:<30} {delta:+d}')
+    print(f'Свёрнуто пород: {len(rows)}')
+
+
+if __name__ == '__main__':
+    main()
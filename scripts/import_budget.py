@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Бюджет холодного старта: время импорта каждой backend/<fn>/index.py по
+`python -X importtime` плюс OPTIONS-вызов handler'а в том же процессе.
+
+Для каждой функции печатается суммарное время импорта, самые тяжёлые модули
+и тяжёлые зависимости (psycopg2, boto3, requests…), загруженные к моменту
+ответа на OPTIONS. Скрипт завершается с кодом 1, если функция превысила бюджет
+из scripts/import_budget.json или OPTIONS потянул тяжёлый модуль.
+
+Запуск:
+    python3 scripts/import_budget.py
+    python3 scripts/import_budget.py breed-photos admin-auth --runs 5 --top 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BACKEND = os.path.join(ROOT, 'backend')
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_budget.json')
+SKIP = {'shared'}
+MARKER = '--import-budget--'
+
+# Выполняется в отдельном интерпретаторе с cwd = папка функции.
+PROBE = '''
+import json, sys
+sys.stderr.write(%(marker)r + "\\n")
+sys.stderr.flush()
+import index
+response = index.handler({"httpMethod": "OPTIONS", "headers": {}}, None)
+heavy = sorted(m for m in %(heavy)r if m in sys.modules)
+print(json.dumps({"status": response.get("statusCode"), "heavy": heavy}))
+'''
+
+
+def parse_importtime(stderr: str):
+    """Суммарное время (мс) импортов верхнего уровня после маркера и список (модуль, мс) по убыванию."""
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    total_us, modules = 0, []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative = int(parts[1])
+        name = parts[2].rstrip()
+        modules.append((name.strip(), int(parts[0]) / 1000))
+        if not name.startswith('  '):
+            total_us += cumulative
+    modules.sort(key=lambda m: -m[1])
+    return total_us / 1000, modules
+
+
+def measure(folder: str, heavy: list):
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE % {'marker': MARKER, 'heavy': heavy}],
+        cwd=folder, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = [line for line in proc.stderr.splitlines() if not line.startswith('import time:')]
+        return None, (tail[-1] if tail else 'код %d' % proc.returncode)
+    total_ms, modules = parse_importtime(proc.stderr)
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {'ms': total_ms, 'modules': modules, 'heavy': probe['heavy'], 'status': probe['status']}, None
+
+
+def discover(names):
+    found = []
+    for name in sorted(os.listdir(BACKEND)):
+        if name in SKIP or not os.path.exists(os.path.join(BACKEND, name, 'index.py')):
+            continue
+        if names and name not in names:
+            continue
+        found.append(name)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время импорта backend-функций против бюджета холодного старта')
+    parser.add_argument('functions', nargs='*', help='имена функций (по умолчанию все)')
+    parser.add_argument('--runs', type=int, default=3, help='замеров на функцию, берётся лучший')
+    parser.add_argument('--top', type=int, default=5, help='сколько самых тяжёлых модулей показать')
+    parser.add_argument('--config', default=CONFIG, help='JSON с бюджетами')
+    args = parser.parse_args()
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+    heavy = config.get('heavy_modules', [])
+
+    failed = 0
+    for name in discover(args.functions):
+        budget = config.get('functions', {}).get(name, config['default_ms'])
+        best, error = None, None
+        for _ in range(max(1, args.runs)):
+            result, error = measure(os.path.join(BACKEND, name), heavy)
+            if error:
+                break
+            if best is None or result['ms'] < best['ms']:
+                best = result
+        if error:
+            failed += 1
+            print(f'❌ {name}: {error}')
+            continue
+
+        problems = []
+        if best['ms'] > budget:
+            problems.append(f'бюджет {budget} мс превышен')
+        if best['heavy']:
+            problems.append('OPTIONS загрузил ' + ', '.join(best['heavy']))
+        failed += bool(problems)
+        mark = '❌' if problems else '✅'
+        print(f'{mark} {name}: {best["ms"]:.1f} мс (бюджет {budget} мс)' + (' — ' + '; '.join(problems) if problems else ''))
+        for module, ms in best['modules'][:args.top]:
+            print(f'     {ms:>7.2f} мс  {module}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Сверка и пересборка registration_summary.
+
+Сводку ведут триггеры на client_magnets и orders (V0039). Скрипт сравнивает
+таблицу с эталонными агрегатами registration_summary_source и печатает
+расхождения: лишние строки, недостающие и строки с другими значениями.
+Участник без магнитов и заказов строки не имеет — читатели берут нули.
+
+Без флагов расходящиеся строки пересчитываются через
+refresh_registration_summary (под той же блокировкой участников, что и в
+триггерах), лишние — удаляются. С --check ничего не меняется, а при
+расхождениях скрипт завершается с кодом 1 — так его можно ставить в cron.
+
+Запуск:
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/rebuild_registration_summary.py --check
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/rebuild_registration_summary.py
+"""
+import argparse
+import os
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'shared'))
+from utils import SCHEMA  # noqa: E402
+
+COLUMNS = (
+    'magnets', 'star1', 'star2', 'star3', 'unique_breeds', 'collection_value',
+    'revealed_magnets', 'xp', 'orders_count', 'orders_total', 'channels',
+)
+
+
+def find_drift(cur):
+    """[(registration_id, 'missing' | 'stale' | 'extra', [колонки с расхождением])]."""
+    differs = ' OR '.join('t.%s IS DISTINCT FROM s.%s' % (c, c) for c in COLUMNS)
+    flags = ', '.join('t.%s IS DISTINCT FROM s.%s' % (c, c) for c in COLUMNS)
+    cur.execute(
+        "SELECT COALESCE(s.registration_id, t.registration_id), s.registration_id IS NULL, "
+        "t.registration_id IS NULL, %s "
+        "FROM %s.registration_summary_source s "
+        "FULL JOIN %s.registration_summary t ON t.registration_id = s.registration_id "
+        "WHERE s.registration_id IS NULL "
+        "OR (t.registration_id IS NULL AND (s.magnets > 0 OR s.orders_count > 0)) "
+        "OR (t.registration_id IS NOT NULL AND (%s)) "
+        "ORDER BY 1" % (flags, SCHEMA, SCHEMA, differs)
+    )
+    drift = []
+    for row in cur.fetchall():
+        kind = 'extra' if row[1] else 'missing' if row[2] else 'stale'
+        drift.append((row[0], kind, [c for c, bad in zip(COLUMNS, row[3:]) if bad]))
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка registration_summary с client_magnets и orders')
+    parser.add_argument('--check', action='store_true', help='только показать расхождения, код 1 если они есть')
+    parser.add_argument('--show', type=int, default=20, help='сколько расхождений напечатать')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    drift = find_drift(cur)
+    for reg_id, kind, columns in drift[:args.show]:
+        print(f'  {reg_id:>8}  {kind:<8} {", ".join(columns)}')
+    if len(drift) > args.show:
+        print(f'  … ещё {len(drift) - args.show}')
+    print(f'Расхождений: {len(drift)}')
+
+    if args.check or not drift:
+        conn.close()
+        sys.exit(1 if drift and args.check else 0)
+
+    extra = [reg_id for reg_id, kind, _ in drift if kind == 'extra']
+    refresh = [reg_id for reg_id, kind, _ in drift if kind != 'extra']
+    if extra:
+        cur.execute("DELETE FROM %s.registration_summary WHERE registration_id = ANY(%%s)" % SCHEMA, (extra,))
+    if refresh:
+        cur.execute("SELECT %s.refresh_registration_summary(%%s::integer[])" % SCHEMA, (refresh,))
+    conn.commit()
+    left = len(find_drift(cur))
+    conn.close()
+    print(f'Пересчитано: {len(refresh)}, удалено: {len(extra)}, осталось расхождений: {left}')
+    sys.exit(1 if left else 0)
+
+
+if __name__ == '__main__':
+    main()
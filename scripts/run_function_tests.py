@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Локальный прогон tests.json всех backend-функций и замер задержек.
+
+Каждая функция импортируется изолированно (свои index.py, utils.py, repository.py,
+service.py), handler вызывается с событием, собранным из теста, против локального
+Postgres из DATABASE_URL. Для каждого теста печатается pass/fail, p50/p95 задержки
+и число SQL-запросов за вызов. Тест с "maxQueries": N падает, если вызов сделал
+больше N запросов, — так фиксируется число round-trip'ов горячих путей.
+Тест с "managerSession": true идёт с X-Session-Id служебной сессии менеджера
+(создаётся для первого активного admin_users), "isBase64Encoded": true — с телом в base64.
+
+Запуск:
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/run_function_tests.py
+    python3 scripts/run_function_tests.py --setup-db                  # накатить db_migrations/
+    python3 scripts/run_function_tests.py lookup-magnets scan-magnet --repeat 50 --json bench.json
+    python3 scripts/run_function_tests.py --repeat 50 --compare bench.json
+"""
+import argparse
+import base64
+import contextlib
+import gzip
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BACKEND = os.path.join(ROOT, 'backend')
+MIGRATIONS = os.path.join(ROOT, 'db_migrations')
+SCHEMA = 't_p65563100_joywood_magnets_app'
+
+SKIP = {'shared'}
+LOCAL_MODULES = ('index', 'utils', 'repository', 'service')
+EXTERNAL_REQUIREMENTS = ('boto3', 'requests')
+# Служебная сессия менеджера для тестов с "managerSession": true.
+MANAGER_SESSION = 'run-function-tests'
+# В partial-режиме строка-имя типа в expectedBody совпадает с любым значением этого типа.
+TYPE_PLACEHOLDERS = {'string': str, 'number': (int, float), 'boolean': bool, 'array': list, 'object': dict}
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, считающий выполненные запросы текущего вызова."""
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        CountingCursor.statements += 1
+        return super().executemany(query, vars_list)
+
+
+_original_connect = psycopg2.connect
+
+
+def _counting_connect(*args, **kwargs):
+    kwargs.setdefault('cursor_factory', CountingCursor)
+    return _original_connect(*args, **kwargs)
+
+
+def setup_db(dsn):
+    """Пересоздаёт схему и накатывает db_migrations/ по порядку. Сиды с чужими данными пропускаются."""
+    conn = _original_connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS %s CASCADE' % SCHEMA)
+    cur.execute('CREATE SCHEMA %s' % SCHEMA)
+    cur.execute('SET search_path TO %s' % SCHEMA)
+    for name in sorted(os.listdir(MIGRATIONS)):
+        if not name.endswith('.sql'):
+            continue
+        with open(os.path.join(MIGRATIONS, name), encoding='utf-8') as f:
+            sql = f.read()
+        try:
+            cur.execute('BEGIN')
+            cur.execute(sql)
+            cur.execute('COMMIT')
+        except psycopg2.Error as e:
+            cur.execute('ROLLBACK')
+            print(f'   ⚠️  {name}: {str(e).splitlines()[0]}')
+    conn.close()
+    print('✅ схема пересоздана из db_migrations/')
+
+
+def ensure_manager_session():
+    """Сессия MANAGER_SESSION первого активного менеджера, действующая ещё час."""
+    conn = _original_connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO %s.admin_sessions (id, user_id, expires_at, user_agent) "
+        "SELECT %%s, id, now() + interval '1 hour', 'run_function_tests' FROM %s.admin_users "
+        "WHERE is_active ORDER BY id LIMIT 1 "
+        "ON CONFLICT (id) DO UPDATE SET expires_at = EXCLUDED.expires_at, revoked = false" % (SCHEMA, SCHEMA),
+        (MANAGER_SESSION,)
+    )
+    conn.commit()
+    conn.close()
+
+
+def build_event(test):
+    parts = urlsplit(test.get('path') or '/')
+    headers = {'Content-Type': 'application/json', **(test.get('headers') or {})}
+    if test.get('managerSession'):
+        headers['X-Session-Id'] = MANAGER_SESSION
+    event = {
+        'httpMethod': test.get('method', 'GET'),
+        'path': parts.path or '/',
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(parts.query)) or None,
+        'requestContext': {'identity': {'sourceIp': '127.0.0.1', 'userAgent': 'run_function_tests'}},
+        'isBase64Encoded': bool(test.get('isBase64Encoded')),
+    }
+    if 'body' in test:
+        body = test['body']
+        event['body'] = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+    return event
+
+
+def body_matches(expected, actual, partial):
+    if not partial:
+        return expected == actual
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(
+            k in actual and body_matches(v, actual[k], True) for k, v in expected.items()
+        )
+    if isinstance(expected, list):
+        return isinstance(actual, list) and len(expected) == len(actual) and all(
+            body_matches(e, a, True) for e, a in zip(expected, actual)
+        )
+    if isinstance(expected, str) and expected in TYPE_PLACEHOLDERS and expected != actual:
+        return isinstance(actual, TYPE_PLACEHOLDERS[expected])
+    return expected == actual
+
+
+def response_body(response):
+    """Тело ответа как текст: base64 и Content-Encoding (gzip/br) из utils.ok() снимаются."""
+    body = response.get('body') or ''
+    if not response.get('isBase64Encoded'):
+        return body
+    raw = base64.b64decode(body)
+    encoding = (response.get('headers') or {}).get('Content-Encoding')
+    if encoding == 'gzip':
+        raw = gzip.decompress(raw)
+    elif encoding == 'br':
+        import brotli
+        raw = brotli.decompress(raw)
+    return raw.decode('utf-8')
+
+
+def check(test, response):
+    status = response.get('statusCode')
+    if status != test.get('expectedStatus', 200):
+        return f'статус {status}, ожидался {test.get("expectedStatus", 200)}'
+    if 'expectedBody' in test:
+        try:
+            actual = json.loads(response_body(response) or 'null')
+        except ValueError:
+            return 'тело ответа не JSON'
+        if not body_matches(test['expectedBody'], actual, test.get('bodyMatcher') == 'partial'):
+            return 'тело ответа не совпадает с expectedBody'
+    return None
+
+
+def check_queries(test, statements):
+    limit = test.get('maxQueries')
+    if limit is not None and statements > limit:
+        return f'{statements} SQL-запросов, допустимо не больше {limit}'
+    return None
+
+
+def load_handler(folder):
+    for name in LOCAL_MODULES:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, folder)
+    try:
+        return importlib.import_module('index').handler, sys.modules.get('utils')
+    finally:
+        sys.path.remove(folder)
+
+
+def last_trace(utils_mod):
+    return utils_mod.last_trace() if utils_mod is not None and hasattr(utils_mod, 'last_trace') else None
+
+
+def invoke(handler, event, show_logs):
+    if show_logs:
+        return handler(event, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handler(event, None)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run_function(name, repeat, show_logs=False):
+    folder = os.path.join(BACKEND, name)
+    with open(os.path.join(folder, 'tests.json'), encoding='utf-8') as f:
+        tests = json.load(f).get('tests', [])
+    try:
+        handler, utils_mod = load_handler(folder)
+    except Exception as e:
+        return [{'name': t.get('name', ''), 'passed': False, 'error': f'импорт: {e}'} for t in tests]
+    if any(t.get('managerSession') for t in tests):
+        ensure_manager_session()
+
+    results = []
+    for test in tests:
+        latencies, error, statements = [], None, 0
+        for _ in range(repeat):
+            CountingCursor.statements = 0
+            before = last_trace(utils_mod)
+            started = time.perf_counter()
+            try:
+                response = invoke(handler, build_event(test), show_logs)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                break
+            latencies.append((time.perf_counter() - started) * 1000)
+            trace = last_trace(utils_mod)
+            # Инструментированные функции считают запросы сами (utils.instrumented).
+            statements = len(trace['queries']) if trace is not None and trace is not before else CountingCursor.statements
+            error = error or check(test, response) or check_queries(test, statements)
+        result = {'name': test.get('name', ''), 'passed': error is None, 'queries': statements}
+        if latencies:
+            result['p50_ms'] = round(statistics.median(latencies), 3)
+            result['p95_ms'] = round(percentile(latencies, 95), 3)
+        if error:
+            result['error'] = error
+        results.append(result)
+    return results
+
+
+def discover(names, skip_external):
+    found = []
+    for name in sorted(os.listdir(BACKEND)):
+        folder = os.path.join(BACKEND, name)
+        if name in SKIP or not os.path.exists(os.path.join(folder, 'tests.json')):
+            continue
+        if names and name not in names:
+            continue
+        if skip_external and not names:
+            req_path = os.path.join(folder, 'requirements.txt')
+            reqs = open(req_path, encoding='utf-8').read() if os.path.exists(req_path) else ''
+            if any(r in reqs for r in EXTERNAL_REQUIREMENTS):
+                continue
+        found.append(name)
+    return found
+
+
+def print_report(report, baseline):
+    failed = 0
+    for fn, results in report.items():
+        print(f'\n{fn}')
+        for r in results:
+            failed += not r['passed']
+            mark = '✅' if r['passed'] else '❌'
+            line = f'  {mark} {r["name"]}'
+            if 'p50_ms' in r:
+                line += f'  p50={r["p50_ms"]:.2f}ms p95={r["p95_ms"]:.2f}ms sql={r["queries"]}'
+            base = next((b for b in (baseline or {}).get(fn, []) if b['name'] == r['name']), None)
+            if base and 'p50_ms' in base and 'p50_ms' in r and base['p50_ms']:
+                delta = (r['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100
+                line += f'  Δp50={delta:+.0f}% Δsql={r["queries"] - base.get("queries", 0):+d}'
+            if r.get('error'):
+                line += f'  — {r["error"]}'
+            print(line)
+    total = sum(len(v) for v in report.values())
+    print(f'\nИтого: {total - failed}/{total} тестов прошли')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Прогон tests.json backend-функций против локального Postgres')
+    parser.add_argument('functions', nargs='*', help='имена функций (по умолчанию все)')
+    parser.add_argument('--repeat', type=int, default=1, help='повторов каждого теста для замера задержки')
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    parser.add_argument('--compare', help='JSON-файл прошлого прогона для сравнения p50 и числа запросов')
+    parser.add_argument('--setup-db', action='store_true', help='пересоздать схему из db_migrations/')
+    parser.add_argument('--skip-external', action='store_true', help='пропустить функции с boto3/requests')
+    parser.add_argument('--show-logs', action='store_true', help='не глушить вывод handler\'ов (строки трассировки)')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('Укажите DATABASE_URL локального Postgres')
+    if args.setup_db:
+        setup_db(dsn)
+
+    psycopg2.connect = _counting_connect
+    report = {name: run_function(name, max(1, args.repeat), args.show_logs) for name in discover(args.functions, args.skip_external)}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    failed = print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
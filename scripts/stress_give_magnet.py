@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Нагрузочная проверка выдачи магнитов give-magnet на пересортицу склада.
+
+Создаёт временную породу с остатком --stock и --clients временных участников,
+затем --threads потоков одновременно выдают эту породу всем участникам через
+service.give_magnet. После прогона сверяется: выдано ровно столько, сколько
+было на складе, остаток 0, у каждого участника не больше одного магнита этой
+породы. Второй прогон — все потоки выдают породу одному участнику: успешной
+должна быть ровно одна выдача. Печатается пропускная способность (выдач и
+отказов в секунду). Временные данные удаляются в конце.
+
+Третий прогон — Падук для новых клиентов (add-client-manager give_paduk):
+потоки одновременно оформляют первые заказы --clients участникам при остатке
+Падука --stock. Списаний должно быть ровно min(stock, clients), остаток не
+уходит в минус, магнит получает каждый. Остаток Падука после прогона
+возвращается к прежнему.
+
+В конце — сверка свёртки журнала: остаток в magnet_inventory_current не
+меняется ни при свёртке на пути записи (lock_inventory_breeds), ни при
+compact_inventory_movements(), а несвёрнутых движений не остаётся.
+
+С --legacy тот же прогон делается прежней последовательностью запросов
+(проверка остатка без блокировки, вставка, движение -1) — для сравнения.
+
+Запуск:
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/stress_give_magnet.py
+    DATABASE_URL=postgresql://localhost/joywood python3 scripts/stress_give_magnet.py --stock 50 --clients 400 --threads 16 --legacy
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'give-magnet'))
+import service  # noqa: E402
+from utils import SCHEMA, db  # noqa: E402
+
+BREED = 'Стресс-тест'
+PADUK = 'Падук'
+
+# repository.py add-client-manager под своим именем: модуль repository уже занят give-magnet.
+_spec = importlib.util.spec_from_file_location(
+    'client_repository',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'add-client-manager', 'repository.py'),
+)
+client_repo = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(client_repo)
+
+
+def legacy_give(cur, conn, registration_id, breed, stars, category, actor=None):
+    """Прежняя выдача: отдельные запросы без блокировок."""
+    cur.execute("SELECT id, phone FROM %s.registrations WHERE id = %%s" % SCHEMA, (registration_id,))
+    reg = cur.fetchone()
+    cur.execute("SELECT id FROM %s.client_magnets WHERE registration_id = %%s AND breed = %%s" % SCHEMA,
+                (registration_id, breed))
+    if cur.fetchone():
+        raise service.MagnetError('уже есть', 409)
+    cur.execute("SELECT stock, active FROM %s.magnet_inventory_current WHERE breed = %%s" % SCHEMA, (breed,))
+    if cur.fetchone()[0] <= 0:
+        raise service.MagnetError('закончился')
+    cur.execute(
+        "INSERT INTO %s.client_magnets (registration_id, phone, breed, stars, category, status) "
+        "VALUES (%%s, %%s, %%s, %%s, %%s, 'in_transit') RETURNING id" % SCHEMA,
+        (registration_id, reg[1], breed, stars, category))
+    cur.execute("INSERT INTO %s.inventory_movements (breed, delta, reason) VALUES (%%s, -1, 'give')" % SCHEMA, (breed,))
+    conn.commit()
+
+
+def setup(cur, stock, clients):
+    cur.execute(
+        "INSERT INTO %s.magnet_inventory (breed, stars, category, stock) VALUES (%%s, 1, 'Обычный', %%s) "
+        "ON CONFLICT (breed) DO UPDATE SET stock = EXCLUDED.stock, active = true" % SCHEMA, (BREED, stock))
+    cur.execute(
+        "INSERT INTO %s.registrations (name, phone, channel) "
+        "SELECT 'Стресс ' || g, '', 'stress' FROM generate_series(1, %%s) g RETURNING id" % SCHEMA, (clients,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def reset_stock(cur, stock):
+    cur.execute("DELETE FROM %s.inventory_movements WHERE breed = %%s" % SCHEMA, (BREED,))
+    cur.execute("UPDATE %s.magnet_inventory SET stock = %%s WHERE breed = %%s" % SCHEMA, (stock, BREED))
+
+
+def cleanup(cur, ids):
+    cur.execute("DELETE FROM %s.inventory_movements WHERE breed = %%s" % SCHEMA, (BREED,))
+    cur.execute("DELETE FROM %s.client_magnets WHERE breed = %%s" % SCHEMA, (BREED,))
+    cur.execute("DELETE FROM %s.registrations WHERE id = ANY(%%s)" % SCHEMA, (ids,))
+    cur.execute("DELETE FROM %s.magnet_inventory WHERE breed = %%s" % SCHEMA, (BREED,))
+
+
+def hammer(give, targets, threads):
+    """Раздаёт targets потокам; возвращает (выдано, отказов, ошибок, секунд)."""
+    counts = {'given': 0, 'refused': 0, 'errors': 0}
+    lock = threading.Lock()
+    queue = list(targets)
+    start = threading.Barrier(threads)
+
+    def worker():
+        start.wait()
+        while True:
+            with lock:
+                if not queue:
+                    return
+                reg_id = queue.pop()
+            with db() as conn:
+                try:
+                    give(conn.cursor(), conn, reg_id, BREED, 1, 'Обычный', 'stress')
+                    key = 'given'
+                except service.MagnetError:
+                    key = 'refused'
+                except psycopg2.Error:
+                    key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return counts['given'], counts['refused'], counts['errors'], time.perf_counter() - started
+
+
+def verify(cur):
+    """(остаток, магнитов породы в БД, различных владельцев)."""
+    cur.execute("SELECT stock FROM %s.magnet_inventory_current WHERE breed = %%s" % SCHEMA, (BREED,))
+    left = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*), COUNT(DISTINCT registration_id) FROM %s.client_magnets WHERE breed = %%s" % SCHEMA,
+                (BREED,))
+    return (left, *cur.fetchone())
+
+
+def run(name, give, args):
+    problems = []
+    with db() as conn:
+        cur = conn.cursor()
+        ids = setup(cur, args.stock, args.clients)
+        reset_stock(cur, args.stock)
+        conn.commit()
+        try:
+            given, refused, errors, seconds = hammer(give, ids, args.threads)
+            left, rows, owners = verify(cur)
+            oversold = max(rows - args.stock, 0)
+            conn.commit()
+            print(f'{name}: {args.clients} участников, склад {args.stock}, потоков {args.threads}')
+            print(f'  выдано {given}, отказов {refused}, ошибок {errors} за {seconds:.2f} с '
+                  f'({(given + refused) / seconds:.0f} запросов/с)')
+            print(f'  магнитов в БД {rows}, остаток {left}, пересорт {oversold}')
+            if oversold or owners != rows or left != args.stock - rows or errors:
+                problems.append('пересорт или расхождение склада')
+
+            reset_stock(cur, args.stock)
+            cur.execute("DELETE FROM %s.client_magnets WHERE breed = %%s" % SCHEMA, (BREED,))
+            conn.commit()
+            given, refused, errors, seconds = hammer(give, [ids[0]] * args.threads * 4, args.threads)
+            left, rows, owners = verify(cur)
+            conn.commit()
+            print(f'  один участник, {args.threads * 4} выдач: успешных {given}, магнитов в БД {rows}, '
+                  f'остаток {left}')
+            if rows != 1 or left != args.stock - 1:
+                problems.append('дубль породы у одного участника')
+        finally:
+            cleanup(cur, ids)
+            conn.commit()
+    for problem in problems:
+        print(f'  ❌ {problem}')
+    if not problems:
+        print('  ✅ без пересорта')
+    return not problems
+
+
+def paduk_stock(cur):
+    cur.execute("SELECT stock FROM %s.magnet_inventory_current WHERE breed = %%s" % SCHEMA, (PADUK,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_paduk_stock(cur, stock):
+    """Остаток Падука через движение 'set', как PUT склада."""
+    delta = stock - paduk_stock(cur)
+    if delta:
+        cur.execute(
+            "INSERT INTO %s.inventory_movements (breed, delta, reason, actor) VALUES (%%s, %%s, 'set', 'stress')"
+            % SCHEMA, (PADUK, delta))
+
+
+def run_paduk(args):
+    with db() as conn:
+        cur = conn.cursor()
+        original = paduk_stock(cur)
+        if original is None:
+            cur.execute("INSERT INTO %s.magnet_inventory (breed, stars, category, stock) "
+                        "VALUES (%%s, 2, 'Особенный', 0)" % SCHEMA, (PADUK,))
+        ids = setup(cur, 0, args.clients)
+        cur.execute(
+            "INSERT INTO %s.orders (registration_id, amount, channel) SELECT id, 0, 'stress' FROM unnest(%%s) AS id "
+            "RETURNING registration_id, id" % SCHEMA, (ids,))
+        orders = dict(cur.fetchall())
+        set_paduk_stock(cur, args.stock)
+        conn.commit()
+
+        def give(cur, conn, reg_id, *_):
+            client_repo.give_paduk(cur, reg_id, '', orders[reg_id])
+            conn.commit()
+
+        try:
+            given, _, errors, seconds = hammer(give, ids, args.threads)
+            left = paduk_stock(cur)
+            cur.execute(
+                "SELECT (SELECT count(*) FROM %s.inventory_movements WHERE reason = 'paduk' AND registration_id = ANY(%%s)),"
+                " (SELECT count(*) FROM %s.client_magnets WHERE breed = %%s AND registration_id = ANY(%%s))"
+                % (SCHEMA, SCHEMA), (ids, PADUK, ids))
+            taken, magnets = cur.fetchone()
+            conn.commit()
+            expected = min(args.stock, args.clients)
+            print(f'Падук новым клиентам: {args.clients} заказов, остаток {args.stock}, потоков {args.threads}')
+            print(f'  за {seconds:.2f} с: магнитов {magnets}, списаний {taken}, остаток {left}, ошибок {errors}')
+            ok = taken == expected and left == args.stock - expected and magnets == args.clients and not errors
+        finally:
+            cur.execute("DELETE FROM %s.inventory_movements WHERE registration_id = ANY(%%s) AND NOT compacted"
+                        % SCHEMA, (ids,))
+            cur.execute("DELETE FROM %s.client_magnets WHERE registration_id = ANY(%%s)" % SCHEMA, (ids,))
+            cur.execute("DELETE FROM %s.orders WHERE registration_id = ANY(%%s)" % SCHEMA, (ids,))
+            cur.execute("DELETE FROM %s.registrations WHERE id = ANY(%%s)" % SCHEMA, (ids,))
+            if original is None:
+                cur.execute("DELETE FROM %s.inventory_movements WHERE breed = %%s" % SCHEMA, (PADUK,))
+                cur.execute("DELETE FROM %s.magnet_inventory WHERE breed = %%s" % SCHEMA, (PADUK,))
+            else:
+                set_paduk_stock(cur, original)
+            conn.commit()
+    print('  ✅ без ухода в минус' if ok else '  ❌ списаний больше остатка или расхождение склада')
+    return ok
+
+
+def check_compaction(cur, conn):
+    """Остаток породы до и после свёртки; True — совпал и несвёрнутых движений нет там, где их не должно быть."""
+    def state():
+        cur.execute(
+            "SELECT (SELECT stock FROM %s.magnet_inventory_current WHERE breed = %%s),"
+            " (SELECT count(*) FROM %s.inventory_movements WHERE breed = %%s AND NOT compacted)"
+            % (SCHEMA, SCHEMA), (BREED, BREED))
+        return cur.fetchone()
+
+    def add(n):
+        cur.execute(
+            "INSERT INTO %s.inventory_movements (breed, delta, reason, actor) "
+            "SELECT %%s, 1, 'set', 'stress' FROM generate_series(1, %%s)" % SCHEMA, (BREED, n))
+
+    setup(cur, 10, 0)
+    reset_stock(cur, 10)
+    ok = True
+    add(12)
+    cur.execute("SELECT %s.lock_inventory_breeds(ARRAY[%%s], 10)" % SCHEMA, (BREED,))
+    ok &= state() == (22, 0)
+    add(3)
+    cur.execute("SELECT %s.lock_inventory_breeds(ARRAY[%%s], 10)" % SCHEMA, (BREED,))
+    ok &= state() == (25, 3)
+    cur.execute("SELECT %s.compact_inventory_movements()" % SCHEMA)
+    ok &= state() == (25, 0)
+    cur.execute("SELECT stock FROM %s.magnet_inventory WHERE breed = %%s" % SCHEMA, (BREED,))
+    ok &= cur.fetchone()[0] == 25
+    conn.rollback()
+    print('Свёртка журнала: ' + ('✅ остаток не меняется' if ok else '❌ остаток после свёртки другой'))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Параллельная выдача магнитов: проверка на пересорт склада')
+    parser.add_argument('--stock', type=int, default=25)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--legacy', action='store_true', help='прогнать и прежнюю выдачу для сравнения')
+    args = parser.parse_args()
+
+    passed = run('give_magnet', service.give_magnet, args)
+    passed = run_paduk(args) and passed
+    with db() as conn:
+        passed = check_compaction(conn.cursor(), conn) and passed
+    if args.legacy:
+        run('прежняя выдача', legacy_give, args)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import { useState, useCallback, useEffect } from "react";
+import { useState, useCallback, useEffect, useRef } from "react";
 import { API_URLS } from "@/lib/api";
 
 export interface InventoryItem {
@@ -24,12 +24,43 @@ interface UseInventoryResult {
 export function useInventory(): UseInventoryResult {
   const [inventory, setInventory] = useState<InventoryMap>({});
   const [loading, setLoading] = useState(true);
+  // Отметка склада из последнего ответа: повторные загрузки берут только строки, изменённые после неё.
+  const versionRef = useRef<number | null>(null);
+  // Счётчик локальных правок остатков: после правки дельта с сервера её не перезапишет,
+  // поэтому следующая загрузка — полная.
+  const editsRef = useRef(0);
+
+  const markEdited = useCallback(() => {
+    editsRef.current += 1;
+    versionRef.current = null;
+  }, []);
 
   const reload = useCallback(() => {
     setLoading(true);
-    fetch(`${API_URLS.GIVE_MAGNET}?action=inventory`)
+    const since = versionRef.current;
+    const edits = editsRef.current;
+    const url = `${API_URLS.GIVE_MAGNET}?action=inventory` + (since !== null ? `&since=${since}` : "");
+    fetch(url)
       .then((r) => r.json())
-      .then((data) => setInventory(data.inventory || {}))
+      .then((data) => {
+        const rows: InventoryMap = data.inventory || {};
+        // Правка во время запроса: ответ её не учитывает, отметке из него верить нельзя.
+        const fresh = editsRef.current === edits;
+        versionRef.current = fresh && typeof data.version === "number" ? data.version : null;
+        // full — отметка устарела, сервер прислал склад целиком.
+        if (since === null || data.full) {
+          setInventory(rows);
+          return;
+        }
+        setInventory((prev) => {
+          const next = { ...prev, ...rows };
+          // Породы удалили из склада — дельта этого не покажет, нужна полная загрузка.
+          if (typeof data.total === "number" && Object.keys(next).length !== data.total) {
+            versionRef.current = null;
+          }
+          return next;
+        });
+      })
       .catch(() => {})
       .finally(() => setLoading(false));
   }, []);
@@ -41,6 +72,7 @@ export function useInventory(): UseInventoryResult {
   );
 
   const setStockForBreed = useCallback((breed: string, stock?: number, active?: boolean) => {
+    markEdited();
     setInventory((prev) => ({
       ...prev,
       [breed]: {
@@ -49,21 +81,23 @@ export function useInventory(): UseInventoryResult {
         ...(active !== undefined ? { active } : {}),
       },
     }));
-  }, []);
+  }, [markEdited]);
 
   const decrementStock = useCallback((breed: string) => {
+    markEdited();
     setInventory((prev) => ({
       ...prev,
       [breed]: { ...prev[breed], stock: Math.max((prev[breed]?.stock ?? 1) - 1, 0) },
     }));
-  }, []);
+  }, [markEdited]);
 
   const incrementStock = useCallback((breed: string) => {
+    markEdited();
     setInventory((prev) => ({
       ...prev,
       [breed]: { ...prev[breed], stock: (prev[breed]?.stock ?? 0) + 1 },
     }));
-  }, []);
+  }, [markEdited]);
 
   return { inventory, stockMap, loading, reload, setStockForBreed, decrementStock, incrementStock };
 }